@@ -0,0 +1,94 @@
+"""
+Benchmark: in-flight gateway calls, sync session vs. async client
+Run with: python benchmarks/bench_async_gateway.py [calls] [latency_ms]
+
+Points both gateways at a local HTTP server that answers every request after
+a fixed delay. That stands in for a slow gateway. A sync worker waits out
+each call in turn. The async gateway keeps them all in flight on one event
+loop.
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import django
+
+# Setup Django
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dealnest.settings')
+django.setup()
+
+from payments.services import AsyncPaystackGateway, PaystackGateway
+from payments.transport import aclose_clients
+
+
+def start_server(latency):
+    body = json.dumps({'status': True, 'data': {'status': 'success'}}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            threading.Event().wait(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 1024
+
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+async def run_async(calls):
+    gateway = AsyncPaystackGateway(public_key='pk', secret_key='sk')
+    results = await asyncio.gather(*(gateway.verify_payment(f'ref-{i}') for i in range(calls)))
+    await aclose_clients(asyncio.get_running_loop())
+    return results
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 200) / 1000
+    server, url = start_server(latency)
+    PaystackGateway.BASE_URL = url
+
+    try:
+        sync_calls = max(1, min(calls, int(2 / latency)))
+        gateway = PaystackGateway(public_key='pk', secret_key='sk')
+        start = time.perf_counter()
+        for i in range(sync_calls):
+            assert gateway.verify_payment(f'ref-{i}')['status']
+        sync_rate = sync_calls / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        results = asyncio.run(run_async(calls))
+        elapsed = time.perf_counter() - start
+        assert all(result['status'] for result in results)
+        async_rate = calls / elapsed
+
+        print('=' * 64)
+        print(f"verify_payment against a gateway answering in {latency * 1000:.0f} ms")
+        print('=' * 64)
+        print(f"{'sync, one worker':<28} {sync_rate:10,.1f} calls/s  ({sync_calls} calls)")
+        print(f"{'async, one event loop':<28} {async_rate:10,.1f} calls/s  ({calls} calls, {elapsed:.2f}s)")
+        print('-' * 64)
+        print(f"Throughput per process: {async_rate / sync_rate:5.1f}x")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark: POST /api/deals/bulk/ vs. one POST /api/deals/ per deal
+Run with: python benchmarks/bench_bulk_deals.py [count]
+
+Runs against a throwaway test database.
+"""
+import os
+import sys
+import time
+
+import django
+
+# Setup Django
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dealnest.settings')
+django.setup()
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+
+
+def timed(label, func, count):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed:8.3f}s  {count / elapsed:10,.0f} deals/s")
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    # The per-user daily throttle would stop the single-POST run part way
+    APIView.throttle_classes = []
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        from core.models import User, PlatformSettings, JobType
+        from deals.models import Deal
+
+        PlatformSettings.objects.create()
+        user = User.objects.create_user(username='bench-agency', email='bench@example.com')
+        job_type = JobType.objects.create(name='Design', slug='design')
+        api = APIClient()
+        api.force_authenticate(user)
+        payload = [
+            {'title': f'Deal {i}', 'description': 'Benchmark deal', 'amount': '15000.00', 'job_type_id': job_type.id}
+            for i in range(count)
+        ]
+
+        def single():
+            for item in payload:
+                assert api.post('/api/deals/', item, format='json').status_code == 201
+
+        def bulk():
+            response = api.post('/api/deals/bulk/', payload, format='json')
+            assert response.status_code == 201, response.content[:300]
+
+        print('=' * 60)
+        print(f"Creating {count:,} deals")
+        print('=' * 60)
+        single_time = timed('one POST per deal', single, count)
+        bulk_time = timed('one bulk POST', bulk, count)
+        print('-' * 60)
+        print(f"Speed-up: {single_time / bulk_time:6.1f}x  ({Deal.objects.count():,} deals created)")
+    finally:
+        runner.teardown_databases(old_config)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark: response size and CPU of GET /api/deals/, compact vs. fully expanded
+Run with: python benchmarks/bench_deal_list_payload.py [page_size]
+
+Runs against a throwaway test database.
+"""
+import os
+import sys
+import time
+
+import django
+
+# Setup Django
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dealnest.settings')
+django.setup()
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.views import APIView
+
+REPEAT = 50
+FULL = 'client,freelancer,job_type_details,submissions,fee_breakdown,description,milestones,attachments,' \
+       'requirements,deadline,revision_count,updated_at,dispute_window_expires'
+
+
+def cpu_ms(func):
+    start = time.process_time()
+    for _ in range(REPEAT):
+        func()
+    return (time.process_time() - start) / REPEAT * 1000
+
+
+def measure(api, user, url):
+    """Response bytes, CPU for the whole request and CPU for serializing plus rendering alone."""
+    from core.cache import get_platform_settings
+    from deals.serializers import DealListSerializer
+
+    response = api.get(url)
+    assert response.status_code == 200, response.content[:300]
+    request_ms = cpu_ms(lambda: api.get(url))
+
+    request = Request(APIRequestFactory().get(url))
+    request.user = user
+    context = {'request': request, 'platform_settings': get_platform_settings()}
+    field_names = DealListSerializer(context=context).readable_field_names
+    page = list(DealListSerializer.setup_eager_loading(user.deals_as_client.order_by('-created_at'), field_names))
+    serialize_ms = cpu_ms(lambda: JSONRenderer().render(DealListSerializer(page, many=True, context=context).data))
+    return len(response.content), request_ms, serialize_ms
+
+
+def main():
+    page_size = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    APIView.throttle_classes = []
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        from core.models import User, PlatformSettings, JobType
+        from deals.models import Deal, DealSubmission
+
+        PlatformSettings.objects.create()
+        client = User.objects.create_user(username='bench-client', email='client@example.com', first_name='Ada')
+        freelancer = User.objects.create_user(username='bench-maker', email='maker@example.com', bio='x' * 300)
+        job_type = JobType.objects.create(name='Design', slug='design', description='Graphic design work')
+        for i in range(page_size):
+            deal = Deal.objects.create(
+                client=client, freelancer=freelancer, job_type=job_type, title=f'Brand refresh {i}',
+                description='Logo, palette and type system. ' * 20, amount=250000,
+                milestones=[{'title': 'Concepts', 'amount': 100000}, {'title': 'Final', 'amount': 150000}],
+                requirements='Three concepts, two revision rounds.',
+            )
+            for round_ in range(2):
+                DealSubmission.objects.create(
+                    deal=deal, freelancer=freelancer, revision_round=round_,
+                    links=['https://example.com/concepts'], notes='Concepts attached. ' * 10,
+                )
+
+        api = APIClient()
+        api.force_authenticate(client)
+        compact = measure(api, client, f'/api/deals/?page_size={page_size}')
+        full = measure(api, client, f'/api/deals/?page_size={page_size}&expand={FULL}')
+
+        print('=' * 64)
+        print(f"GET /api/deals/ with {page_size} deals (CPU, mean of {REPEAT})")
+        print('=' * 64)
+        print(f"{'':<12} {'bytes':>10} {'request (ms)':>14} {'serialize (ms)':>16}")
+        for label, (size, request_ms, serialize_ms) in (('expanded', full), ('compact', compact)):
+            print(f"{label:<12} {size:>10,} {request_ms:>14.2f} {serialize_ms:>16.2f}")
+        print('-' * 64)
+        print(f"{'reduction':<12} {full[0] / compact[0]:>9.1f}x {full[1] / compact[1]:>13.1f}x {full[2] / compact[2]:>15.1f}x")
+    finally:
+        runner.teardown_databases(old_config)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark: page-N latency of the deals list, page numbers vs. keyset cursors
+Run with: python benchmarks/bench_deal_pagination.py [deal_count]
+
+Runs against a throwaway test database. Only the pagination queries are
+timed; serialization costs the same for every page.
+"""
+import os
+import sys
+import time
+from datetime import timedelta
+from urllib.parse import parse_qs, urlparse
+
+import django
+
+# Setup Django
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dealnest.settings')
+django.setup()
+
+from django.db.models import Q
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment
+from django.utils import timezone
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+PAGE_SIZE = 20
+REPEAT = 20
+
+
+def best_of(func):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def seed(user, other, count):
+    from core.references import assign_reference_ids
+    from deals.models import Deal
+
+    now = timezone.now()
+    deals = []
+    for i in range(count):
+        if i % 4 == 0:
+            deal = Deal(client=other, freelancer=user, title=f'Hired {i}', description='D', amount=100)
+        else:
+            deal = Deal(client=user, title=f'Own {i}', description='D', amount=100)
+        deal.unique_shareable_url = f'bench-{i}'
+        deals.append(deal)
+    Deal.objects.bulk_create(assign_reference_ids(deals), batch_size=1000)
+    # Spread created_at out; bulk_create stamps every row with the same time
+    for offset in range(0, count, 1000):
+        ids = [deal.id for deal in deals[offset:offset + 1000]]
+        for i, pk in enumerate(ids):
+            Deal.objects.filter(pk=pk).update(created_at=now - timedelta(seconds=offset + i))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        from core.models import User
+        from deals.models import Deal
+        from deals.pagination import DealCursorPagination
+        from deals.serializers import DealSerializer
+
+        user = User.objects.create_user(username='bench-power', email='power@example.com')
+        other = User.objects.create_user(username='bench-other', email='other@example.com')
+        seed(user, other, count)
+
+        factory = APIRequestFactory()
+        combined = DealSerializer.setup_eager_loading(
+            Deal.objects.filter(Q(client=user) | Q(freelancer=user)).order_by('-created_at')
+        ).prefetch_related(None)
+        branches = [
+            DealSerializer.setup_eager_loading(Deal.objects.filter(client=user)).prefetch_related(None),
+            DealSerializer.setup_eager_loading(Deal.objects.filter(freelancer=user).exclude(client=user)).prefetch_related(None),
+        ]
+        ordered = list(
+            Deal.objects.filter(Q(client=user) | Q(freelancer=user)).order_by('-created_at', '-id').only('id', 'created_at')
+        )
+
+        def page_number(n):
+            paginator = PageNumberPagination()
+            paginator.page_size = PAGE_SIZE
+            request = Request(factory.get('/api/deals/', {'page': n}))
+            return lambda: paginator.paginate_queryset(combined, request)
+
+        def cursor(n):
+            paginator = DealCursorPagination()
+            paginator.page_size = PAGE_SIZE
+            params = {}
+            if n > 1:
+                paginator.base_url = 'http://testserver/api/deals/'
+                url = paginator.encode_cursor(ordered[(n - 1) * PAGE_SIZE - 1], reverse=False)
+                params = parse_qs(urlparse(url).query)
+            request = Request(factory.get('/api/deals/', params))
+            return lambda: paginator.paginate_queryset(branches, request)
+
+        last_page = len(ordered) // PAGE_SIZE
+        pages = sorted({1, 10, 100, last_page // 4, last_page // 2, last_page})
+        print('=' * 60)
+        print(f"Deals list over {len(ordered):,} deals, {PAGE_SIZE} per page (best of {REPEAT})")
+        print('=' * 60)
+        print(f"{'page':>8} {'page number (ms)':>20} {'cursor (ms)':>15}")
+        for n in pages:
+            print(f"{n:>8} {best_of(page_number(n)):>20.2f} {best_of(cursor(n)):>15.2f}")
+    finally:
+        runner.teardown_databases(old_config)
+
+
+if __name__ == '__main__':
+    main()
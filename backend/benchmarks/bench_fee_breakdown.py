@@ -0,0 +1,70 @@
+"""
+Benchmark: batch fee breakdown vs. PlatformSettings.calculate_fee_breakdown
+Run with: python benchmarks/bench_fee_breakdown.py [count]
+"""
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+import django
+
+# Setup Django
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dealnest.settings')
+django.setup()
+
+from core import fees
+from core.models import PlatformSettings
+
+
+def timed(label, func, count):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed:8.3f}s  {count / elapsed:14,.0f} amounts/s")
+    return result, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = random.Random(42)
+    amounts = [Decimal(rng.randint(100, 10 ** 9)) / 100 for _ in range(count)]
+    kobo = [fees.to_kobo(amount) for amount in amounts]
+
+    settings = PlatformSettings(
+        platform_fee_percent=Decimal('5.00'),
+        min_platform_fee=Decimal('50.00'),
+        max_platform_fee=Decimal('25000.00'),
+        fee_payer='split',
+    )
+
+    print('=' * 70)
+    print(f"Fee breakdown over {count:,} amounts (NumPy: {'yes' if fees.np is not None else 'no'})")
+    print('=' * 70)
+
+    scalar, scalar_time = timed(
+        'scalar calculate_fee_breakdown', lambda: [settings.calculate_fee_breakdown(a) for a in amounts], count
+    )
+    _, convert_time = timed('bulk, Decimal input', lambda: fees.bulk_fee_breakdown(settings, amounts), count)
+    columns, bulk_time = timed(
+        'bulk, kobo input', lambda: fees.bulk_fee_breakdown(settings, kobo, amounts_in_kobo=True), count
+    )
+    if fees.np is not None:
+        with_numpy = fees.np
+        fees.np = None
+        try:
+            timed('bulk, pure-integer fallback', lambda: fees.bulk_fee_breakdown(settings, kobo, amounts_in_kobo=True), count)
+        finally:
+            fees.np = with_numpy
+
+    mismatches = sum(1 for got, want in zip(fees.breakdown_dicts(columns), scalar) if got != want)
+    print('-' * 70)
+    print(f"Speed-up (Decimal input): {scalar_time / convert_time:6.1f}x")
+    print(f"Speed-up (kobo input):    {scalar_time / bulk_time:6.1f}x")
+    print(f"Mismatches vs scalar:     {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark: end-to-end deposit pipeline against the gateway simulator
+Run with: python benchmarks/bench_payment_pipeline.py [deposits] [latency_ms]
+
+Runs against a throwaway test database with payments.simulator standing in
+for Paystack. Each deposit goes through the real views: initialize, the
+customer paying, the signed charge.success webhook being acknowledged, and
+the stored event being processed. With no broker configured, Celery runs
+the processing task inline, right after the webhook commits.
+"""
+import os
+import statistics
+import sys
+import time
+
+import django
+import requests
+
+# Setup Django
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dealnest.settings')
+django.setup()
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings, setup_test_environment
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 150) / 1000
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        from rest_framework.test import APIClient
+
+        from core.models import PlatformSettings, User
+        from payments.models import WebhookEvent
+        from payments.services import PaystackGateway
+        from payments.simulator import GatewaySimulator
+
+        with GatewaySimulator(latency=latency, jitter=latency / 5, seed=1) as simulator, \
+                override_settings(PAYSTACK_SECRET_KEY=simulator.paystack_secret):
+            PaystackGateway.BASE_URL = simulator.url
+            PlatformSettings.objects.create(active_gateway='paystack', paystack_secret_key=simulator.paystack_secret)
+            user = User.objects.create_user(username='bench-saver', email='saver@example.com')
+            client = APIClient()
+            client.force_authenticate(user)
+            webhook_client = APIClient()
+            checkout = requests.Session()
+
+            stages = {'initialize': [], 'pay': [], 'webhook request': [], 'processing': []}
+            start = time.perf_counter()
+            for i in range(count):
+                t0 = time.perf_counter()
+                init = client.post('/api/payments/deposit/initiate/', {'amount': '1000'}, format='json').json()
+                t1 = time.perf_counter()
+                checkout.get(init['data']['authorization_url'])
+                t2 = time.perf_counter()
+                webhook = simulator.webhooks.pop()
+                response = webhook_client.post(
+                    '/api/payments/webhook/paystack/', webhook['body'], content_type='application/json',
+                    HTTP_X_PAYSTACK_SIGNATURE=webhook['headers']['x-paystack-signature'],
+                )
+                t3 = time.perf_counter()
+                assert response.status_code == 200, response.status_code
+                event = WebhookEvent.objects.order_by('-id').first()
+                stages['initialize'].append(t1 - t0)
+                stages['pay'].append(t2 - t1)
+                stages['webhook request'].append(t3 - t2)
+                # Without a broker this ran inline, inside the webhook request
+                stages['processing'].append((event.processed_at - event.received_at).total_seconds())
+            elapsed = time.perf_counter() - start
+
+            user.refresh_from_db()
+            assert user.balance == 1000 * count, user.balance
+            print('=' * 64)
+            print(f"{count} deposits against a gateway answering in {latency * 1000:.0f} ms")
+            print('=' * 64)
+            for stage, timings in stages.items():
+                print(f"{stage:<16} median {statistics.median(timings) * 1000:8.1f} ms")
+            print('-' * 64)
+            print(f"Pipeline throughput: {count / elapsed:,.1f} deposits/s on one worker")
+            print(f"Gateway calls served: {sum(v for k, v in simulator.stats.items() if ' ' in k)}")
+    finally:
+        runner.teardown_databases(old_config)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: payout throughput, one transfer per withdrawal vs. batched bulk transfers
+Run with: python benchmarks/bench_payouts.py [payouts] [latency_ms]
+
+Runs against a throwaway test database. A local HTTP server stands in for
+Paystack's /transfer and /transfer/bulk endpoints and answers every request
+after a fixed delay.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import django
+
+# Setup Django
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dealnest.settings')
+django.setup()
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment
+
+
+def start_server(latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            threading.Event().wait(latency)
+            if self.path == '/transfer/bulk':
+                data = [
+                    {'reference': t['reference'], 'transfer_code': f"TRF_{t['reference']}", 'status': 'success'}
+                    for t in payload['transfers']
+                ]
+            else:
+                data = {'reference': payload['reference'], 'transfer_code': 'TRF_x', 'status': 'success'}
+            body = json.dumps({'status': True, 'data': data}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 150) / 1000
+    server, url = start_server(latency)
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        from core.models import User
+        from core.money import Money
+        from payments.models import Payout
+        from payments.payouts import drain_payout_queue, enqueue_withdrawal
+        from payments.services import PaystackGateway
+        from payments.views import reserve_withdrawal, withdrawal_response
+
+        PaystackGateway.BASE_URL = url
+        gateway = PaystackGateway(public_key='pk', secret_key='sk')
+        user = User.objects.create_user(username='bench-earner', email='earner@example.com', balance=10 ** 9)
+        amount = Money.from_naira(500)
+
+        # One synchronous transfer per withdrawal, as WithdrawalView does without batching
+        inline = max(1, min(count, int(3 / latency)))
+        start = time.perf_counter()
+        for i in range(inline):
+            reference = f'WITH-inline-{i}'
+            tx = reserve_withdrawal(user, gateway, amount, reference)
+            withdrawal_response(user, tx, gateway.transfer(amount, 'RCP_1', reference))
+        inline_rate = inline / (time.perf_counter() - start)
+
+        for i in range(count):
+            enqueue_withdrawal(user, gateway, amount, f'WITH-queued-{i}', 'RCP_1', '0123456789', '044')
+        print('=' * 64)
+        print(f"Payouts against a gateway answering in {latency * 1000:.0f} ms")
+        print('=' * 64)
+        print(f"{'one transfer per request':<30} {inline_rate:10,.1f} payouts/s  ({inline} payouts)")
+        for batch_size in (25, 100):
+            Payout.objects.update(status='pending', batch_id='')
+            start = time.perf_counter()
+            stats = drain_payout_queue(gateway, batch_size=batch_size, concurrency=1)
+            elapsed = time.perf_counter() - start
+            assert stats.get('paid') == count, stats
+            print(f"{f'bulk, batches of {batch_size}':<30} {count / elapsed:10,.1f} payouts/s  ({count} payouts, {stats['batches']} requests)")
+    finally:
+        runner.teardown_databases(old_config)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Load test: GET /api/d/<slug>/public/ uncached, cached, and conditional (304)
+Run with: python benchmarks/bench_public_deal_cache.py [requests]
+
+Runs against a throwaway test database with throttling disabled, using the
+configured cache backend (LocMem unless REDIS_URL is set).
+"""
+import os
+import sys
+import time
+
+import django
+
+# Setup Django
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dealnest.settings')
+django.setup()
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+
+
+def run(label, count, request):
+    start = time.perf_counter()
+    for _ in range(count):
+        request()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {count / elapsed:10,.0f} req/s  {elapsed / count * 1000:8.3f} ms/req")
+    return count / elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    # Anonymous throttling would cut the run off after 100 requests
+    APIView.throttle_classes = []
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        from core.models import User, PlatformSettings, JobType
+        from deals.cache import invalidate_public_deal
+        from deals.models import Deal, DealSubmission
+
+        cache.clear()
+        PlatformSettings.objects.create()
+        client = User.objects.create_user(username='bench-client', email='client@example.com')
+        freelancer = User.objects.create_user(username='bench-maker', email='maker@example.com')
+        job_type = JobType.objects.create(name='Design', slug='design')
+        deal = Deal.objects.create(
+            client=client, freelancer=freelancer, job_type=job_type, title='Brand refresh',
+            description='Logo, palette and type system. ' * 20, amount=250000, status='in_progress',
+        )
+        for round_ in range(3):
+            DealSubmission.objects.create(deal=deal, freelancer=freelancer, revision_round=round_, notes='Draft')
+        slug = deal.unique_shareable_url
+        url = f'/api/d/{slug}/public/'
+        api = APIClient()
+
+        def uncached():
+            invalidate_public_deal(slug)
+            assert api.get(url).status_code == 200
+
+        def cached():
+            assert api.get(url).status_code == 200
+
+        etag = api.get(url)['ETag']
+
+        def conditional():
+            assert api.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+        def conditional_cold():
+            invalidate_public_deal(slug)
+            assert api.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+        print('=' * 64)
+        print(f"Public deal page, {count:,} sequential requests ({settings.CACHES['default']['BACKEND'].rsplit('.', 1)[-1]})")
+        print('=' * 64)
+        base = run('uncached (query + serialize)', count, uncached)
+        hit = run('cache hit', count, cached)
+        run('If-None-Match, cache hit', count, conditional)
+        run('If-None-Match, cold cache', count, conditional_cold)
+        print('-' * 64)
+        print(f"Cache-hit speed-up: {hit / base:5.1f}x")
+    finally:
+        runner.teardown_databases(old_config)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,9 +11,15 @@ from datetime import timedelta
 from decimal import Decimal
 
 from deals.models import Deal, Dispute, DealMessage, DealSubmission
+from deals.transitions import ADMIN_SETTABLE_STATUSES, apply_transition, transition, try_transition
+from payments.health import gateway_health
+from payments.ledger import ADJUSTMENTS, FEES, account_balance, post, settle_escrow, user_account
 from payments.models import PaymentTransaction, Payout
+from payments.services import GATEWAY_CLASSES
 from core.models import Notification, PlatformSettings, ThirdPartyIntegration
 from core.audit import AdminAuditLog
+from core.cache import get_platform_secrets, get_platform_settings
+from core.money import Money, ZERO
 
 User = get_user_model()
 
@@ -51,6 +57,8 @@ class AdminStatsView(views.APIView):
 
         # Volume: Total completed deal volume
         total_volume = Deal.objects.filter(status='completed').aggregate(Sum('amount'))['amount__sum'] or 0
+        # Fees actually booked when escrows were settled, at the rates charged then
+        estimated_revenue = float(account_balance(FEES))
         
         return response.Response({
             "users": {
@@ -69,7 +77,7 @@ class AdminStatsView(views.APIView):
                 "total_volume": float(total_volume),
                 "total_outflow": float(total_outflow),
                 "pending_payouts": float(pending_outflow),
-                "estimated_revenue": float(total_volume) * 0.05
+                "estimated_revenue": estimated_revenue
             }
         })
 
@@ -180,53 +188,42 @@ class AdminDealDetailView(views.APIView):
             changes = {"action": action, "reason": reason}
             
             if action == 'cancel_deal':
-                if deal.status in ['completed', 'refunded', 'cancelled']:
-                    return response.Response({"error": "Cannot cancel a finished deal"}, status=400)
-                
-                # If funded, refund the client
-                if deal.status in ['funded', 'in_progress', 'delivered', 'disputed']:
-                    # Find the transaction to see how much was actually paid
-                    tx = PaymentTransaction.objects.filter(deal=deal, status='success', transaction_type='deal_payment').first()
-                    refund_amount = tx.amount_paid if tx else deal.amount
-                    
-                    deal.client.balance += Decimal(str(refund_amount))
-                    deal.client.save()
-                    changes['refunded'] = True
-                    changes['refund_amount'] = float(refund_amount)
-                
-                deal.status = 'cancelled'
-                deal.save()
+                with transaction.atomic():
+                    # Refund only if the deal was still funded when the cancellation won
+                    if not try_transition(deal, 'cancel_unfunded'):
+                        apply_transition(deal, 'admin_cancel')
+                        # Find the transaction to see how much was actually paid
+                        tx = PaymentTransaction.objects.filter(deal=deal, status='success', transaction_type='deal_payment').first()
+                        refund_amount = tx.amount_paid if tx else deal.amount
+
+                        settle_escrow(
+                            deal, 'refund', [(user_account(deal.client_id), Money.from_naira(refund_amount))], f"deal-{deal.id}"
+                        )
+                        changes['refunded'] = True
+                        changes['refund_amount'] = float(refund_amount)
                 
             elif action == 'force_complete':
-                if deal.status in ['completed', 'refunded', 'cancelled']:
-                    return response.Response({"error": "Deal is already in a final state"}, status=400)
-                
                 if not deal.freelancer:
                     return response.Response({"error": "No freelancer assigned to complete"}, status=400)
             
-                settings = PlatformSettings.objects.first()
-                if not settings:
-                    settings = PlatformSettings.objects.create()
-                
-                breakdown = settings.calculate_fee_breakdown(deal.amount)
+                settings = get_platform_settings()
+                breakdown = settings.fee_breakdown(deal.amount)
                 net_amount = breakdown['total_to_receive']
                 
-                deal.freelancer.balance += Decimal(str(net_amount))
-                deal.freelancer.save()
-                deal.status = 'completed'
-                deal.save()
+                with transaction.atomic():
+                    apply_transition(deal, 'force_complete')
+                    settle_escrow(deal, 'release', [(user_account(deal.freelancer_id), net_amount)], f"deal-{deal.id}")
                 changes['funds_released'] = True
                 changes['net_released'] = float(net_amount)
-                changes['fee_deducted'] = breakdown['freelancer_fee']
+                changes['fee_deducted'] = float(breakdown['freelancer_fee'])
             
             elif action == 'update_status':
                 new_status = request.data.get('status')
-                if new_status in dict(Deal.STATUS_CHOICES):
-                    deal.status = new_status
-                    deal.save()
-                    changes['new_status'] = new_status
-                else:
+                if new_status not in ADMIN_SETTABLE_STATUSES:
                     return response.Response({"error": "Invalid status"}, status=400)
+                if not transition(deal, ADMIN_SETTABLE_STATUSES, new_status):
+                    return response.Response({"error": "Deal is not in an active, funded status"}, status=400)
+                changes['new_status'] = new_status
             
             else:
                 return response.Response({"error": "Invalid action"}, status=400)
@@ -245,6 +242,8 @@ class AdminDealDetailView(views.APIView):
             
         except Deal.DoesNotExist:
             return response.Response({"error": "Deal not found"}, status=status.HTTP_404_NOT_FOUND)
+        except ValidationError as e:
+            return response.Response({"error": e.detail[0]}, status=400)
 
     def _get_client_ip(self, request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -319,6 +318,47 @@ class AdminDisputeDetailView(views.APIView):
             } for s in submissions]
         })
 
+    def _settle(self, dispute, deal, decision, notes, refund_amount, settings):
+        """Move the deal out of dispute and settle its escrow; raises ValidationError if another action won."""
+        if decision == 'release_to_freelancer':
+            if deal.freelancer:
+                # Calculate net amount after fees
+                net_amount = settings.fee_breakdown(deal.amount)['total_to_receive']
+
+                apply_transition(deal, 'resolve_dispute')
+                settle_escrow(deal, 'release', [(user_account(deal.freelancer_id), net_amount)], f"deal-{deal.id}")
+
+        elif decision == 'full_refund':
+            apply_transition(deal, 'refund_dispute')
+            # Find how much client actually paid
+            tx = PaymentTransaction.objects.filter(deal=deal, status='success', transaction_type='deal_payment').first()
+            refund_amount_client = tx.amount_paid if tx else deal.amount
+
+            settle_escrow(
+                deal, 'refund', [(user_account(deal.client_id), Money.from_naira(refund_amount_client))], f"deal-{deal.id}"
+            )
+
+        elif decision == 'partial_refund':
+            deal_amount = Money.from_naira(deal.amount)
+            if refund_amount > deal_amount or refund_amount < ZERO:
+                raise ValidationError("Invalid refund amount")
+
+            freelancer_share = deal_amount - refund_amount
+            f_fee = settings.fee_breakdown(deal.amount)['freelancer_fee']
+            net_freelancer_share = max(ZERO, freelancer_share - f_fee)
+
+            apply_transition(deal, 'resolve_dispute')
+            payouts = [(user_account(deal.client_id), refund_amount)]
+            if deal.freelancer:
+                payouts.append((user_account(deal.freelancer_id), net_freelancer_share))
+            settle_escrow(deal, 'refund', payouts, f"deal-{deal.id}")
+
+        # Update Dispute Record; conditional, so a concurrent resolution loses here
+        if not Dispute.objects.filter(pk=dispute.pk, resolved_at__isnull=True).update(
+            admin_decision=decision, decision_notes=notes, resolved_at=timezone.now()
+        ):
+            raise ValidationError("Dispute already resolved")
+
     def post(self, request, id):
         from django.db import transaction
         
@@ -332,82 +372,42 @@ class AdminDisputeDetailView(views.APIView):
         
         decision = request.data.get('decision') # release_to_freelancer, full_refund, partial_refund
         notes = request.data.get('notes', '')
-        refund_amount = float(request.data.get('refund_amount', 0))
+        try:
+            refund_amount = Money.from_naira(request.data.get('refund_amount', 0))
+        except (ArithmeticError, ValueError, TypeError):
+            return response.Response({"error": "Invalid refund amount"}, status=400)
         
         deal = dispute.deal
         
         # Get platform settings for fee calculation
-        settings = PlatformSettings.objects.first()
-        if not settings:
-            settings = PlatformSettings.objects.create() # Create default if none exist
+        settings = get_platform_settings()
         
-        with transaction.atomic():
-            if decision == 'release_to_freelancer':
-                if deal.freelancer:
-                    # Calculate net amount after fees
-                    breakdown = settings.calculate_fee_breakdown(deal.amount)
-                    net_amount = breakdown['total_to_receive']
-                    
-                    deal.freelancer.balance += Decimal(str(net_amount))
-                    deal.freelancer.save()
-                    deal.status = 'completed'
-                
-            elif decision == 'full_refund':
-                # Find how much client actually paid
-                tx = PaymentTransaction.objects.filter(deal=deal, status='success', transaction_type='deal_payment').first()
-                refund_amount_client = tx.amount_paid if tx else deal.amount
-                
-                deal.client.balance += Decimal(str(refund_amount_client))
-                deal.client.save()
-                deal.status = 'refunded'
-                
-            elif decision == 'partial_refund':
-                if refund_amount > float(deal.amount) or refund_amount < 0:
-                     return response.Response({"error": "Invalid refund amount"}, status=400)
-                     
-                freelancer_share = float(deal.amount) - refund_amount
-                breakdown = settings.calculate_fee_breakdown(deal.amount)
-                f_fee = breakdown['freelancer_fee']
-                net_freelancer_share = max(0, freelancer_share - f_fee)
-                
-                deal.client.balance += Decimal(str(refund_amount))
-                deal.client.save()
-                
-                if deal.freelancer:
-                    deal.freelancer.balance += Decimal(str(net_freelancer_share))
-                    deal.freelancer.save()
-                
-                deal.status = 'completed'
-                    
-            # Update Deal and Create Notifications
-            deal.save()
+        try:
+            with transaction.atomic():
+                self._settle(dispute, deal, decision, notes, refund_amount, settings)
+        except ValidationError as e:
+            return response.Response({"error": e.detail[0]}, status=400)
+
+        # Enhanced Notifications with Justification
+        notes_snippet = f"\n\nJustification: {notes}" if notes else ""
+        
+        if decision == 'release_to_freelancer':
+            Notification.objects.create(recipient=deal.client, deal=deal, type='dispute_resolved',
+                content=f"Dispute resolved for '{deal.title}'. Funds released to freelancer.{notes_snippet}")
+            Notification.objects.create(recipient=deal.freelancer, deal=deal, type='dispute_resolved',
+                content=f"Dispute resolved for '{deal.title}'. You have won the dispute.{notes_snippet}")
             
-            # Update Dispute Record
-            dispute.admin_decision = decision
-            dispute.decision_notes = notes
-            dispute.resolved_at = timezone.now()
-            dispute.save()
-
-            # Enhanced Notifications with Justification
-            notes_snippet = f"\n\nJustification: {notes}" if notes else ""
+        elif decision == 'full_refund':
+            Notification.objects.create(recipient=deal.client, deal=deal, type='dispute_resolved',
+                content=f"Dispute resolved for '{deal.title}'. Funds refunded to you.{notes_snippet}")
+            Notification.objects.create(recipient=deal.freelancer, deal=deal, type='dispute_resolved',
+                content=f"Dispute resolved for '{deal.title}'. Funds refunded to client.{notes_snippet}")
             
-            if decision == 'release_to_freelancer':
-                Notification.objects.create(recipient=deal.client, deal=deal, type='dispute_resolved',
-                    content=f"Dispute resolved for '{deal.title}'. Funds released to freelancer.{notes_snippet}")
-                Notification.objects.create(recipient=deal.freelancer, deal=deal, type='dispute_resolved',
-                    content=f"Dispute resolved for '{deal.title}'. You have won the dispute.{notes_snippet}")
-                
-            elif decision == 'full_refund':
-                Notification.objects.create(recipient=deal.client, deal=deal, type='dispute_resolved',
-                    content=f"Dispute resolved for '{deal.title}'. Funds refunded to you.{notes_snippet}")
-                Notification.objects.create(recipient=deal.freelancer, deal=deal, type='dispute_resolved',
-                    content=f"Dispute resolved for '{deal.title}'. Funds refunded to client.{notes_snippet}")
-                
-            elif decision == 'partial_refund':
-                Notification.objects.create(recipient=deal.client, deal=deal, type='dispute_resolved',
-                    content=f"Dispute resolved for '{deal.title}'. Partial refund processed.{notes_snippet}")
-                Notification.objects.create(recipient=deal.freelancer, deal=deal, type='dispute_resolved',
-                    content=f"Dispute resolved for '{deal.title}'. Partial payment released to you.{notes_snippet}")
+        elif decision == 'partial_refund':
+            Notification.objects.create(recipient=deal.client, deal=deal, type='dispute_resolved',
+                content=f"Dispute resolved for '{deal.title}'. Partial refund processed.{notes_snippet}")
+            Notification.objects.create(recipient=deal.freelancer, deal=deal, type='dispute_resolved',
+                content=f"Dispute resolved for '{deal.title}'. Partial payment released to you.{notes_snippet}")
 
         return response.Response({"status": "success", "decision": decision})
 
@@ -433,10 +433,8 @@ class AdminPlatformSettingsView(APIView):
     
     def get(self, request):
         try:
-            settings = PlatformSettings.objects.first()
-            if not settings:
-                # Create default settings if none exist
-                settings = PlatformSettings.objects.create()
+            settings = get_platform_settings()
+            secrets = get_platform_secrets()
             
             # Mask sensitive keys for security
             data = {
@@ -453,9 +451,9 @@ class AdminPlatformSettingsView(APIView):
                 "whatsapp_link": settings.whatsapp_link,
                 # Mask API keys (show only last 4 chars)
                 "paystack_public_key": self._mask_key(settings.paystack_public_key),
-                "paystack_secret_key": self._mask_key(settings.paystack_secret_key),
+                "paystack_secret_key": self._mask_key(secrets['paystack_secret_key']),
                 "flutterwave_public_key": self._mask_key(settings.flutterwave_public_key),
-                "flutterwave_secret_key": self._mask_key(settings.flutterwave_secret_key),
+                "flutterwave_secret_key": self._mask_key(secrets['flutterwave_secret_key']),
             }
             
             return Response(data)
@@ -464,6 +462,7 @@ class AdminPlatformSettingsView(APIView):
     
     def patch(self, request):
         try:
+            # Edit a fresh row: get_platform_settings() returns a shared read-only snapshot
             settings = PlatformSettings.objects.first()
             if not settings:
                 settings = PlatformSettings.objects.create()
@@ -567,9 +566,9 @@ class AdminFinancialStatsView(views.APIView):
     permission_classes = [permissions.IsAdminUser]
 
     def get(self, request):
-        # Revenue: 5% of all completed deals
+        # Revenue: platform fees on all completed deals
         completed_volume = Deal.objects.filter(status='completed').aggregate(Sum('amount'))['amount__sum'] or 0
-        total_revenue = float(completed_volume) * 0.05
+        total_revenue = _completed_deal_revenue()
         
         # Escrow: Funds currently held
         escrow_balance = Deal.objects.filter(
@@ -692,7 +691,7 @@ class AdminUserDetailView(views.APIView):
                 user.is_active = data['is_active']
                 fields_updated.append('is_active')
                 
-            user.save()
+            user.save(update_fields=fields_updated)
             
             # Audit Log
             AdminAuditLog.objects.create(
@@ -730,7 +729,7 @@ class AdminUserActionView(views.APIView):
             
             if action == 'ban':
                 user.is_active = False
-                user.save()
+                user.save(update_fields=['is_active'])
                 AdminAuditLog.objects.create(
                     admin=request.user,
                     action="ban_user",
@@ -743,7 +742,7 @@ class AdminUserActionView(views.APIView):
                 
             elif action == 'unban':
                 user.is_active = True
-                user.save()
+                user.save(update_fields=['is_active'])
                 AdminAuditLog.objects.create(
                     admin=request.user,
                     action="unban_user",
@@ -759,9 +758,18 @@ class AdminUserActionView(views.APIView):
                 if amount is None:
                     return response.Response({"error": "Amount is required"}, status=status.HTTP_400_BAD_REQUEST)
                 
+                try:
+                    adjustment = Money.from_naira(amount)
+                except (ArithmeticError, ValueError, TypeError):
+                    return response.Response({"error": "Invalid amount"}, status=status.HTTP_400_BAD_REQUEST)
+                
                 old_balance = user.balance
-                user.balance += Decimal(str(amount))
-                user.save()
+                # A correction may take a wallet below zero
+                post(
+                    'adjustment', [(user_account(user), adjustment), (ADJUSTMENTS, -adjustment)],
+                    f"admin-{request.user.id}", overdraft=True,
+                )
+                user.balance = (Money.from_naira(old_balance) + adjustment).to_decimal()
                 
                 AdminAuditLog.objects.create(
                     admin=request.user,
@@ -771,7 +779,7 @@ class AdminUserActionView(views.APIView):
                     changes={
                         "old_balance": float(old_balance),
                         "new_balance": float(user.balance),
-                        "adjustment": float(amount),
+                        "adjustment": float(adjustment),
                         "reason": reason
                     },
                     ip_address=self._get_client_ip(request)
@@ -813,7 +821,9 @@ class AdminIntegrationsView(APIView):
             "secret_key": self._mask_key(i.secret_key),
             "is_active": i.is_active,
             "config": i.config,
-            "updated_at": i.updated_at
+            "updated_at": i.updated_at,
+            # Circuit breaker state and rolling window, shared by all workers
+            "health": gateway_health.snapshot(i.service) if i.service in GATEWAY_CLASSES else None,
         } for i in integrations]
         return Response(data)
 
@@ -835,6 +845,9 @@ class AdminIntegrationsView(APIView):
             if 'config' in request.data:
                 integration.config.update(request.data['config'])
                 changes['config'] = integration.config
+            if request.data.get('reset_circuit') and integration.service in GATEWAY_CLASSES:
+                gateway_health.reset(integration.service)
+                changes['reset_circuit'] = True
                 
             integration.save()
             
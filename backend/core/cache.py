@@ -0,0 +1,143 @@
+"""
+Process-wide PlatformSettings snapshot.
+
+Every worker keeps the last settings row it loaded together with the version
+it was loaded under. The current version lives in the shared Django cache and
+is replaced whenever PlatformSettings is saved or deleted, so a warm read is a
+single cache lookup and never touches the database.
+
+The snapshot is shared and read-only. Values derived from it, such as the
+FeeSchedule, are kept here keyed by version rather than set on the row. The
+gateway secret keys are deferred, so they never reach the shared cache.
+get_platform_secrets() reads them on demand and keeps them in process
+memory for the current version only.
+"""
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+SETTINGS_VERSION_KEY = 'platform_settings:version'
+SETTINGS_SNAPSHOT_KEY = 'platform_settings:snapshot:{version}'
+SETTINGS_SNAPSHOT_TIMEOUT = 60 * 60 * 24
+
+SECRET_FIELDS = ('paystack_secret_key', 'flutterwave_secret_key')
+
+_snapshot = None  # (version, PlatformSettings)
+_snapshot_lock = threading.Lock()
+_secrets = None  # (version, {field: value})
+_fee_schedules = {}  # version -> FeeSchedule of that version's snapshot
+
+
+def _current_version():
+    version = cache.get(SETTINGS_VERSION_KEY)
+    if version is None:
+        # Cache was flushed or never populated: start a fresh version so no
+        # worker can keep serving a snapshot from before the flush.
+        cache.add(SETTINGS_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(SETTINGS_VERSION_KEY)
+    return version
+
+
+def platform_settings_version():
+    """Opaque token that changes whenever PlatformSettings does, e.g. for ETags."""
+    return _current_version()
+
+
+def _load_from_db():
+    from .models import PlatformSettings
+
+    settings_obj = PlatformSettings.objects.defer(*SECRET_FIELDS).first()
+    if not settings_obj:
+        PlatformSettings.objects.create()
+        settings_obj = PlatformSettings.objects.defer(*SECRET_FIELDS).first()
+    return settings_obj
+
+
+def get_platform_settings():
+    """
+    Return the active PlatformSettings, creating the default row if needed.
+
+    The returned instance is shared by every caller in the process and must be
+    treated as read-only. Load a fresh row from the database to edit settings.
+    Its secret key fields are deferred: use get_platform_secrets() instead,
+    since touching them would load them onto the shared instance.
+    """
+    global _snapshot
+
+    version = _current_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot[0] == version:
+        return snapshot[1]
+
+    with _snapshot_lock:
+        snapshot = _snapshot
+        if snapshot is not None and snapshot[0] == version:
+            return snapshot[1]
+
+        snapshot_key = SETTINGS_SNAPSHOT_KEY.format(version=version)
+        settings_obj = cache.get(snapshot_key)
+        if settings_obj is None:
+            settings_obj = _load_from_db()
+            cache.set(snapshot_key, settings_obj, SETTINGS_SNAPSHOT_TIMEOUT)
+
+        _snapshot = (version, settings_obj)
+        return settings_obj
+
+
+def get_platform_secrets():
+    """{field: value} for the SECRET_FIELDS of the active PlatformSettings."""
+    global _secrets
+
+    version = _current_version()
+    secrets = _secrets
+    if secrets is not None and secrets[0] == version:
+        return secrets[1]
+
+    from .models import PlatformSettings
+
+    settings_obj = get_platform_settings()
+    values = PlatformSettings.objects.filter(pk=settings_obj.pk).values(*SECRET_FIELDS).first()
+    values = values or dict.fromkeys(SECRET_FIELDS, '')
+    _secrets = (version, values)
+    return values
+
+
+def get_fee_schedule(settings_obj):
+    """
+    The FeeSchedule of the shared snapshot, built once per version. Returns
+    None for any other row.
+    """
+    global _fee_schedules
+
+    snapshot = _snapshot
+    if snapshot is None or snapshot[1] is not settings_obj:
+        return None
+    version = snapshot[0]
+    schedule = _fee_schedules.get(version)
+    if schedule is None:
+        from .fees import FeeSchedule
+
+        schedule = FeeSchedule.build(settings_obj)
+        # Older versions are never asked for again
+        _fee_schedules = {version: schedule}
+    return schedule
+
+
+def _bump_version():
+    global _snapshot, _secrets
+    cache.set(SETTINGS_VERSION_KEY, uuid.uuid4().hex, None)
+    _snapshot = _secrets = None
+
+
+def invalidate_platform_settings():
+    """
+    Drop the cached snapshot in every process.
+
+    The version is bumped immediately so the writing request sees its own
+    change, and again once the surrounding transaction commits so no other
+    worker can re-cache the pre-commit row under the new version.
+    """
+    _bump_version()
+    transaction.on_commit(_bump_version)
@@ -0,0 +1,214 @@
+"""
+Fee breakdowns in exact integer kobo.
+
+fee_breakdown() prices a single amount as Money. bulk_fee_breakdown()
+computes all six columns for many amounts at once for lists, reports and
+admin stats, and is vectorized with NumPy when NumPy is installed. Both round
+half-even to the kobo, the same way the original Decimal implementation
+did.
+"""
+from .money import Money, to_kobo
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the pure-integer path is used instead
+    np = None
+
+FEE_COLUMNS = (
+    'base_amount', 'client_fee', 'freelancer_fee',
+    'total_to_pay', 'total_to_receive', 'platform_revenue',
+)
+
+# Fees are tracked in 1/20000 kobo while they are computed. The fee percent
+# has two decimals (x100), a percent is /100, and split fees are halved, so
+# every intermediate value is an exact integer at this scale.
+FEE_SCALE = 20000
+
+# Below this many amounts the NumPy setup cost outweighs the vectorized loop.
+NUMPY_MIN_BATCH = 64
+
+
+class FeeSchedule:
+    """The fee fields of a PlatformSettings row, converted to integers once."""
+    __slots__ = ('percent_bp', 'min_fee', 'max_fee', 'fee_payer', 'source')
+
+    def __init__(self, percent_bp, min_fee, max_fee, fee_payer, source=None):
+        self.percent_bp = percent_bp
+        self.min_fee = min_fee
+        self.max_fee = max_fee
+        self.fee_payer = fee_payer
+        self.source = source
+
+    @staticmethod
+    def _source_values(settings):
+        return (settings.platform_fee_percent, settings.min_platform_fee,
+                settings.max_platform_fee, settings.fee_payer)
+
+    @classmethod
+    def build(cls, settings):
+        """Convert the fee fields of a PlatformSettings row."""
+        percent, min_fee, max_fee, fee_payer = source = cls._source_values(settings)
+        return cls(
+            percent_bp=to_kobo(percent),
+            min_fee=to_kobo(min_fee),
+            max_fee=to_kobo(max_fee),
+            fee_payer=fee_payer,
+            source=source,
+        )
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        Return the schedule for a PlatformSettings row. The shared snapshot's
+        schedule is built once per settings version (core.cache); any other
+        row is converted on each call.
+        """
+        if isinstance(settings, FeeSchedule):
+            return settings
+        from .cache import get_fee_schedule
+
+        return get_fee_schedule(settings) or cls.build(settings)
+
+
+def _round_half_even(value):
+    quotient, remainder = divmod(value, FEE_SCALE)
+    twice = remainder * 2
+    if twice > FEE_SCALE or (twice == FEE_SCALE and quotient & 1):
+        quotient += 1
+    return quotient
+
+
+def _round_half_even_array(values):
+    quotient, remainder = np.divmod(values, FEE_SCALE)
+    twice = remainder * 2
+    round_up = (twice > FEE_SCALE) | ((twice == FEE_SCALE) & ((quotient & 1) == 1))
+    return quotient + round_up
+
+
+def _breakdown_one(amount, rate, min_fee, max_fee, payer):
+    scaled_amount = amount * FEE_SCALE
+    fee = amount * rate
+    if min_fee > 0 and fee < min_fee:
+        fee = min_fee
+    if max_fee > 0 and fee > max_fee:
+        fee = max_fee
+    if fee > scaled_amount:
+        fee = scaled_amount
+
+    if payer == 'client':
+        client_fee, freelancer_fee = fee, 0
+    elif payer == 'freelancer':
+        client_fee, freelancer_fee = 0, fee
+    elif payer == 'split':
+        client_fee = freelancer_fee = fee // 2
+    else:
+        client_fee = freelancer_fee = 0
+
+    return (
+        amount,
+        _round_half_even(client_fee),
+        _round_half_even(freelancer_fee),
+        _round_half_even(scaled_amount + client_fee),
+        _round_half_even(scaled_amount - freelancer_fee),
+        _round_half_even(client_fee + freelancer_fee),
+    )
+
+
+def _breakdown_python(schedule, amounts):
+    args = (schedule.percent_bp * 2, schedule.min_fee * FEE_SCALE,
+            schedule.max_fee * FEE_SCALE, schedule.fee_payer)
+    rows = [_breakdown_one(amount, *args) for amount in amounts]
+    if not rows:
+        return {name: [] for name in FEE_COLUMNS}
+    return dict(zip(FEE_COLUMNS, map(list, zip(*rows))))
+
+
+def _breakdown_numpy(schedule, amounts):
+    amounts = np.asarray(amounts, dtype=np.int64)
+    scaled_amount = amounts * FEE_SCALE
+    fee = amounts * (schedule.percent_bp * 2)
+    if schedule.min_fee > 0:
+        fee = np.maximum(fee, schedule.min_fee * FEE_SCALE)
+    if schedule.max_fee > 0:
+        fee = np.minimum(fee, schedule.max_fee * FEE_SCALE)
+    fee = np.minimum(fee, scaled_amount)
+
+    zeros = np.zeros_like(fee)
+    if schedule.fee_payer == 'client':
+        client_fee, freelancer_fee = fee, zeros
+    elif schedule.fee_payer == 'freelancer':
+        client_fee, freelancer_fee = zeros, fee
+    elif schedule.fee_payer == 'split':
+        client_fee = freelancer_fee = fee // 2
+    else:
+        client_fee = freelancer_fee = zeros
+
+    return {
+        'base_amount': amounts,
+        'client_fee': _round_half_even_array(client_fee),
+        'freelancer_fee': _round_half_even_array(freelancer_fee),
+        'total_to_pay': _round_half_even_array(scaled_amount + client_fee),
+        'total_to_receive': _round_half_even_array(scaled_amount - freelancer_fee),
+        'platform_revenue': _round_half_even_array(client_fee + freelancer_fee),
+    }
+
+
+def fee_breakdown(settings, amount):
+    """
+    Fee breakdown for a single amount as a dict of Money keyed by FEE_COLUMNS.
+    `settings` is a PlatformSettings row or a FeeSchedule.
+    """
+    schedule = FeeSchedule.from_settings(settings)
+    row = _breakdown_one(
+        Money.from_naira(amount).kobo,
+        schedule.percent_bp * 2,
+        schedule.min_fee * FEE_SCALE,
+        schedule.max_fee * FEE_SCALE,
+        schedule.fee_payer,
+    )
+    return {name: Money(kobo) for name, kobo in zip(FEE_COLUMNS, row)}
+
+
+def as_floats(breakdown):
+    """Render a Money breakdown as the naira floats the API has always returned."""
+    return {name: float(value) for name, value in breakdown.items()}
+
+
+def bulk_fee_breakdown(settings, amounts, amounts_in_kobo=False):
+    """
+    Compute the fee breakdown columns for many deal amounts at once.
+
+    `settings` is a PlatformSettings row or a FeeSchedule. `amounts` is any
+    sequence of naira amounts, or of integer kobo when `amounts_in_kobo` is
+    set (a NumPy int64 array avoids a copy). Returns a dict keyed by
+    FEE_COLUMNS whose values are integer kobo: NumPy int64 arrays when NumPy
+    is installed and the batch is large enough, lists of int otherwise.
+    """
+    schedule = FeeSchedule.from_settings(settings)
+    if not amounts_in_kobo:
+        amounts = [to_kobo(amount) for amount in amounts]
+
+    if np is not None and len(amounts) >= NUMPY_MIN_BATCH:
+        return _breakdown_numpy(schedule, amounts)
+    return _breakdown_python(schedule, amounts)
+
+
+def column_total(column):
+    """Sum a breakdown column to integer kobo, whichever backend produced it."""
+    if np is not None and isinstance(column, np.ndarray):
+        return int(column.sum())
+    return sum(column)
+
+
+def breakdown_dicts(columns):
+    """
+    Turn breakdown columns into per-amount dicts shaped like
+    PlatformSettings.calculate_fee_breakdown() output (naira floats).
+    """
+    naira = []
+    for name in FEE_COLUMNS:
+        column = columns[name]
+        if np is not None and isinstance(column, np.ndarray):
+            column = column.tolist()
+        naira.append([kobo / 100 for kobo in column])
+    return [dict(zip(FEE_COLUMNS, row)) for row in zip(*naira)]
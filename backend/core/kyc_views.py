@@ -25,7 +25,7 @@ class RequestVerificationView(views.APIView):
              
         user.kyc_document = document
         user.kyc_status = 'pending'
-        user.save()
+        user.save(update_fields=['kyc_document', 'kyc_status'])
         
         # Notify Admins (For MVP, we just log it or maybe create a generic admin notification if system existed)
         # We don't have a direct 'notify all admins' function yet, but the Admin Dashboard sees pending users.
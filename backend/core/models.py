@@ -1,10 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
-from django.utils.crypto import get_random_string
 import uuid
 
-class User(AbstractUser):
+from .cache import invalidate_platform_settings
+from .references import ReferenceIDMixin
+
+class User(ReferenceIDMixin, AbstractUser):
     ROLE_CHOICES = (
         ('client', 'Client'),
         ('freelancer', 'Freelancer'),
@@ -43,19 +45,46 @@ class User(AbstractUser):
     total_deals_completed = models.PositiveIntegerField(default=0)
     disputes_count = models.PositiveIntegerField(default=0)
 
+    # reference_id is generated as DN-USR-XXXXXXXX on first save
+    REFERENCE_PREFIX = 'USR'
+
+    # Editing these drops the user's saved transfer recipients
+    BANK_DETAIL_FIELDS = ('bank_name', 'bank_account')
+
+    # Changed only by payments.ledger, with a conditional UPDATE. save() leaves
+    # it alone unless it is named in update_fields.
+    LEDGER_FIELDS = ('balance',)
+
     def __str__(self):
         return self.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_bank_details = instance._bank_details()
+        return instance
+
+    def _bank_details(self):
+        # Read __dict__ so deferred fields are not loaded just for this
+        return tuple(self.__dict__.get(name) for name in self.BANK_DETAIL_FIELDS)
+
+    def _update_fields_without_ledger(self):
+        deferred = self.get_deferred_fields()
+        return [
+            f.name for f in self._meta.concrete_fields
+            if not f.primary_key and f.name not in self.LEDGER_FIELDS and f.attname not in deferred
+        ]
+
     def save(self, *args, **kwargs):
-        if not self.reference_id:
-            # Generate DN-USR-XXXXXX format
-            unique_code = get_random_string(8, allowed_chars='ABCDEFGHJKLMNPQRSTUVWXYZ23456789')
-            self.reference_id = f"DN-USR-{unique_code}"
-            # Ensure uniqueness
-            while User.objects.filter(reference_id=self.reference_id).exists():
-                unique_code = get_random_string(8, allowed_chars='ABCDEFGHJKLMNPQRSTUVWXYZ23456789')
-                self.reference_id = f"DN-USR-{unique_code}"
+        # A plain save() of an instance loaded before a posting would write its stale balance back
+        if not self._state.adding and not args and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = self._update_fields_without_ledger()
+        loaded = getattr(self, '_loaded_bank_details', None)
+        bank_details_changed = loaded is not None and loaded != self._bank_details()
         super().save(*args, **kwargs)
+        if bank_details_changed:
+            self.transfer_recipients.all().delete()
+        self._loaded_bank_details = self._bank_details()
 
 class PlatformSettings(models.Model):
     GATEWAY_CHOICES = (
@@ -93,56 +122,36 @@ class PlatformSettings(models.Model):
     def save(self, *args, **kwargs):
         if not self.pk and PlatformSettings.objects.exists():
             return
-        return super(PlatformSettings, self).save(*args, **kwargs)
+        result = super(PlatformSettings, self).save(*args, **kwargs)
+        invalidate_platform_settings()
+        return result
+
+    def delete(self, *args, **kwargs):
+        result = super(PlatformSettings, self).delete(*args, **kwargs)
+        invalidate_platform_settings()
+        return result
 
     def calculate_fee_breakdown(self, amount):
         """
         Calculates how much the client pays and how much the freelancer receives
-        based on the fee_payer setting.
+        based on the fee_payer setting. Values are naira floats for API output;
+        use fee_breakdown() for the exact Money amounts.
         """
-        from decimal import Decimal
-        amount = Decimal(str(amount))
-        fee_percent = Decimal(str(self.platform_fee_percent))
-        min_fee = Decimal(str(self.min_platform_fee))
-        max_fee = Decimal(str(self.max_platform_fee))
-        
-        # Base calculation
-        total_fee = (amount * fee_percent) / Decimal('100')
-        
-        # Apply Min/Max Logic (Hybrid)
-        if min_fee > 0:
-            total_fee = max(total_fee, min_fee)
-        
-        if max_fee > 0:
-            total_fee = min(total_fee, max_fee)
-            
-        # Safety: Fee cannot exceed amount (for extremely small deals)
-        if total_fee > amount:
-            total_fee = amount
-        
-        client_fee = Decimal('0')
-        freelancer_fee = Decimal('0')
-        
-        if self.fee_payer == 'client':
-            client_fee = total_fee
-        elif self.fee_payer == 'freelancer':
-            freelancer_fee = total_fee
-        elif self.fee_payer == 'split':
-            client_fee = total_fee / Decimal('2')
-            freelancer_fee = total_fee / Decimal('2')
-            
-        # Round to 2 decimal places for kobo precision
-        def r2(val):
-            return float(Decimal(str(val)).quantize(Decimal('0.01')))
-
-        return {
-            'base_amount': float(amount),
-            'client_fee': r2(client_fee),
-            'freelancer_fee': r2(freelancer_fee),
-            'total_to_pay': r2(amount + client_fee),
-            'total_to_receive': r2(amount - freelancer_fee),
-            'platform_revenue': r2(client_fee + freelancer_fee)
-        }
+        from .fees import as_floats
+        return as_floats(self.fee_breakdown(amount))
+
+    def fee_breakdown(self, amount):
+        """Same breakdown as calculate_fee_breakdown(), as exact Money values."""
+        from .fees import fee_breakdown
+        return fee_breakdown(self, amount)
+
+    def calculate_fee_breakdowns(self, amounts):
+        """
+        Batch version of calculate_fee_breakdown(): returns one breakdown dict
+        per amount, computed in integer kobo by core.fees.
+        """
+        from .fees import bulk_fee_breakdown, breakdown_dicts
+        return breakdown_dicts(bulk_fee_breakdown(self, amounts))
 
     class Meta:
         verbose_name_plural = "Platform Settings"
@@ -183,6 +192,17 @@ class Notification(models.Model):
 # Import audit log model
 from .audit import AdminAuditLog
 
+class ReferenceSequence(models.Model):
+    """
+    Next free value of a reference ID sequence. Processes reserve values in
+    blocks, see core.references.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.name} @ {self.next_value}"
+
 class ThirdPartyIntegration(models.Model):
     SERVICE_CHOICES = (
         ('resend', 'Resend (Email)'),
@@ -0,0 +1,96 @@
+"""
+Integer-kobo money type shared by fees, gateways and wallet code.
+
+Amounts arrive as Decimal (model fields), int kobo (Paystack), or strings
+and floats (request bodies, Flutterwave). Convert them to Money once at the
+edge. From then on, arithmetic and comparisons are exact integer operations
+and nothing is re-parsed or rounded through float. Convert back with
+to_decimal() when writing a DecimalField.
+"""
+from decimal import Decimal, ROUND_HALF_EVEN
+from functools import total_ordering
+
+
+def to_kobo(amount):
+    """Convert a naira amount (Decimal, int, float or str) to integer kobo."""
+    if isinstance(amount, int):
+        return amount * 100
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return int(amount.scaleb(2).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+@total_ordering
+class Money:
+    """An immutable naira amount held as integer kobo."""
+    __slots__ = ('kobo',)
+
+    def __init__(self, kobo=0):
+        object.__setattr__(self, 'kobo', int(kobo))
+
+    @classmethod
+    def from_kobo(cls, kobo):
+        return cls(kobo)
+
+    @classmethod
+    def from_naira(cls, amount):
+        """Build from a naira amount, rounding half-even to the kobo."""
+        if isinstance(amount, Money):
+            return amount
+        return cls(to_kobo(amount))
+
+    def to_decimal(self):
+        """Naira as a two-place Decimal, ready for a DecimalField."""
+        return Decimal(self.kobo).scaleb(-2)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Money is immutable')
+
+    __delattr__ = __setattr__
+
+    def __reduce__(self):
+        return (Money, (self.kobo,))
+
+    def __add__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return Money(self.kobo + other.kobo)
+
+    def __sub__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return Money(self.kobo - other.kobo)
+
+    def __neg__(self):
+        return Money(-self.kobo)
+
+    def __abs__(self):
+        return Money(abs(self.kobo))
+
+    def __eq__(self, other):
+        if isinstance(other, Money):
+            return self.kobo == other.kobo
+        return NotImplemented
+
+    def __lt__(self, other):
+        if isinstance(other, Money):
+            return self.kobo < other.kobo
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.kobo)
+
+    def __bool__(self):
+        return self.kobo != 0
+
+    def __float__(self):
+        return self.kobo / 100
+
+    def __str__(self):
+        return str(self.to_decimal())
+
+    def __repr__(self):
+        return f"Money('{self}')"
+
+
+ZERO = Money(0)
@@ -0,0 +1,226 @@
+"""
+Reference IDs (DN-DL-XXXXXXXX, DN-DS-..., DN-USR-...) without a pre-insert
+existence check.
+
+Each process reserves a block of sequence values from ReferenceSequence, one
+query per block. Every value goes through a keyed Feistel permutation of
+the 40-bit code space, and the result is rendered in the existing 8-character
+alphabet. The codes look random but are unique within a sequence, and
+decode_reference() can recover the sequence value.
+
+Blocks are reserved in autocommit mode, so a reservation is durable before
+any of its codes is used. Inside a transaction that takes a connection of
+its own. Rolling back the caller's transaction then cannot hand the same
+block out again, and concurrent writers do not hold the sequence row for
+the length of their transactions.
+SQLite allows one writer at a time, so a second connection would wait on
+the caller's own transaction. There a reservation made inside a
+transaction is taken on the caller's connection and only covers the codes
+asked for; nothing is kept for later, so a rollback cannot leak codes.
+
+Codes issued before this allocator existed were random, and a new code can
+match one of them. That surfaces as an IntegrityError on insert.
+ReferenceIDMixin then drops the current block and retries, or raises if the
+insert ran inside a transaction, since a failed INSERT breaks it.
+"""
+import hashlib
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+
+REFERENCE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+REFERENCE_LENGTH = 8
+DEFAULT_BLOCK_SIZE = 100
+MAX_SAVE_ATTEMPTS = 5
+
+_HALF_BITS = REFERENCE_LENGTH * 5 // 2
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 4
+
+
+def _round_keys(prefix):
+    secret = f"{settings.SECRET_KEY}:reference:{prefix}".encode()
+    return [hashlib.blake2b(secret, digest_size=16, person=bytes([i]) * 16).digest() for i in range(_ROUNDS)]
+
+
+def _round(key, value):
+    digest = hashlib.blake2b(value.to_bytes(4, 'big'), key=key, digest_size=4).digest()
+    return int.from_bytes(digest, 'big') & _HALF_MASK
+
+
+def _permute(keys, value):
+    left, right = value >> _HALF_BITS, value & _HALF_MASK
+    for key in keys:
+        left, right = right, left ^ _round(key, right)
+    return (left << _HALF_BITS) | right
+
+
+def _unpermute(keys, value):
+    left, right = value >> _HALF_BITS, value & _HALF_MASK
+    for key in reversed(keys):
+        left, right = right ^ _round(key, left), left
+    return (left << _HALF_BITS) | right
+
+
+def _encode(value):
+    chars = []
+    for _ in range(REFERENCE_LENGTH):
+        value, index = divmod(value, len(REFERENCE_ALPHABET))
+        chars.append(REFERENCE_ALPHABET[index])
+    return ''.join(reversed(chars))
+
+
+def _decode(code):
+    value = 0
+    for char in code:
+        value = value * len(REFERENCE_ALPHABET) + REFERENCE_ALPHABET.index(char)
+    return value
+
+
+class ReferenceAllocator:
+    """Hands out DN-<prefix>-XXXXXXXX codes from per-process sequence blocks."""
+
+    def __init__(self, prefix, block_size=None):
+        self.prefix = prefix
+        self.block_size = block_size or getattr(settings, 'REFERENCE_ID_BLOCK_SIZE', DEFAULT_BLOCK_SIZE)
+        self._keys = _round_keys(prefix)
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+
+    @property
+    def sequence_name(self):
+        return f"reference:{self.prefix}"
+
+    def _advance(self, count):
+        """Move the sequence on by `count` on this thread's connection. Returns the first value."""
+        ReferenceSequence = apps.get_model('core', 'ReferenceSequence')
+        with transaction.atomic():
+            sequence, _ = ReferenceSequence.objects.select_for_update().get_or_create(name=self.sequence_name)
+            start = sequence.next_value
+            sequence.next_value = start + count
+            sequence.save(update_fields=['next_value'])
+        return start
+
+    def _reserve(self, count):
+        """Reserve `count` values in autocommit mode. Returns (start, end)."""
+        if not connection.in_atomic_block:
+            start = self._advance(count)
+            return start, start + count
+
+        # Connections are per thread, so a short-lived thread has its own,
+        # outside the caller's transaction
+        result = {}
+
+        def reserve():
+            try:
+                result['start'] = self._advance(count)
+            except Exception as e:
+                result['error'] = e
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=reserve, name=f"reserve-{self.sequence_name}")
+        thread.start()
+        thread.join()
+        if 'error' in result:
+            raise result['error']
+        return result['start'], result['start'] + count
+
+    def format(self, value):
+        return f"DN-{self.prefix}-{_encode(_permute(self._keys, value))}"
+
+    def decode(self, reference_id):
+        """Return the sequence value a reference ID was generated from."""
+        code = reference_id.rsplit('-', 1)[-1]
+        return _unpermute(self._keys, _decode(code))
+
+    def allocate(self, count=1):
+        """Return `count` fresh reference IDs."""
+        codes = []
+        with self._lock:
+            while len(codes) < count:
+                wanted = count - len(codes)
+                if self._next < self._end:
+                    take = min(self._end - self._next, wanted)
+                    codes.extend(self.format(value) for value in range(self._next, self._next + take))
+                    self._next += take
+                elif connection.in_atomic_block and connection.vendor == 'sqlite':
+                    # Only what this call needs: a rollback takes the reservation with it
+                    start = self._advance(wanted)
+                    codes.extend(self.format(value) for value in range(start, start + wanted))
+                else:
+                    self._next, self._end = self._reserve(max(self.block_size, wanted))
+        return codes
+
+    def next(self):
+        return self.allocate(1)[0]
+
+    def discard_block(self):
+        """Forget the current block, e.g. after it produced a duplicate."""
+        with self._lock:
+            self._next = self._end = 0
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+
+def get_allocator(prefix):
+    allocator = _allocators.get(prefix)
+    if allocator is None:
+        with _allocators_lock:
+            allocator = _allocators.setdefault(prefix, ReferenceAllocator(prefix))
+    return allocator
+
+
+def decode_reference(reference_id):
+    """Recover the sequence value behind an allocator-issued reference ID."""
+    prefix = reference_id.split('-')[1]
+    return get_allocator(prefix).decode(reference_id)
+
+
+def assign_reference_ids(objs):
+    """
+    Pre-assign reference IDs to unsaved instances so they can go through
+    bulk_create(), which bypasses save().
+    """
+    pending = [obj for obj in objs if not obj.reference_id]
+    if not pending:
+        return objs
+    codes = get_allocator(type(pending[0]).REFERENCE_PREFIX).allocate(len(pending))
+    for obj, code in zip(pending, codes):
+        obj.reference_id = code
+    return objs
+
+
+class ReferenceIDMixin:
+    """
+    Model mixin that fills `reference_id` on first save. The model sets
+    REFERENCE_PREFIX and declares a unique `reference_id` field.
+    """
+    REFERENCE_PREFIX = None
+
+    def save(self, *args, **kwargs):
+        if self.reference_id:
+            return super().save(*args, **kwargs)
+
+        allocator = get_allocator(self.REFERENCE_PREFIX)
+        using = kwargs.get('using') or 'default'
+        for attempt in range(MAX_SAVE_ATTEMPTS):
+            self.reference_id = allocator.next()
+            in_transaction = transaction.get_connection(using).in_atomic_block
+            try:
+                return super().save(*args, **kwargs)
+            except IntegrityError:
+                if in_transaction:
+                    # The failed INSERT broke the caller's transaction, so it cannot be retried here
+                    self.reference_id = None
+                    allocator.discard_block()
+                    raise
+                taken = type(self)._default_manager.using(using).filter(reference_id=self.reference_id).exists()
+                if not taken or attempt == MAX_SAVE_ATTEMPTS - 1:
+                    self.reference_id = None
+                    raise
+                allocator.discard_block()
@@ -0,0 +1,404 @@
+import pickle
+import random
+from decimal import Decimal
+from unittest.mock import patch
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from core import fees
+from core.cache import get_platform_secrets, get_platform_settings
+from core.models import JobType, PlatformSettings, ReferenceSequence, User
+from core.money import Money
+from core.references import ReferenceAllocator, assign_reference_ids, decode_reference, get_allocator
+from deals.models import Deal, Dispute
+from deals.services import DealService
+from payments.ledger import account_balance, user_account
+from payments.services import PaymentProcessor
+
+
+class PlatformSettingsCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.settings = PlatformSettings.objects.create(platform_fee_percent=Decimal('5.00'))
+
+    def test_warm_cache_runs_no_queries(self):
+        get_platform_settings()
+
+        with self.assertNumQueries(0):
+            for _ in range(10):
+                settings = get_platform_settings()
+
+        self.assertEqual(settings.pk, self.settings.pk)
+
+    def test_save_invalidates_snapshot(self):
+        self.assertEqual(get_platform_settings().platform_fee_percent, Decimal('5.00'))
+
+        self.settings.platform_fee_percent = Decimal('7.50')
+        self.settings.save()
+
+        self.assertEqual(get_platform_settings().platform_fee_percent, Decimal('7.50'))
+
+    def test_cache_flush_reloads_from_database(self):
+        get_platform_settings()
+        PlatformSettings.objects.filter(pk=self.settings.pk).update(fee_payer='client')
+        cache.clear()
+
+        self.assertEqual(get_platform_settings().fee_payer, 'client')
+
+    def test_secret_keys_stay_out_of_the_shared_cache(self):
+        PlatformSettings.objects.filter(pk=self.settings.pk).update(paystack_secret_key='sk_live_hidden')
+        cache.clear()
+
+        settings = get_platform_settings()
+        secrets = get_platform_secrets()
+
+        self.assertNotIn(b'sk_live_hidden', pickle.dumps(settings))
+        self.assertEqual(secrets['paystack_secret_key'], 'sk_live_hidden')
+        with self.assertNumQueries(0):
+            get_platform_secrets()
+
+    def test_fee_schedule_is_not_set_on_the_shared_snapshot(self):
+        settings = get_platform_settings()
+
+        schedule = fees.FeeSchedule.from_settings(settings)
+
+        self.assertIs(fees.FeeSchedule.from_settings(settings), schedule)
+        self.assertNotIn('_fee_schedule', vars(settings))
+        self.settings.platform_fee_percent = Decimal('7.50')
+        self.settings.save()
+        self.assertEqual(fees.FeeSchedule.from_settings(get_platform_settings()).percent_bp, 750)
+
+    def test_creates_default_row_when_missing(self):
+        self.settings.delete()
+
+        settings = get_platform_settings()
+
+        self.assertIsNotNone(settings.pk)
+        self.assertEqual(PlatformSettings.objects.count(), 1)
+
+
+def decimal_fee_breakdown(settings, amount):
+    """The original Decimal implementation of calculate_fee_breakdown(), kept as the reference."""
+    amount = Decimal(str(amount))
+    fee_percent = Decimal(str(settings.platform_fee_percent))
+    min_fee = Decimal(str(settings.min_platform_fee))
+    max_fee = Decimal(str(settings.max_platform_fee))
+
+    total_fee = (amount * fee_percent) / Decimal('100')
+    if min_fee > 0:
+        total_fee = max(total_fee, min_fee)
+    if max_fee > 0:
+        total_fee = min(total_fee, max_fee)
+    if total_fee > amount:
+        total_fee = amount
+
+    client_fee = Decimal('0')
+    freelancer_fee = Decimal('0')
+    if settings.fee_payer == 'client':
+        client_fee = total_fee
+    elif settings.fee_payer == 'freelancer':
+        freelancer_fee = total_fee
+    elif settings.fee_payer == 'split':
+        client_fee = total_fee / Decimal('2')
+        freelancer_fee = total_fee / Decimal('2')
+
+    def r2(val):
+        return float(Decimal(str(val)).quantize(Decimal('0.01')))
+
+    return {
+        'base_amount': float(amount),
+        'client_fee': r2(client_fee),
+        'freelancer_fee': r2(freelancer_fee),
+        'total_to_pay': r2(amount + client_fee),
+        'total_to_receive': r2(amount - freelancer_fee),
+        'platform_revenue': r2(client_fee + freelancer_fee)
+    }
+
+
+def random_fee_settings(rng):
+    return PlatformSettings(
+        platform_fee_percent=Decimal(rng.randint(0, 10000)) / 100,
+        min_platform_fee=Decimal(rng.choice([0, 0, rng.randint(1, 10 ** 6)])) / 100,
+        max_platform_fee=Decimal(rng.choice([0, 0, rng.randint(1, 10 ** 8)])) / 100,
+        fee_payer=rng.choice(['client', 'freelancer', 'split']),
+    )
+
+
+class MoneyTestCase(TestCase):
+    def test_fee_breakdown_matches_decimal_reference(self):
+        rng = random.Random(3)
+        for _ in range(200):
+            settings = random_fee_settings(rng)
+            for _ in range(50):
+                amount = Decimal(rng.randint(1, 10 ** rng.randint(1, 12))) / 100
+                expected = decimal_fee_breakdown(settings, amount)
+                breakdown = settings.fee_breakdown(amount)
+
+                self.assertEqual(settings.calculate_fee_breakdown(amount), expected, (settings.__dict__, amount))
+                self.assertEqual(
+                    {name: value.to_decimal() for name, value in breakdown.items()},
+                    {name: Decimal(str(value)).quantize(Decimal('0.01')) for name, value in expected.items()},
+                )
+
+    def test_arithmetic_matches_decimal(self):
+        rng = random.Random(5)
+        for _ in range(2000):
+            a = Decimal(rng.randint(-10 ** 12, 10 ** 12)) / 100
+            b = Decimal(rng.randint(-10 ** 12, 10 ** 12)) / 100
+            x, y = Money.from_naira(a), Money.from_naira(b)
+
+            self.assertEqual(x.to_decimal(), a)
+            self.assertEqual((x + y).to_decimal(), a + b)
+            self.assertEqual((x - y).to_decimal(), a - b)
+            self.assertEqual(x < y, a < b)
+            self.assertEqual(x == y, a == b)
+            self.assertEqual(float(x), float(a))
+            self.assertEqual(str(x), str(a.quantize(Decimal('0.01'))))
+
+    def test_parses_every_input_type_to_the_kobo(self):
+        self.assertEqual(Money.from_naira(Decimal('1025.50')).kobo, 102550)
+        self.assertEqual(Money.from_naira('1025.5').kobo, 102550)
+        self.assertEqual(Money.from_naira(1025.5).kobo, 102550)
+        self.assertEqual(Money.from_naira(1025).kobo, 102500)
+        self.assertEqual(Money.from_naira(0.1 + 0.2).kobo, 30)
+        self.assertEqual(Money.from_kobo(102550), Money.from_naira('1025.50'))
+
+    def test_is_immutable_and_compact(self):
+        money = Money.from_naira('10.00')
+
+        with self.assertRaises(AttributeError):
+            money.kobo = 5
+        self.assertFalse(hasattr(money, '__dict__'))
+        self.assertEqual(pickle.loads(pickle.dumps(money)), money)
+
+
+class BulkFeeBreakdownTestCase(TestCase):
+    FEE_SETTINGS = [
+        {'platform_fee_percent': Decimal('5.00'), 'fee_payer': 'split'},
+        {'platform_fee_percent': Decimal('7.35'), 'fee_payer': 'client'},
+        {'platform_fee_percent': Decimal('2.50'), 'fee_payer': 'freelancer',
+         'min_platform_fee': Decimal('100.00'), 'max_platform_fee': Decimal('2500.00')},
+        {'platform_fee_percent': Decimal('3.33'), 'fee_payer': 'split', 'min_platform_fee': Decimal('0.05')},
+    ]
+
+    def _amounts(self, count):
+        rng = random.Random(count)
+        amounts = [Decimal('0.01'), Decimal('0.03'), Decimal('1.01'), Decimal('99999999.99')]
+        amounts += [Decimal(rng.randint(1, 10 ** 9)) / 100 for _ in range(count)]
+        return amounts
+
+    def _assert_matches_scalar(self, amounts):
+        for overrides in self.FEE_SETTINGS:
+            settings = PlatformSettings(**overrides)
+            expected = [decimal_fee_breakdown(settings, amount) for amount in amounts]
+            self.assertEqual(settings.calculate_fee_breakdowns(amounts), expected, overrides)
+
+    def test_matches_scalar_breakdown(self):
+        self._assert_matches_scalar(self._amounts(500))
+
+    def test_pure_integer_fallback_matches_scalar(self):
+        with patch.object(fees, 'np', None):
+            self._assert_matches_scalar(self._amounts(500))
+
+    def test_columns_are_integer_kobo(self):
+        settings = PlatformSettings(platform_fee_percent=Decimal('5.00'), fee_payer='split')
+
+        columns = fees.bulk_fee_breakdown(settings, [Decimal('1000.00'), Decimal('0.01')])
+
+        self.assertEqual(columns['client_fee'], [2500, 0])
+        self.assertEqual(columns['total_to_pay'], [102500, 1])
+        self.assertEqual(fees.column_total(columns['platform_revenue']), 5000)
+
+
+class ReferenceAllocatorTestCase(TestCase):
+    def setUp(self):
+        self.client_user = User.objects.create_user(username='refclient', email='ref@example.com')
+
+    def _deal(self, **kwargs):
+        return Deal(client=self.client_user, title='Logo', description='Desc', amount=Decimal('5000.00'), **kwargs)
+
+    def test_codes_are_unique_and_reversible(self):
+        allocator = ReferenceAllocator('DL', block_size=50)
+
+        codes = allocator.allocate(500)
+
+        self.assertEqual(len(set(codes)), 500)
+        for code in codes:
+            self.assertRegex(code, r'^DN-DL-[A-HJ-NP-Z2-9]{8}$')
+        values = [allocator.decode(code) for code in codes]
+        self.assertEqual(values, list(range(values[0], values[0] + 500)))
+
+    def test_save_does_not_check_for_existing_codes(self):
+        Deal.objects.create(client=self.client_user, title='Warm', description='Desc', amount=100)
+        deal = self._deal()
+
+        with CaptureQueriesContext(connection) as queries:
+            deal.save()
+
+        self.assertTrue(deal.reference_id.startswith('DN-DL-'))
+        self.assertFalse([q for q in queries if q['sql'].startswith('SELECT') and '"deals_deal"' in q['sql']])
+
+    def test_insert_in_a_transaction_takes_no_savepoint(self):
+        with CaptureQueriesContext(connection) as queries:
+            self._deal(unique_shareable_url='first').save()
+
+        sqls = [q['sql'] for q in queries]
+        insert = next(i for i, sql in enumerate(sqls) if sql.startswith('INSERT INTO "deals_deal"'))
+        # Savepoints before it belong to the sequence reservation, not the insert
+        self.assertFalse(sqls[insert - 1].startswith('SAVEPOINT'))
+        self.assertFalse([sql for sql in sqls[insert:] if 'SAVEPOINT' in sql])
+
+    def test_clash_in_a_transaction_drops_the_block_and_raises(self):
+        allocator = get_allocator('DL')
+        allocator.discard_block()
+        next_code = allocator.allocate(1)[0]
+        ReferenceSequence.objects.filter(name=allocator.sequence_name).update(next_value=allocator.decode(next_code))
+        Deal.objects.bulk_create([self._deal(reference_id=next_code, unique_shareable_url='legacy')])
+
+        deal = self._deal()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            deal.save()
+
+        self.assertIsNone(deal.reference_id)
+
+    def test_assign_reference_ids_for_bulk_create(self):
+        deals = [self._deal(unique_shareable_url=f'bulk-{i}') for i in range(25)]
+
+        Deal.objects.bulk_create(assign_reference_ids(deals))
+
+        references = set(Deal.objects.filter(unique_shareable_url__startswith='bulk-').values_list('reference_id', flat=True))
+        self.assertEqual(len(references), 25)
+        self.assertEqual(decode_reference(deals[0].reference_id) + 1, decode_reference(deals[1].reference_id))
+
+    def test_users_and_disputes_get_prefixed_codes(self):
+        deal = Deal.objects.create(client=self.client_user, title='T', description='D', amount=100)
+        dispute = Dispute.objects.create(deal=deal, opened_by=self.client_user, reason='Late')
+
+        self.assertTrue(self.client_user.reference_id.startswith('DN-USR-'))
+        self.assertTrue(dispute.reference_id.startswith('DN-DS-'))
+
+
+class UserBalanceSaveTestCase(TestCase):
+    def test_save_does_not_write_back_a_stale_balance(self):
+        user = User.objects.create_user(username='saver', email='saver@example.com', balance=1000)
+        stale = User.objects.get(pk=user.pk)
+        User.objects.filter(pk=user.pk).update(balance=250)
+
+        stale.email_verified = True
+        stale.save()
+
+        user.refresh_from_db()
+        self.assertEqual((user.balance, user.email_verified), (250, True))
+
+    def test_balance_is_saved_when_named(self):
+        user = User.objects.create_user(username='saver', email='saver@example.com', balance=1000)
+        user.balance = 400
+        user.save(update_fields=['balance'])
+        user.refresh_from_db()
+        self.assertEqual(user.balance, 400)
+
+
+class AdminDealActionTestCase(TestCase):
+    def setUp(self):
+        PlatformSettings.objects.create(active_gateway='paystack', platform_fee_percent=10, fee_payer='split')
+        job_type = JobType.objects.create(name='Dev', slug='dev')
+        self.client_user = User.objects.create_user(username='client', email='client@example.com')
+        self.freelancer = User.objects.create_user(username='freelancer', email='freelancer@example.com')
+        self.deal = Deal.objects.create(
+            client=self.client_user, freelancer=self.freelancer, job_type=job_type,
+            title='Logo', description='Desc', amount=10000,
+        )
+        PaymentProcessor.process_successful_payment('DEP-1', Money.from_naira(10500), 'paystack', {}, resolved=('deposit', self.client_user))
+        self.client_user.refresh_from_db()
+        DealService.fund_deal(self.deal, self.client_user, payment_method='wallet')
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+
+    def act(self, action, **data):
+        return self.api.post(f'/api/admin/deals/{self.deal.id}/', {'action': action, **data}, format='json')
+
+    def test_force_complete_settles_once(self):
+        self.assertEqual(self.act('force_complete').status_code, 200)
+        response = self.act('force_complete')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(account_balance(user_account(self.freelancer)), Money.from_naira(9500))
+
+    def test_stats_revenue_is_the_booked_fees(self):
+        self.act('force_complete')
+        # Later fee changes do not rewrite what was charged
+        PlatformSettings.objects.update(platform_fee_percent=20)
+        cache.clear()
+
+        response = self.api.get('/api/admin/stats/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['financials']['estimated_revenue'], 1000.0)
+
+    def test_cancel_after_completion_does_not_refund(self):
+        self.act('force_complete')
+        response = self.act('cancel_deal')
+
+        self.assertEqual(response.status_code, 400)
+        self.deal.refresh_from_db()
+        self.assertEqual(self.deal.status, 'completed')
+        self.assertEqual(account_balance(user_account(self.client_user)), Money.from_naira(0))
+
+    def test_update_status_cannot_set_a_settled_status(self):
+        self.assertEqual(self.act('update_status', status='completed').status_code, 400)
+        self.assertEqual(self.act('update_status', status='in_progress').status_code, 200)
+        self.deal.refresh_from_db()
+        self.assertEqual(self.deal.status, 'in_progress')
+
+    def test_dispute_resolution_loses_to_a_settled_deal(self):
+        dispute = Dispute.objects.create(deal=self.deal, opened_by=self.client_user, reason='Late')
+        Deal.objects.filter(pk=self.deal.pk).update(status='disputed')
+        # Settled by another admin between the dispute being loaded and resolved
+        self.act('force_complete')
+
+        response = self.api.post(f'/api/admin/disputes/{dispute.id}/resolve/', {'decision': 'full_refund'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        dispute.refresh_from_db()
+        self.assertIsNone(dispute.resolved_at)
+        self.assertEqual(account_balance(user_account(self.client_user)), Money.from_naira(0))
+
+
+class ReferenceAllocatorAutocommitTestCase(TransactionTestCase):
+    def setUp(self):
+        self.allocator = get_allocator('USR')
+        self.allocator.discard_block()
+        self.addCleanup(self.allocator.discard_block)
+
+    def test_block_reserved_in_autocommit_is_kept(self):
+        User.objects.create_user(username='autocommit', email='autocommit@example.com')
+
+        with CaptureQueriesContext(connection) as queries:
+            user = User.objects.create_user(username='second', email='second@example.com')
+
+        self.assertTrue(user.reference_id.startswith('DN-USR-'))
+        self.assertFalse([q for q in queries if 'referencesequence' in q['sql']])
+
+    def test_reservation_in_a_transaction_survives_its_rollback(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            start, end = self.allocator._reserve(10)
+            raise RuntimeError
+
+        sequence = ReferenceSequence.objects.get(name=self.allocator.sequence_name)
+        self.assertEqual((end - start, sequence.next_value), (10, end))
+
+    def test_retries_when_code_is_already_taken(self):
+        next_code = self.allocator.allocate(1)[0]
+        self.allocator.discard_block()
+        # Occupy the code the allocator is about to hand out, as a legacy random ID would
+        ReferenceSequence.objects.filter(name=self.allocator.sequence_name).update(
+            next_value=self.allocator.decode(next_code)
+        )
+        User.objects.create_user(username='legacy', email='legacy@example.com', reference_id=next_code)
+
+        user = User.objects.create_user(username='fresh', email='fresh@example.com')
+
+        self.assertNotEqual(user.reference_id, next_code)
+        self.assertTrue(user.reference_id.startswith('DN-USR-'))
@@ -4,7 +4,8 @@ from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth import get_user_model
 from .serializers import UserSerializer, RegisterSerializer, NotificationSerializer
-from .models import Notification, PlatformSettings
+from .models import Notification
+from .cache import get_platform_settings
 
 User = get_user_model()
 
@@ -43,7 +44,7 @@ class UserViewSet(viewsets.ModelViewSet):
          user = request.user
          user.email_verified = True
          user.kyc_status = 'basic'
-         user.save()
+         user.save(update_fields=['email_verified', 'kyc_status'])
          return Response({'status': 'verified', 'message': 'Email verified successfully'})
 
 class PublicProfileView(generics.RetrieveAPIView):
@@ -120,10 +121,7 @@ class PlatformSettingsView(APIView):
     permission_classes = [permissions.AllowAny] # Using AllowAny so register/login can potentially see public keys if needed, or IsAuthenticated
 
     def get(self, request):
-        settings = PlatformSettings.objects.first()
-        if not settings:
-            return Response({})
-            
+        settings = get_platform_settings()
         return Response({
             'active_gateway': settings.active_gateway,
             'paystack_public_key': settings.paystack_public_key,
@@ -186,12 +186,39 @@ CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/
 CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+CELERY_BEAT_SCHEDULE = {
+    'process-payout-queue': {'task': 'payments.tasks.process_payout_queue', 'schedule': 60.0},
+    'reconcile-payouts': {'task': 'payments.tasks.reconcile_payouts', 'schedule': 15 * 60.0},
+    'reconcile-withdrawals': {'task': 'payments.tasks.reconcile_withdrawals', 'schedule': 15 * 60.0},
+    'reconcile-payments': {'task': 'payments.tasks.reconcile_payments', 'schedule': 10 * 60.0},
+    'process-webhook-events': {'task': 'payments.tasks.process_webhook_events', 'schedule': 60.0},
+    'purge-webhook-events': {'task': 'payments.tasks.purge_webhook_events', 'schedule': 24 * 60 * 60.0},
+}
 
-# If no Redis available (e.g. naive Windows setup), use eager execution for tasks
+# If no Redis available (e.g. naive Windows setup), use eager execution for tasks.
+# Webhooks are then processed after the response is sent, and there is no beat:
+# call /api/payments/cron/process-webhooks/ from cron (see payments/webhooks.py).
 if not os.environ.get('CELERY_BROKER_URL') and 'Redis' not in os.environ.get('OS', ''):
      CELERY_TASK_ALWAYS_EAGER = True
      CELERY_TASK_EAGER_PROPAGATES = True
 
+# Cache
+# Shared across workers when Redis is available so PlatformSettings invalidation
+# reaches every process; falls back to a per-process memory cache otherwise.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Email Configuration
 EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
 EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.resend.com')
@@ -368,3 +395,41 @@ PAYSTACK_SECRET_KEY = os.environ.get('PAYSTACK_SECRET_KEY', '')
 # Flutterwave Configuration (optional)
 FLUTTERWAVE_PUBLIC_KEY = os.environ.get('FLUTTERWAVE_PUBLIC_KEY', '')
 FLUTTERWAVE_SECRET_KEY = os.environ.get('FLUTTERWAVE_SECRET_KEY', '')
+# Point these at `manage.py run_gateway_simulator` for load testing
+PAYSTACK_BASE_URL = os.environ.get('PAYSTACK_BASE_URL', 'https://api.paystack.co')
+FLUTTERWAVE_BASE_URL = os.environ.get('FLUTTERWAVE_BASE_URL', 'https://api.flutterwave.com/v3')
+
+# Payment gateway HTTP client (see payments/transport.py)
+PAYMENT_GATEWAY_CONNECT_TIMEOUT = float(os.environ.get('PAYMENT_GATEWAY_CONNECT_TIMEOUT', 3.05))
+PAYMENT_GATEWAY_READ_TIMEOUT = float(os.environ.get('PAYMENT_GATEWAY_READ_TIMEOUT', 20))
+PAYMENT_GATEWAY_GET_RETRIES = int(os.environ.get('PAYMENT_GATEWAY_GET_RETRIES', 2))
+PAYMENT_GATEWAY_RETRY_BUDGET = float(os.environ.get('PAYMENT_GATEWAY_RETRY_BUDGET', 5))
+PAYMENT_GATEWAY_POOL_SIZE = int(os.environ.get('PAYMENT_GATEWAY_POOL_SIZE', 10))
+PAYMENT_GATEWAY_ASYNC_POOL_SIZE = int(os.environ.get('PAYMENT_GATEWAY_ASYNC_POOL_SIZE', 200))
+# Circuit breaker shared by all workers (see payments/health.py). With failover on,
+# payment initialization moves to the other configured gateway while the active one is open.
+GATEWAY_HEALTH_WINDOW = int(os.environ.get('GATEWAY_HEALTH_WINDOW', 60))
+GATEWAY_BREAKER_MIN_CALLS = int(os.environ.get('GATEWAY_BREAKER_MIN_CALLS', 20))
+GATEWAY_BREAKER_FAILURE_RATE = float(os.environ.get('GATEWAY_BREAKER_FAILURE_RATE', 0.5))
+GATEWAY_BREAKER_SLOW_CALL = float(os.environ.get('GATEWAY_BREAKER_SLOW_CALL', 10))
+GATEWAY_BREAKER_COOLDOWN = int(os.environ.get('GATEWAY_BREAKER_COOLDOWN', 30))
+PAYMENT_GATEWAY_FAILOVER = os.environ.get('PAYMENT_GATEWAY_FAILOVER', 'False') == 'True'
+# Serve verify/deposit/withdraw through the async views; only worth it under an ASGI server
+PAYMENTS_ASYNC_VIEWS = os.environ.get('PAYMENTS_ASYNC_VIEWS', 'False') == 'True'
+
+# Batched payouts (see payments/payouts.py). When on, withdrawals are queued and
+# sent through the bulk transfer API by the process_payout_queue task.
+PAYOUTS_BATCHED = os.environ.get('PAYOUTS_BATCHED', 'False') == 'True'
+PAYOUT_BATCH_SIZE = int(os.environ.get('PAYOUT_BATCH_SIZE', 100))
+PAYOUT_CONCURRENCY = int(os.environ.get('PAYOUT_CONCURRENCY', 4))
+
+# Reconciliation of pending payments with the gateway (see payments/reconciliation.py)
+RECONCILE_CHUNK_SIZE = int(os.environ.get('RECONCILE_CHUNK_SIZE', 200))
+RECONCILE_CONCURRENCY = int(os.environ.get('RECONCILE_CONCURRENCY', 10))
+
+# Webhook events are stored on receipt and processed by Celery (see payments/webhooks.py).
+# A failing event is retried with exponential backoff, then dead-lettered.
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 8))
+WEBHOOK_RETRY_BASE_DELAY = float(os.environ.get('WEBHOOK_RETRY_BASE_DELAY', 30))
+# Processed events are kept this long so gateway redeliveries are recognised
+WEBHOOK_RETENTION_DAYS = int(os.environ.get('WEBHOOK_RETENTION_DAYS', 30))
@@ -1,13 +1,20 @@
 from django.contrib import admin
+from django.utils import timezone
+from .cache import invalidate_public_deal
 from .models import Deal, DealMessage, Dispute
 
+def _bulk_set_status(queryset, status):
+    # .update() skips Deal.save(), so bump updated_at and drop the cached public pages here
+    invalidate_public_deal(*queryset.values_list('unique_shareable_url', flat=True))
+    queryset.update(status=status, updated_at=timezone.now())
+
 @admin.action(description='Mark selected deals as Completed')
 def make_completed(modeladmin, request, queryset):
-    queryset.update(status='completed')
+    _bulk_set_status(queryset, 'completed')
 
 @admin.action(description='Cancel selected deals')
 def make_cancelled(modeladmin, request, queryset):
-    queryset.update(status='cancelled')
+    _bulk_set_status(queryset, 'cancelled')
 
 @admin.register(Deal)
 class DealAdmin(admin.ModelAdmin):
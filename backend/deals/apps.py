@@ -3,3 +3,11 @@ from django.apps import AppConfig
 class DealsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'deals'
+
+    def ready(self):
+        from django.conf import settings
+        from django.db.models.signals import post_save
+
+        from .cache import invalidate_user_deals
+
+        post_save.connect(invalidate_user_deals, sender=settings.AUTH_USER_MODEL, dispatch_uid='deals_user_profile')
@@ -0,0 +1,91 @@
+"""
+Per-slug cache of the public deal page (PublicDealView).
+
+Each entry holds the serialized deal and its ETag. The fee breakdown depends
+on the platform settings, so both the ETag and the cache key include the
+settings version along with the deal's updated_at. The page also shows the
+client's and freelancer's public profiles. Users have no updated_at, so each
+one gets a version token in the cache, and the ETag includes both tokens.
+Saving a user's public fields replaces the token and drops the cached pages
+of that user's deals (invalidate_user_deals(), connected in DealsConfig).
+
+Anything that changes what the page shows must call invalidate_public_deal():
+Deal.save()/delete(), new submissions, and queryset .update()s of deals,
+which must also set updated_at.
+"""
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from core.cache import platform_settings_version
+
+PUBLIC_DEAL_KEY = 'deals:public:{version}:{slug}'
+PUBLIC_DEAL_TIMEOUT = 60 * 5
+USER_VERSION_KEY = 'deals:public:user:{user_id}'
+
+
+def _user_versions(*user_ids):
+    keys = [USER_VERSION_KEY.format(user_id=user_id) for user_id in user_ids if user_id]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Never set or evicted: start a fresh token so no ETag from
+            # before the eviction can match again
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return ':'.join(versions[key] for key in keys)
+
+
+def public_deal_etag(deal_id, updated_at, client_id=None, freelancer_id=None):
+    users = _user_versions(client_id, freelancer_id)
+    digest = hashlib.blake2b(
+        f"{deal_id}:{updated_at.isoformat()}:{platform_settings_version()}:{users}".encode(), digest_size=16
+    ).hexdigest()
+    return f'"{digest}"'
+
+
+def _key(slug):
+    return PUBLIC_DEAL_KEY.format(version=platform_settings_version(), slug=slug)
+
+
+def get_cached_public_deal(slug):
+    """Return (etag, data) for the slug, or None on a miss."""
+    return cache.get(_key(slug))
+
+
+def cache_public_deal(slug, etag, data):
+    cache.set(_key(slug), (etag, data), PUBLIC_DEAL_TIMEOUT)
+
+
+def invalidate_public_deal(*slugs):
+    """
+    Drop the cached pages for these slugs now, and again once the surrounding
+    transaction commits so a concurrent reader cannot re-cache the old row.
+    """
+    keys = [_key(slug) for slug in slugs if slug]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _bump_user_version(user_id):
+    cache.set(USER_VERSION_KEY.format(user_id=user_id), uuid.uuid4().hex, None)
+
+
+def invalidate_user_deals(sender, instance, created=False, update_fields=None, **kwargs):
+    """post_save receiver for the user model: a profile change shows on every page of the user's deals."""
+    from core.serializers import PublicUserSerializer
+    from .models import Deal
+
+    if created or (update_fields is not None and not set(PublicUserSerializer.Meta.fields) & set(update_fields)):
+        return
+
+    _bump_user_version(instance.pk)
+    transaction.on_commit(lambda: _bump_user_version(instance.pk))
+    invalidate_public_deal(*Deal.objects.filter(
+        Q(client_id=instance.pk) | Q(freelancer_id=instance.pk)
+    ).values_list('unique_shareable_url', flat=True))
@@ -1,7 +1,9 @@
+from django.db import transaction
 from django.http import JsonResponse
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from .models import Deal
+from .transitions import try_transition
 from .services import DealService
 import os
 import logging
@@ -35,12 +37,13 @@ def cron_release_funds(request):
         
         for deal in expired_deals:
             try:
-                # Mark as completed
-                deal.status = 'completed'
-                deal.save()
-                
-                # Release funds to freelancer
-                DealService.release_payout(deal)
+                with transaction.atomic():
+                    # Mark as completed, unless the client approved or disputed it meanwhile
+                    if not try_transition(deal, 'auto_release'):
+                        continue
+                    
+                    # Release funds to freelancer
+                    DealService.release_payout(deal)
                 count += 1
             except Exception as e:
                 error_msg = f"Error releasing deal {deal.id}: {str(e)}"
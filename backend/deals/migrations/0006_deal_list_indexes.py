@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_referencesequence'),
+        ('deals', '0005_deal_reference_id_dispute_reference_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deal',
+            index=models.Index(fields=['client', 'created_at'], name='deal_client_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deal',
+            index=models.Index(fields=['freelancer', 'created_at'], name='deal_freelancer_created_idx'),
+        ),
+    ]
@@ -1,12 +1,16 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from django.utils.text import slugify
 from django.utils.crypto import get_random_string
 import uuid
 
+from core.references import ReferenceIDMixin
+from .cache import invalidate_public_deal
+
 User = settings.AUTH_USER_MODEL
 
-class Deal(models.Model):
+class Deal(ReferenceIDMixin, models.Model):
     STATUS_CHOICES = (
         ('created', 'Created'),
         ('funded', 'Funded'),
@@ -44,20 +48,30 @@ class Deal(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # reference_id is generated as DN-DL-XXXXXXXX on first save
+    REFERENCE_PREFIX = 'DL'
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of each side of the deals list
+            models.Index(fields=['client', 'created_at'], name='deal_client_created_idx'),
+            models.Index(fields=['freelancer', 'created_at'], name='deal_freelancer_created_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.unique_shareable_url:
-            self.unique_shareable_url = slugify(self.title[:50]) + '-' + get_random_string(8)
-        
-        if not self.reference_id:
-            # Generate DN-DL-XXXXXX format
-            unique_code = get_random_string(8, allowed_chars='ABCDEFGHJKLMNPQRSTUVWXYZ23456789')
-            self.reference_id = f"DN-DL-{unique_code}"
-            # Ensure uniqueness
-            while Deal.objects.filter(reference_id=self.reference_id).exists():
-                unique_code = get_random_string(8, allowed_chars='ABCDEFGHJKLMNPQRSTUVWXYZ23456789')
-                self.reference_id = f"DN-DL-{unique_code}"
+            self.unique_shareable_url = self.generate_shareable_url(self.title)
         
         super(Deal, self).save(*args, **kwargs)
+        invalidate_public_deal(self.unique_shareable_url)
+
+    def delete(self, *args, **kwargs):
+        invalidate_public_deal(self.unique_shareable_url)
+        return super().delete(*args, **kwargs)
+
+    @staticmethod
+    def generate_shareable_url(title):
+        return slugify(title[:50]) + '-' + get_random_string(8)
 
     def __str__(self):
         return f"{self.title} ({self.get_status_display()})"
@@ -76,6 +90,12 @@ class DealSubmission(models.Model):
     class Meta:
         ordering = ['-created_at']
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Submissions are part of the public deal page, so they change its ETag
+        Deal.objects.filter(pk=self.deal_id).update(updated_at=timezone.now())
+        invalidate_public_deal(self.deal.unique_shareable_url)
+
     def __str__(self):
         return f"Submission for {self.deal} - Round {self.revision_round}"
 
@@ -89,7 +109,7 @@ class DealMessage(models.Model):
     def __str__(self):
         return f"Message by {self.user} on {self.deal}"
 
-class Dispute(models.Model):
+class Dispute(ReferenceIDMixin, models.Model):
     DECISION_CHOICES = (
         ('release_to_freelancer', 'Release to Freelancer'),
         ('partial_refund', 'Partial Refund'),
@@ -108,16 +128,8 @@ class Dispute(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     resolved_at = models.DateTimeField(null=True, blank=True)
 
+    # reference_id is generated as DN-DS-XXXXXXXX on first save
+    REFERENCE_PREFIX = 'DS'
+
     def __str__(self):
         return f"Dispute for {self.deal}"
-
-    def save(self, *args, **kwargs):
-        if not self.reference_id:
-            # Generate DN-DS-XXXXXX format
-            unique_code = get_random_string(8, allowed_chars='ABCDEFGHJKLMNPQRSTUVWXYZ23456789')
-            self.reference_id = f"DN-DS-{unique_code}"
-            # Ensure uniqueness
-            while Dispute.objects.filter(reference_id=self.reference_id).exists():
-                unique_code = get_random_string(8, allowed_chars='ABCDEFGHJKLMNPQRSTUVWXYZ23456789')
-                self.reference_id = f"DN-DS-{unique_code}"
-        super(Dispute, self).save(*args, **kwargs)
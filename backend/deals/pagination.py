@@ -0,0 +1,141 @@
+"""
+Keyset pagination for deal lists.
+
+Pages are addressed by an opaque cursor holding the (created_at, id) of the
+row at the page boundary, so page N costs the same as page 1: no COUNT(*)
+and no OFFSET scan.
+
+The queryset may be given as a list of branch querysets, e.g. "deals I
+created" and "deals I am hired on". Each branch is paged on its own with
+its own (user, created_at) index and LIMIT, so no branch reads more than a
+page. On backends that allow ORDER BY/LIMIT inside a compound query
+(PostgreSQL, MySQL) the branches are sent as one UNION ALL. Django refuses
+that on SQLite (supports_slicing_ordering_in_compound is False), so there
+each branch is a query of its own and the sorted results are merged in
+Python. The branches must not overlap and must share the same
+select_related(), only() and prefetch_related() lookups.
+
+Unlike DRF's PageNumberPagination the response has no `count`: a total
+would need the COUNT(*) this pagination exists to avoid. Clients get
+`next`, `previous` and `results`.
+"""
+import base64
+import heapq
+import json
+from datetime import datetime
+
+from django.db import connections
+from django.db.models import Q, prefetch_related_objects
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class DealCursorPagination(BasePagination):
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        branches = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.limit = self.get_page_size(request)
+        self.reverse, position = self.decode_cursor(request)
+        # Prefetch once for the merged page rather than once per branch
+        prefetch = branches[0]._prefetch_related_lookups
+
+        pages = [self._page_branch(branch.prefetch_related(None), position) for branch in branches]
+        rows = list(self._combine(pages, connections[branches[0].db]))
+        has_more = len(rows) > self.limit
+        page = rows[:self.limit]
+        if self.reverse:
+            page.reverse()
+        if prefetch:
+            prefetch_related_objects(page, *prefetch)
+
+        # Walking forward there is always a page behind us once a cursor was
+        # used; walking back there is always a page ahead
+        if self.reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = page
+        return page
+
+    def _page_branch(self, queryset, position):
+        if position is not None:
+            created_at, pk = position
+            if self.reverse:
+                queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+            else:
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        return queryset.order_by(*self._ordering())[:self.limit + 1]
+
+    def _ordering(self):
+        return ('created_at', 'id') if self.reverse else ('-created_at', '-id')
+
+    def _combine(self, pages, connection):
+        if len(pages) > 1 and connection.features.supports_slicing_ordering_in_compound:
+            return pages[0].union(*pages[1:], all=True).order_by(*self._ordering())[:self.limit + 1]
+        rows = heapq.merge(*(list(page) for page in pages), key=self._sort_key, reverse=not self.reverse)
+        return list(rows)[:self.limit + 1]
+
+    @staticmethod
+    def _sort_key(deal):
+        return deal.created_at, deal.id
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            return bool(data['r']), (datetime.fromisoformat(data['c']), int(data['i']))
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, deal, reverse):
+        data = json.dumps({'r': reverse, 'c': deal.created_at.isoformat(), 'i': deal.id}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(data.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -1,6 +1,9 @@
 from rest_framework import serializers
+from django.db import models
+from django.db.models import Prefetch
 from .models import Deal, DealMessage, Dispute, DealSubmission
 from core.models import JobType
+from core.cache import get_platform_settings
 from core.serializers import UserSerializer, PublicUserSerializer
 
 class JobTypeSerializer(serializers.ModelSerializer):
@@ -20,7 +23,49 @@ class DealMessageSerializer(serializers.ModelSerializer):
         model = DealMessage
         fields = ['id', 'user', 'message', 'files', 'created_at']
 
-class DealSerializer(serializers.ModelSerializer):
+class FeeBreakdownListSerializer(serializers.ListSerializer):
+    """
+    Computes fee breakdowns for the whole list in one batch instead of one
+    calculate_fee_breakdown() call per row.
+    """
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        deals = list(iterable)
+        if 'fee_breakdown' not in self.child.fields:
+            return super().to_representation(deals)
+        breakdowns = self.child.platform_settings.calculate_fee_breakdowns([deal.amount for deal in deals])
+        self.child.fee_breakdowns = {id(deal): breakdown for deal, breakdown in zip(deals, breakdowns)}
+        try:
+            return super().to_representation(deals)
+        finally:
+            self.child.fee_breakdowns = None
+
+def _field_list(value):
+    return {name.strip() for name in value.split(',') if name.strip()} if value else set()
+
+class SparseFieldsetMixin:
+    """
+    `?fields=a,b` limits the output to the named fields. `?expand=c,d` adds
+    fields that Meta.default_fields leaves out. Write-only fields are never
+    dropped.
+    """
+    def get_field_names(self, declared_fields, info):
+        # Filtering the names, not the built fields, skips building the dropped ones
+        names = super().get_field_names(declared_fields, info)
+        request = self.context.get('request')
+        params = request.query_params if request is not None else {}
+        keep = _field_list(params.get('fields')) or set(getattr(self.Meta, 'default_fields', names))
+        keep |= _field_list(params.get('expand'))
+        return [
+            name for name in names
+            if name in keep or getattr(declared_fields.get(name), 'write_only', False)
+        ]
+
+    @property
+    def readable_field_names(self):
+        return [name for name, field in self.fields.items() if not field.write_only]
+
+class DealSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     client = UserSerializer(read_only=True)  # Will be overridden dynamically or check context? 
     # Actually, we should use Public for both by default, and only show full details if 'me'?
     # Safer: Use PublicUserSerializer by default.
@@ -44,6 +89,54 @@ class DealSerializer(serializers.ModelSerializer):
             'fee_breakdown'
         ]
         read_only_fields = ['status', 'unique_shareable_url', 'client', 'freelancer', 'dispute_window_expires']
+        list_serializer_class = FeeBreakdownListSerializer
+
+    fee_breakdowns = None
+
+    # Columns and relations behind the fields that are not plain Deal columns:
+    # field -> (only() paths, select_related() paths)
+    FIELD_LOADING = {
+        'client': (['client'], ['client']),
+        'freelancer': (['freelancer'], ['freelancer']),
+        'job_type_details': (['job_type'], ['job_type']),
+        'submissions': ([], []),
+        'fee_breakdown': (['amount'], []),
+        'counterpart': (
+            ['client__username', 'client__first_name', 'client__last_name',
+             'freelancer__username', 'freelancer__first_name', 'freelancer__last_name'],
+            ['client', 'freelancer'],
+        ),
+    }
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, field_names=None):
+        """
+        Load everything the serializer touches up front: one JOIN plus one
+        prefetch. Given the output field names, load only those columns and
+        relations.
+        """
+        submissions = Prefetch('submissions', queryset=DealSubmission.objects.order_by('-created_at'))
+        if field_names is None:
+            return queryset.select_related('client', 'freelancer', 'job_type').prefetch_related(submissions)
+
+        columns, related = {'id', 'created_at'}, set()
+        for name in field_names:
+            only, select = cls.FIELD_LOADING.get(name, ([name], []))
+            columns.update(only)
+            related.update(select)
+        # A relation that is serialized whole must not be narrowed by another field's columns
+        columns = {column for column in columns if '__' not in column or column.split('__')[0] not in columns}
+        queryset = queryset.only(*columns)
+        if related:
+            queryset = queryset.select_related(*related)
+        if 'submissions' in field_names:
+            queryset = queryset.prefetch_related(submissions)
+        return queryset
+
+    @property
+    def platform_settings(self):
+        # Views pass one snapshot in the context so every row in a response uses the same settings
+        return self.context.get('platform_settings') or get_platform_settings()
 
     def create(self, validated_data):
         user = self.context['request'].user
@@ -51,11 +144,32 @@ class DealSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
     def get_fee_breakdown(self, obj):
-        from core.models import PlatformSettings
-        settings = PlatformSettings.objects.first()
-        if not settings:
+        if self.fee_breakdowns and id(obj) in self.fee_breakdowns:
+            return self.fee_breakdowns[id(obj)]
+        return self.platform_settings.calculate_fee_breakdown(obj.amount)
+
+class DealListSerializer(DealSerializer):
+    """
+    Compact deal for list calls. Nested users, job type, submissions and fee
+    breakdown are only included when asked for with ?expand= (or ?fields=).
+    """
+    counterpart = serializers.SerializerMethodField()
+
+    class Meta(DealSerializer.Meta):
+        fields = DealSerializer.Meta.fields + ['reference_id', 'counterpart']
+        default_fields = [
+            'id', 'reference_id', 'title', 'status', 'amount', 'currency',
+            'counterpart', 'unique_shareable_url', 'created_at',
+        ]
+
+    def get_counterpart(self, obj):
+        """Display name of the other party to the deal, from the requesting user's side."""
+        request = self.context.get('request')
+        user_id = request.user.id if request is not None else None
+        other = obj.freelancer if obj.client_id == user_id else obj.client
+        if other is None:
             return None
-        return settings.calculate_fee_breakdown(obj.amount)
+        return other.get_full_name() or other.username
 
 class DisputeSerializer(serializers.ModelSerializer):
     opened_by = UserSerializer(read_only=True)
@@ -1,13 +1,19 @@
 import uuid
-from decimal import Decimal
 from datetime import timedelta
 from django.utils import timezone
-from django.db import transaction
-from django.db.models import Q
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q
 from rest_framework.exceptions import ValidationError, PermissionDenied
 from .models import Deal, DealMessage, Dispute, DealSubmission
-from core.models import Notification, PlatformSettings
-from payments.services import get_gateway
+from .transitions import apply_transition
+from core.models import Notification
+from core.cache import get_platform_settings
+from core.fees import as_floats
+from core.money import Money
+from core.references import assign_reference_ids, get_allocator
+from payments.cache import is_success
+from payments.services import PaymentProcessor, get_gateway
+from payments.ledger import InsufficientFunds, escrow_account, post, settle_escrow, user_account
 from payments.models import PaymentTransaction
 from core.emails import EmailService
 import logging
@@ -20,30 +26,27 @@ class DealService:
         if deal.status != 'created':
             raise ValidationError('Deal cannot be funded currently')
         
-        settings, _ = PlatformSettings.objects.get_or_create()
-        breakdown = settings.calculate_fee_breakdown(deal.amount)
-        pay_amount = Decimal(str(breakdown['total_to_pay']))
+        settings = get_platform_settings()
+        fees = settings.fee_breakdown(deal.amount)
+        breakdown = as_floats(fees)
+        pay_amount = fees['total_to_pay']
 
         if payment_method == 'wallet':
-            if user.balance < pay_amount:
-                raise ValidationError(f'Insufficient wallet balance. You need ₦{pay_amount}, but have ₦{user.balance}')
-            
             try:
                 with transaction.atomic():
-                    user.balance -= pay_amount
-                    user.save()
-                    
-                    deal.status = 'funded'
-                    deal.save()
+                    apply_transition(deal, 'fund')
+
+                    reference = f"wallet-{deal.id}-{uuid.uuid4().hex[:10]}"
+                    post('deal_funding', [(user_account(user), -pay_amount), (escrow_account(deal), pay_amount)], reference)
                     
                     PaymentTransaction.objects.create(
                         user=user,
                         deal=deal,
-                        amount_paid=pay_amount,
+                        amount_paid=pay_amount.to_decimal(),
                         transaction_type='deal_payment',
                         gateway='wallet',
                         status='success',
-                        reference=f"wallet-{deal.id}-{uuid.uuid4().hex[:10]}"
+                        reference=reference
                     )
                     
                     if deal.freelancer:
@@ -55,12 +58,16 @@ class DealService:
                         EmailService.send_deal_funded_email(deal)
                 
                 return {'status': 'success', 'message': 'Deal funded successfully from your wallet balance.', 'breakdown': breakdown}
+            except InsufficientFunds:
+                # The debit only goes through if the balance covers it; nothing was written
+                user.refresh_from_db(fields=['balance'])
+                raise ValidationError(f'Insufficient wallet balance. You need ₦{pay_amount}, but have ₦{user.balance}')
             except Exception as e:
                 logger.error(f"Wallet funding failed for deal {deal.id}: {e}")
                 raise Exception(f"Wallet payment failed: {str(e)}")
 
         # Gateway Initialization
-        gateway = get_gateway()
+        gateway = get_gateway(failover=True)
         if not user.email:
             raise ValidationError('User email required for payment')
 
@@ -73,6 +80,10 @@ class DealService:
                 callback_url=callback_url,
                 metadata={'deal_id': deal.id, 'type': 'fund_deal', 'breakdown': breakdown}
             )
+            if is_success(init_data):
+                PaymentProcessor.record_initialized_payment(
+                    reference, 'deal_funding', pay_amount, gateway.NAME, user, deal=deal
+                )
             if init_data.get('status') is not False:
                 init_data['breakdown'] = breakdown
                 return init_data
@@ -83,6 +94,28 @@ class DealService:
             logger.error(f"Error initializing payment for deal {deal.id}: {e}")
             raise Exception(str(e))
 
+    @staticmethod
+    def bulk_create_deals(user, items):
+        """
+        Create many deals for `user` with a single INSERT. `items` is validated
+        DealSerializer data. Slugs and reference IDs are assigned up front
+        because bulk_create() bypasses Deal.save().
+        """
+        deals = [Deal(client=user, **item) for item in items]
+        for attempt in range(2):
+            for deal in deals:
+                deal.unique_shareable_url = Deal.generate_shareable_url(deal.title)
+                deal.reference_id = None
+            assign_reference_ids(deals)
+            try:
+                with transaction.atomic():
+                    return Deal.objects.bulk_create(deals)
+            except IntegrityError:
+                # A slug or reference ID collided; retry once with fresh values
+                if attempt:
+                    raise
+                get_allocator(Deal.REFERENCE_PREFIX).discard_block()
+
     @staticmethod
     def accept_deal(deal: Deal, user):
         if deal.freelancer:
@@ -114,12 +147,8 @@ class DealService:
         if user != deal.freelancer:
             raise PermissionDenied('Only the assigned freelancer can start the work')
         
-        if deal.status != 'funded':
-             raise ValidationError('Deal must be funded before starting')
+        apply_transition(deal, 'start_work')
 
-        deal.status = 'in_progress'
-        deal.save()
-        
         Notification.objects.create(
             recipient=deal.client,
             actor=user,
@@ -134,25 +163,21 @@ class DealService:
         if user != deal.freelancer:
              raise PermissionDenied('Only freelancer can deliver')
         
-        if deal.status != 'in_progress':
-             raise ValidationError('Deal is not in progress')
-
-        deal.status = 'delivered'
-        settings, _ = PlatformSettings.objects.get_or_create()
-        days = settings.dispute_window_days
-        deal.dispute_window_expires = timezone.now() + timedelta(days=days)
-        
-        DealSubmission.objects.create(
-            deal=deal,
-            freelancer=user,
-            links=data.get('links', []),
-            files=data.get('files', []),
-            notes=data.get('notes', ''),
-            revision_round=deal.revision_count + 1
-        )
-        
-        deal.revision_count += 1
-        deal.save()
+        days = get_platform_settings().dispute_window_days
+        with transaction.atomic():
+            apply_transition(
+                deal, 'deliver',
+                dispute_window_expires=timezone.now() + timedelta(days=days),
+                revision_count=F('revision_count') + 1,
+            )
+            DealSubmission.objects.create(
+                deal=deal,
+                freelancer=user,
+                links=data.get('links', []),
+                files=data.get('files', []),
+                notes=data.get('notes', ''),
+                revision_round=deal.revision_count
+            )
 
         Notification.objects.create(
             recipient=deal.client,
@@ -176,42 +201,43 @@ class DealService:
         if user != deal.client:
              raise PermissionDenied('Only client can approve')
         
-        if deal.status not in ['delivered', 'disputed']:
-             raise ValidationError('Deal must be delivered or disputed to approve')
-
-        deal.status = 'completed'
-        deal.save()
-        
-        return DealService.release_payout(deal, actor=user)
+        # The deal only counts as completed if its escrow was paid out too
+        with transaction.atomic():
+            apply_transition(deal, 'approve')
+            return DealService.release_payout(deal, actor=user)
 
     @staticmethod
     def release_payout(deal: Deal, actor=None):
+        """
+        Pay the freelancer out of a completed deal's escrow. Call it in the
+        same transaction as the deal's transition; the notification and email
+        go out once that commits.
+        """
         freelancer = deal.freelancer
         breakdown = {}
         if freelancer:
-            settings, _ = PlatformSettings.objects.get_or_create()
-            breakdown = settings.calculate_fee_breakdown(deal.amount)
-            net_amount = Decimal(str(breakdown['total_to_receive']))
+            settings = get_platform_settings()
+            fees = settings.fee_breakdown(deal.amount)
+            breakdown = as_floats(fees)
+            net_amount = fees['total_to_receive']
             
-            with transaction.atomic():
-                freelancer.refresh_from_db()
-                freelancer.balance += net_amount
-                freelancer.save()
+            # Pays the freelancer out of escrow; what is left over is the platform's fees
+            settle_escrow(deal, 'release', [(user_account(freelancer), net_amount)], f"deal-{deal.id}")
             
             msg = f"The deal '{deal.title}' has been completed. Funds released (₦{net_amount} after fees)!"
             if actor:
                 msg = f"{actor.username} approved the deal '{deal.title}'. Funds released (₦{net_amount} after fees)!"
             
-            Notification.objects.create(
-                recipient=freelancer,
-                deal=deal,
-                type='deal_approved',
-                content=msg
-            )
-            
-            EmailService.send_funds_released_email(deal, amount=net_amount)
-            
-            # Optional: Log payout transaction or similar record here
+            def notify():
+                Notification.objects.create(
+                    recipient=freelancer,
+                    deal=deal,
+                    type='deal_approved',
+                    content=msg
+                )
+                EmailService.send_funds_released_email(deal, amount=net_amount)
+
+            transaction.on_commit(notify)
             
         return {'status': 'success', 'message': 'Payout completed', 'breakdown': breakdown}
 
@@ -220,14 +246,13 @@ class DealService:
         if not reason:
              raise ValidationError('Dispute reason is required')
 
-        deal.status = 'disputed'
-        deal.save()
-        
-        Dispute.objects.create(
-            deal=deal,
-            opened_by=user,
-            reason=reason
-        )
+        with transaction.atomic():
+            apply_transition(deal, 'dispute')
+            Dispute.objects.create(
+                deal=deal,
+                opened_by=user,
+                reason=reason
+            )
 
         other_party = deal.freelancer if user == deal.client else deal.client
         if other_party:
@@ -246,11 +271,7 @@ class DealService:
         if user != deal.client:
              raise PermissionDenied('Only client can request revisions')
         
-        if deal.status != 'delivered':
-             raise ValidationError('Deal must be in delivered status to request revision')
-
-        deal.status = 'in_progress'
-        deal.save()
+        apply_transition(deal, 'request_revision')
 
         Notification.objects.create(
             recipient=deal.freelancer,
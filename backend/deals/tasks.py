@@ -1,6 +1,8 @@
 from celery import shared_task
+from django.db import transaction
 from django.utils import timezone
 from .models import Deal
+from .transitions import try_transition
 
 @shared_task
 def auto_release_funds():
@@ -14,12 +16,13 @@ def auto_release_funds():
     
     count = 0
     for deal in expired_deals:
-        # Mark as completed
-        deal.status = 'completed'
-        deal.save()
-        
-        # Release funds to freelancer
-        DealService.release_payout(deal)
+        with transaction.atomic():
+            # Mark as completed, unless the client approved or disputed it meanwhile
+            if not try_transition(deal, 'auto_release'):
+                continue
+            
+            # Release funds to freelancer
+            DealService.release_payout(deal)
         count += 1
     
     return f"Auto-released {count} deals"
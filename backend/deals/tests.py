@@ -0,0 +1,446 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from core.models import User, PlatformSettings, JobType, Notification
+from core.cache import get_platform_settings
+from .cache import invalidate_public_deal
+from .models import Deal, DealSubmission
+from .pagination import DealCursorPagination
+from .serializers import DealSerializer
+from .services import DealService
+from .tasks import auto_release_funds
+from .transitions import transition
+
+
+class DealAPITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        PlatformSettings.objects.create(platform_fee_percent=Decimal('5.00'))
+        self.user = User.objects.create_user(username='agency', email='agency@example.com')
+        self.freelancer = User.objects.create_user(username='maker', email='maker@example.com', kyc_status='basic')
+        self.job_type = JobType.objects.create(name='Design', slug='design')
+        get_platform_settings()
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def _payload(self, i, **overrides):
+        data = {
+            'title': f'Landing page {i}',
+            'description': 'Design a landing page',
+            'amount': '15000.00',
+            'job_type_id': self.job_type.id,
+        }
+        data.update(overrides)
+        return data
+
+
+class BulkDealCreateTestCase(DealAPITestCase):
+    def test_creates_all_deals_with_one_insert(self):
+        payload = [self._payload(i) for i in range(50)]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.post('/api/deals/bulk/', payload, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data), 50)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "deals_deal"')]
+        self.assertEqual(len(inserts), 1)
+
+        deals = Deal.objects.filter(client=self.user)
+        self.assertEqual(deals.count(), 50)
+        self.assertEqual(len({d.reference_id for d in deals}), 50)
+        self.assertEqual(len({d.unique_shareable_url for d in deals}), 50)
+        self.assertTrue(all(d.reference_id.startswith('DN-DL-') for d in deals))
+
+    def test_accepts_wrapped_payload(self):
+        response = self.api.post('/api/deals/bulk/', {'deals': [self._payload(1)]}, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data[0]['client']['id'], self.user.id)
+
+    def test_reports_errors_per_item_and_creates_nothing(self):
+        payload = [self._payload(0), self._payload(1, amount='abc'), self._payload(2, title='')]
+
+        response = self.api.post('/api/deals/bulk/', payload, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        errors = response.data['errors']
+        self.assertEqual(sorted(errors), [1, 2])
+        self.assertIn('amount', errors[1])
+        self.assertIn('title', errors[2])
+        self.assertFalse(Deal.objects.exists())
+
+    def test_errors_are_keyed_by_index_whatever_drf_defaults_to(self):
+        payload = [self._payload(0), self._payload(1, amount='abc')]
+
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'LIST_SERIALIZER_ERRORS_AS_DICT': False}):
+            response = self.api.post('/api/deals/bulk/', payload, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data['errors']), [1])
+        self.assertIn('amount', response.data['errors'][1])
+
+    def test_rejects_empty_list(self):
+        response = self.api.post('/api/deals/bulk/', [], format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+
+class DealQueryCountTestCase(DealAPITestCase):
+    def _create_deals(self, count):
+        for i in range(count):
+            deal = Deal.objects.create(
+                client=self.user, freelancer=self.freelancer, job_type=self.job_type,
+                title=f'Deal {i}', description='Desc', amount=Decimal('1000.00'),
+            )
+            DealSubmission.objects.create(deal=deal, freelancer=self.freelancer, notes='v1')
+            DealSubmission.objects.create(deal=deal, freelancer=self.freelancer, notes='v2', revision_round=1)
+
+    def test_list_query_count_is_constant(self):
+        # One query per side of the list with users and job type joined, then submissions
+        url = '/api/deals/?expand=client,freelancer,job_type_details,submissions,fee_breakdown'
+        for count in (1, 20):
+            Deal.objects.all().delete()
+            self._create_deals(count)
+
+            with self.assertNumQueries(3):
+                response = self.api.get(url)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), count)
+            self.assertEqual(len(response.data['results'][0]['submissions']), 2)
+
+    def test_retrieve_query_count(self):
+        self._create_deals(1)
+        deal = Deal.objects.get()
+
+        with self.assertNumQueries(2):
+            response = self.api.get(f'/api/deals/{deal.id}/')
+
+        self.assertEqual(response.data['freelancer']['username'], 'maker')
+        self.assertEqual(response.data['job_type_details']['slug'], 'design')
+
+    def test_public_view_query_count(self):
+        self._create_deals(1)
+        deal = Deal.objects.get()
+        self.api.force_authenticate(None)
+
+        with self.assertNumQueries(2):
+            response = self.api.get(f'/api/d/{deal.unique_shareable_url}/public/')
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_bulk_response_does_not_query_per_deal(self):
+        payload = [self._payload(i) for i in range(30)]
+
+        with CaptureQueriesContext(connection) as queries:
+            self.api.post('/api/deals/bulk/', payload, format='json')
+
+        submission_queries = [q for q in queries if 'deals_dealsubmission' in q['sql']]
+        self.assertEqual(len(submission_queries), 1)
+
+
+class SparseFieldsetTestCase(DealAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.freelancer.first_name, self.freelancer.last_name = 'Ada', 'Maker'
+        self.freelancer.save()
+        self.deal = Deal.objects.create(
+            client=self.user, freelancer=self.freelancer, job_type=self.job_type,
+            title='Logo', description='Desc', amount=Decimal('1000.00'),
+        )
+
+    def test_list_is_compact_by_default(self):
+        response = self.api.get('/api/deals/')
+
+        deal = response.data['results'][0]
+        self.assertEqual(set(deal), {
+            'id', 'reference_id', 'title', 'status', 'amount', 'currency',
+            'counterpart', 'unique_shareable_url', 'created_at',
+        })
+        self.assertEqual(deal['counterpart'], 'Ada Maker')
+
+    def test_counterpart_is_the_other_party(self):
+        self.api.force_authenticate(self.freelancer)
+
+        response = self.api.get('/api/deals/')
+
+        self.assertEqual(response.data['results'][0]['counterpart'], 'agency')
+
+    def test_fields_and_expand(self):
+        response = self.api.get('/api/deals/?fields=id,title&expand=client,fee_breakdown')
+
+        deal = response.data['results'][0]
+        self.assertEqual(set(deal), {'id', 'title', 'client', 'fee_breakdown'})
+        self.assertEqual(deal['client']['username'], 'agency')
+        self.assertEqual(deal['fee_breakdown']['base_amount'], 1000.0)
+
+    def test_only_loads_requested_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.api.get('/api/deals/?fields=id,title')
+
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('description', queries[0]['sql'])
+        self.assertNotIn('JOIN', queries[0]['sql'])
+
+    def test_detail_keeps_full_representation(self):
+        response = self.api.get(f'/api/deals/{self.deal.id}/')
+
+        self.assertIn('submissions', response.data)
+        self.assertIn('fee_breakdown', response.data)
+        self.assertEqual(set(self.api.get(f'/api/deals/{self.deal.id}/?fields=status').data), {'status'})
+
+
+class PublicDealCacheTestCase(DealAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.deal = Deal.objects.create(
+            client=self.user, job_type=self.job_type, title='Logo', description='Desc', amount=Decimal('1000.00'),
+        )
+        self.url = f'/api/d/{self.deal.unique_shareable_url}/public/'
+        self.api.force_authenticate(None)
+
+    def test_repeat_hits_are_served_from_cache(self):
+        first = self.api.get(self.url)
+
+        with self.assertNumQueries(0):
+            second = self.api.get(self.url)
+
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertTrue(first['ETag'].startswith('"'))
+
+    def test_matching_if_none_match_gets_304(self):
+        etag = self.api.get(self.url)['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.api.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(response.content)
+
+    def test_304_on_cold_cache_skips_serialization(self):
+        etag = self.api.get(self.url)['ETag']
+        invalidate_public_deal(self.deal.unique_shareable_url)
+
+        with patch.object(DealSerializer, 'to_representation') as to_representation, self.assertNumQueries(1):
+            response = self.api.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        to_representation.assert_not_called()
+
+    def test_changes_invalidate_the_page(self):
+        etag = self.api.get(self.url)['ETag']
+
+        self.deal.status = 'in_progress'
+        self.deal.save()
+        response = self.api.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'in_progress')
+        etag = response['ETag']
+
+        DealSubmission.objects.create(deal=self.deal, freelancer=self.freelancer, notes='v1')
+        response = self.api.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['submissions']), 1)
+
+    def test_profile_change_invalidates_the_page(self):
+        etag = self.api.get(self.url)['ETag']
+        self.user.first_name = 'Renamed'
+        self.user.save()
+
+        response = self.api.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['client']['first_name'], 'Renamed')
+
+        # Cold cache: the ETag check alone must also see the new profile
+        etag = response['ETag']
+        invalidate_public_deal(self.deal.unique_shareable_url)
+        self.user.bio = 'New bio'
+        self.user.save()
+        self.assertEqual(self.api.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_private_user_fields_leave_the_page_cached(self):
+        etag = self.api.get(self.url)['ETag']
+        self.user.save(update_fields=['last_login'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.api.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_settings_change_invalidates_fee_breakdown(self):
+        etag = self.api.get(self.url)['ETag']
+        settings = PlatformSettings.objects.get()
+        settings.platform_fee_percent = Decimal('10.00')
+        settings.save()
+
+        response = self.api.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['fee_breakdown']['platform_revenue'], 100.0)
+
+    def test_unknown_slug_is_404(self):
+        self.assertEqual(self.api.get('/api/d/missing/public/').status_code, 404)
+        self.assertEqual(self.api.get('/api/d/missing/public/', HTTP_IF_NONE_MATCH='"x"').status_code, 404)
+
+
+class DealCursorPaginationTestCase(DealAPITestCase):
+    def setUp(self):
+        super().setUp()
+        other = User.objects.create_user(username='other', email='other@example.com')
+        deals = []
+        for i in range(45):
+            # Interleave both sides of the list and force created_at ties
+            if i % 3 == 0:
+                deals.append(Deal(client=other, freelancer=self.user, title=f'Hired {i}', description='D', amount=100))
+            else:
+                deals.append(Deal(client=self.user, title=f'Own {i}', description='D', amount=100))
+        for deal in deals:
+            deal.save()
+        Deal.objects.create(client=other, title='Not mine', description='D', amount=100)
+        base = timezone.now()
+        for i, deal in enumerate(deals):
+            Deal.objects.filter(pk=deal.pk).update(created_at=base - timedelta(minutes=i // 2))
+        self.expected = list(
+            Deal.objects.filter(Q(client=self.user) | Q(freelancer=self.user))
+            .order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+
+    def _walk(self, url, key):
+        ids = []
+        while url:
+            response = self.api.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = [deal['id'] for deal in response.data['results']]
+            ids.extend(page if key == 'next' else reversed(page))
+            url = response.data[key]
+        return ids
+
+    def test_walks_all_pages_in_order(self):
+        self.assertEqual(self._walk('/api/deals/?page_size=10', 'next'), self.expected)
+
+    def test_walks_back_to_the_first_page(self):
+        response = self.api.get('/api/deals/?page_size=10')
+        for _ in range(4):
+            response = self.api.get(response.data['next'])
+        last_page = [deal['id'] for deal in response.data['results']]
+        self.assertIsNone(response.data['next'])
+
+        ids = self._walk(response.data['previous'], 'previous')
+
+        self.assertEqual(list(reversed(ids)) + last_page, self.expected)
+
+    def test_deep_page_runs_the_same_queries_as_the_first(self):
+        response = self.api.get('/api/deals/?page_size=10')
+        next_url = response.data['next']
+
+        with self.assertNumQueries(2):
+            self.api.get('/api/deals/?page_size=10')
+        with self.assertNumQueries(2):
+            self.api.get(next_url)
+
+    def test_branches_are_one_union_all_where_the_backend_allows_it(self):
+        pagination = DealCursorPagination()
+        pagination.limit, pagination.reverse = 10, False
+        pages = [
+            pagination._page_branch(branch, None)
+            for branch in (Deal.objects.filter(client=self.user), Deal.objects.filter(freelancer=self.user))
+        ]
+
+        # SQLite cannot run it, so only check the query Django would send
+        with patch.object(connection.features, 'supports_slicing_ordering_in_compound', True):
+            sql = str(pagination._combine(pages, connection).query)
+
+        self.assertEqual(sql.count('UNION ALL'), 1)
+        self.assertEqual(sql.count('LIMIT 11'), 3)
+
+    def test_rejects_invalid_cursor(self):
+        response = self.api.get('/api/deals/?cursor=not-a-cursor')
+
+        self.assertEqual(response.status_code, 404)
+
+
+class DealTransitionTestCase(DealAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.deal = Deal.objects.create(
+            client=self.user, freelancer=self.freelancer, title='Logo', description='Desc',
+            amount=Decimal('1000.00'), status='funded',
+        )
+
+    def test_transition_is_one_conditional_update_of_changed_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(transition(self.deal, ('funded',), 'in_progress'))
+
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql']
+        self.assertTrue(sql.startswith('UPDATE "deals_deal" SET "status" = '), sql)
+        self.assertNotIn('"title"', sql)
+        self.assertIn('"deals_deal"."status" IN', sql)
+        self.assertEqual(self.deal.status, 'in_progress')
+
+    def test_losing_transition_leaves_instance_untouched(self):
+        Deal.objects.filter(pk=self.deal.pk).update(status='cancelled')
+
+        self.assertFalse(transition(self.deal, ('funded',), 'in_progress'))
+        self.assertEqual(self.deal.status, 'funded')
+        self.assertEqual(Deal.objects.get(pk=self.deal.pk).status, 'cancelled')
+
+    def test_stale_double_approve_pays_out_once(self):
+        Deal.objects.filter(pk=self.deal.pk).update(status='delivered')
+        first, second = Deal.objects.get(pk=self.deal.pk), Deal.objects.get(pk=self.deal.pk)
+
+        DealService.approve_deal(first, self.user)
+        with self.assertRaises(ValidationError):
+            DealService.approve_deal(second, self.user)
+
+        self.freelancer.refresh_from_db()
+        self.assertEqual(self.freelancer.balance, Decimal('975.00'))
+
+    def test_approval_is_rolled_back_if_payout_fails(self):
+        Deal.objects.filter(pk=self.deal.pk).update(status='delivered')
+        self.deal.refresh_from_db()
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with patch('deals.services.settle_escrow', side_effect=RuntimeError('ledger down')):
+                with self.assertRaises(RuntimeError):
+                    DealService.approve_deal(self.deal, self.user)
+
+        self.assertEqual(Deal.objects.get(pk=self.deal.pk).status, 'delivered')
+        self.assertEqual(callbacks, [])
+        self.assertFalse(Notification.objects.filter(type='deal_approved').exists())
+
+    def test_auto_release_skips_deals_disputed_meanwhile(self):
+        Deal.objects.filter(pk=self.deal.pk).update(
+            status='delivered', dispute_window_expires=timezone.now() - timedelta(minutes=1)
+        )
+        stale = list(Deal.objects.filter(status='delivered'))
+        DealService.dispute_deal(Deal.objects.get(pk=self.deal.pk), self.user, 'Late delivery')
+
+        with patch('deals.tasks.Deal') as task_deal:
+            task_deal.objects.filter.return_value = stale
+            self.assertEqual(auto_release_funds(), 'Auto-released 0 deals')
+
+        self.assertEqual(Deal.objects.get(pk=self.deal.pk).status, 'disputed')
+        self.freelancer.refresh_from_db()
+        self.assertEqual(self.freelancer.balance, Decimal('0.00'))
+
+    def test_deliver_increments_revision_count_in_the_update(self):
+        DealService.start_work(self.deal, self.freelancer)
+        DealService.deliver_work(self.deal, self.freelancer, {'notes': 'v1'})
+        DealService.request_revision(self.deal, self.user, 'More contrast')
+        DealService.deliver_work(self.deal, self.freelancer, {'notes': 'v2'})
+
+        self.deal.refresh_from_db()
+        self.assertEqual(self.deal.status, 'delivered')
+        self.assertEqual(self.deal.revision_count, 2)
+        self.assertEqual(list(self.deal.submissions.values_list('revision_round', flat=True)), [2, 1])
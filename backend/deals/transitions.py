@@ -0,0 +1,78 @@
+"""
+Deal state machine.
+
+A transition is a single conditional UPDATE:
+    UPDATE deals_deal SET status=?, updated_at=?, ... WHERE id=? AND status IN (...)
+It writes only the changed columns. If another request moved the deal first,
+the UPDATE matches no row and the transition loses, so a deal can never be
+approved, paid out or disputed twice from a stale read.
+"""
+from typing import NamedTuple
+
+from django.db.models.expressions import Combinable
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .cache import invalidate_public_deal
+from .models import Deal
+
+
+class Transition(NamedTuple):
+    sources: tuple
+    target: str
+    error: str
+
+
+DEAL_TRANSITIONS = {
+    'fund': Transition(('created',), 'funded', 'Deal cannot be funded currently'),
+    'start_work': Transition(('funded',), 'in_progress', 'Deal must be funded before starting'),
+    'deliver': Transition(('in_progress',), 'delivered', 'Deal is not in progress'),
+    'approve': Transition(('delivered', 'disputed'), 'completed', 'Deal must be delivered or disputed to approve'),
+    'auto_release': Transition(('delivered',), 'completed', 'Deal is no longer awaiting release'),
+    'dispute': Transition(('funded', 'in_progress', 'delivered'), 'disputed', 'Only an active, funded deal can be disputed'),
+    'request_revision': Transition(('delivered',), 'in_progress', 'Deal must be in delivered status to request revision'),
+    # Admin actions. Each settles the escrow in the same transaction, so only the winner moves money.
+    'cancel_unfunded': Transition(('created',), 'cancelled', 'Deal has been funded'),
+    'admin_cancel': Transition(('funded', 'in_progress', 'delivered', 'disputed'), 'cancelled', 'Cannot cancel a finished deal'),
+    'force_complete': Transition(('funded', 'in_progress', 'delivered', 'disputed'), 'completed', 'Only a funded, unfinished deal can be completed'),
+    'resolve_dispute': Transition(('disputed',), 'completed', 'Deal is no longer disputed'),
+    'refund_dispute': Transition(('disputed',), 'refunded', 'Deal is no longer disputed'),
+}
+
+# Statuses an admin may set by hand. All of them hold escrow; moving a deal in
+# or out of a settled status goes through a transition above that moves the money.
+ADMIN_SETTABLE_STATUSES = ('funded', 'in_progress', 'delivered', 'disputed')
+
+
+def transition(deal, from_states, to_state, **fields):
+    """
+    Move `deal` from one of `from_states` to `to_state`, also setting `fields`
+    (values or F() expressions). Returns True if this call won. The instance
+    is updated in place only when it did.
+    """
+    values = {'status': to_state, 'updated_at': timezone.now(), **fields}
+    won = Deal.objects.filter(pk=deal.pk, status__in=from_states).update(**values) == 1
+    if not won:
+        return False
+
+    expressions = [name for name, value in values.items() if isinstance(value, Combinable)]
+    for name, value in values.items():
+        if name not in expressions:
+            setattr(deal, name, value)
+    if expressions:
+        deal.refresh_from_db(fields=expressions)
+    invalidate_public_deal(deal.unique_shareable_url)
+    return True
+
+
+def try_transition(deal, name, **fields):
+    """Run the named transition from DEAL_TRANSITIONS; returns whether it won."""
+    sources, target, _ = DEAL_TRANSITIONS[name]
+    return transition(deal, sources, target, **fields)
+
+
+def apply_transition(deal, name, **fields):
+    """Run the named transition, raising ValidationError if it loses."""
+    if not try_transition(deal, name, **fields):
+        raise ValidationError(DEAL_TRANSITIONS[name].error)
+    return deal
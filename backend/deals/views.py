@@ -1,23 +1,61 @@
 from rest_framework import viewsets, permissions, status, views
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.conf import settings
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.utils.http import parse_etags
+from django.db.models import Q, prefetch_related_objects
 from .models import Deal
-from .serializers import DealSerializer, DealMessageSerializer
+from .serializers import DealSerializer, DealListSerializer, DealMessageSerializer
 from .services import DealService
+from .pagination import DealCursorPagination
+from .cache import cache_public_deal, get_cached_public_deal, public_deal_etag
+from core.cache import get_platform_settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+BULK_CREATE_MAX = 1000
+
 class DealViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = DealSerializer
+    pagination_class = DealCursorPagination
     lookup_field = 'id'
 
     def get_queryset(self):
         user = self.request.user
-        return Deal.objects.filter(Q(client=user) | Q(freelancer=user)).order_by('-created_at')
+        queryset = Deal.objects.filter(Q(client=user) | Q(freelancer=user)).order_by('-created_at')
+        return DealSerializer.setup_eager_loading(queryset)
+
+    def get_list_branches(self):
+        """
+        The list queryset split at the OR, so each side is paged along its own
+        (client, created_at) / (freelancer, created_at) index.
+        """
+        user = self.request.user
+        serializer_class = self.get_serializer_class()
+        field_names = self.get_serializer().readable_field_names
+        return [
+            serializer_class.setup_eager_loading(Deal.objects.filter(client=user), field_names),
+            serializer_class.setup_eager_loading(Deal.objects.filter(freelancer=user).exclude(client=user), field_names),
+        ]
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_list_branches())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return DealListSerializer
+        return DealSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['platform_settings'] = get_platform_settings()
+        return context
 
     def perform_create(self, serializer):
         serializer.save(client=self.request.user)
@@ -32,6 +70,27 @@ class DealViewSet(viewsets.ModelViewSet):
             return obj
         return super().get_object()
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create up to BULK_CREATE_MAX deals in one transaction. Accepts a list
+        of deals (or {"deals": [...]}); errors are keyed by item index.
+        """
+        items = request.data.get('deals') if isinstance(request.data, dict) else request.data
+        max_items = getattr(settings, 'DEALS_BULK_CREATE_MAX', BULK_CREATE_MAX)
+        serializer = self.get_serializer(data=items, many=True, allow_empty=False, max_length=max_items)
+        if not serializer.is_valid():
+            errors = serializer.errors
+            # Per-item errors come back as a list with an empty entry for each valid item,
+            # unless DRF's LIST_SERIALIZER_ERRORS_AS_DICT already keyed them by index
+            if isinstance(errors, list):
+                errors = {index: item_errors for index, item_errors in enumerate(errors) if item_errors}
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        deals = DealService.bulk_create_deals(request.user, serializer.validated_data)
+        prefetch_related_objects(deals, 'submissions')
+        return Response(self.get_serializer(deals, many=True).data, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['post'])
     def fund(self, request, id=None):
         deal = self.get_object()
@@ -102,9 +161,38 @@ class DealViewSet(viewsets.ModelViewSet):
             msg = DealService.send_message(deal, request.user, content, files)
             return Response(DealMessageSerializer(msg).data, status=201)
 
+def _etag_matches(etag, if_none_match):
+    # If-None-Match uses the weak comparison, so W/"x" matches "x"
+    return '*' in if_none_match or any(tag.removeprefix('W/') == etag for tag in if_none_match)
+
 class PublicDealView(views.APIView):
+    """
+    Shareable deal page. Responses are cached per slug and carry a strong
+    ETag; a matching If-None-Match gets a 304 without serializing the deal.
+    """
     permission_classes = [permissions.AllowAny]
 
     def get(self, request, slug):
-        deal = get_object_or_404(Deal, unique_shareable_url=slug)
-        return Response(DealSerializer(deal).data)
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        cached = get_cached_public_deal(slug)
+        if cached is not None:
+            etag, data = cached
+            if _etag_matches(etag, if_none_match):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+            return Response(data, headers={'ETag': etag})
+
+        if if_none_match:
+            row = Deal.objects.filter(unique_shareable_url=slug).values_list(
+                'id', 'updated_at', 'client_id', 'freelancer_id'
+            ).first()
+            if row is None:
+                raise Http404
+            etag = public_deal_etag(*row)
+            if _etag_matches(etag, if_none_match):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        deal = get_object_or_404(DealSerializer.setup_eager_loading(Deal.objects.all()), unique_shareable_url=slug)
+        etag = public_deal_etag(deal.id, deal.updated_at, deal.client_id, deal.freelancer_id)
+        data = DealSerializer(deal, context={'platform_settings': get_platform_settings()}).data
+        cache_public_deal(slug, etag, data)
+        return Response(data, headers={'ETag': etag})
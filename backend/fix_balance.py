@@ -4,14 +4,15 @@ Manually fix user balance for the stuck transaction
 import os
 import sys
 import django
-from decimal import Decimal
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dealnest.settings')
 django.setup()
 
 from core.models import User
-from payments.models import PaymentTransaction
+from core.money import Money
+from payments.ledger import ADJUSTMENTS, post, user_account
+from payments.models import LedgerEntry, PaymentTransaction
 
 print('='*50)
 print('MANUAL BALANCE CORRECTION')
@@ -25,11 +26,14 @@ tx = PaymentTransaction.objects.filter(reference='DEP-8-426fe350').first()
 if tx:
     print(f"Reference: {tx.reference} | Amount: {tx.amount_paid} | Status: {tx.status}")
     
-    # Check if we should credit
-    if user.balance == Decimal('0.00') and tx.status == 'success':
+    # Check if we should credit: nothing in the ledger has paid this deposit into the wallet yet
+    credited = LedgerEntry.objects.filter(account=user_account(user), reference=tx.reference).exists()
+    if not credited and tx.status == 'success':
         print("\nApplying correction...")
-        user.balance += tx.amount_paid
-        user.save()
+        amount = Money.from_naira(tx.amount_paid)
+        # A correcting posting, so verify_ledger still balances and the fix stays on record
+        post('adjustment', [(user_account(user), amount), (ADJUSTMENTS, -amount)], tx.reference)
+        user.refresh_from_db()
         print(f"SUCCESS: New Balance is {user.balance}")
     else:
         print("\nNo correction needed (Balance already updated or transaction invalid).")
@@ -1,21 +1,62 @@
 from django.contrib import admin
-from .models import PaymentTransaction, Payout
+from .models import AccountBalance, LedgerEntry, PaymentTransaction, Payout, TransferRecipient, WebhookEvent
+from .webhooks import requeue_events
 
 @admin.register(PaymentTransaction)
 class PaymentTransactionAdmin(admin.ModelAdmin):
     list_display = ('reference', 'deal', 'amount_paid', 'status', 'gateway', 'created_at')
     list_filter = ('status', 'gateway')
-    search_fields = ('reference', 'deal__title')
+    search_fields = ('reference', 'transfer_code', 'gateway_reference', 'deal__title')
     readonly_fields = ('raw_response', 'created_at')
 
 @admin.register(Payout)
 class PayoutAdmin(admin.ModelAdmin):
-    list_display = ('reference', 'freelancer', 'amount', 'status', 'created_at')
+    list_display = ('reference', 'freelancer', 'amount', 'status', 'attempts', 'transfer_code', 'created_at')
     list_filter = ('status',)
-    search_fields = ('reference', 'freelancer__username')
+    search_fields = ('reference', 'transfer_code', 'batch_id', 'freelancer__username')
+    readonly_fields = ('batch_id', 'transfer_code', 'attempts', 'failure_reason', 'updated_at')
     
     actions = ['process_payout_manually']
     
     @admin.action(description='Mark as Paid (Manual)')
     def process_payout_manually(self, request, queryset):
         queryset.update(status='paid')
+
+@admin.register(TransferRecipient)
+class TransferRecipientAdmin(admin.ModelAdmin):
+    list_display = ('recipient_code', 'user', 'gateway', 'bank_code', 'account_number', 'is_test_mode', 'created_at')
+    list_filter = ('gateway', 'is_test_mode')
+    search_fields = ('recipient_code', 'account_number', 'user__username')
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'gateway', 'event_type', 'reference', 'status', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('status', 'gateway', 'event_type')
+    search_fields = ('reference',)
+    readonly_fields = ('payload', 'attempts', 'last_error', 'received_at', 'processed_at')
+
+    actions = ['retry_events']
+
+    @admin.action(description='Retry selected events')
+    def retry_events(self, request, queryset):
+        requeued = requeue_events(queryset)
+        self.message_user(request, f"Requeued {requeued} webhook events.")
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'account', 'amount', 'kind', 'reference', 'posting', 'created_at')
+    list_filter = ('kind',)
+    search_fields = ('account', 'reference', 'posting')
+
+    # Append-only: corrections are reversing postings, not edits
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(AccountBalance)
+class AccountBalanceAdmin(admin.ModelAdmin):
+    list_display = ('account', 'balance', 'updated_at')
+    search_fields = ('account',)
+    readonly_fields = ('account', 'balance', 'updated_at')
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'payments'
+
+    def ready(self):
+        # Connects the request signals that drain webhooks after the response in eager mode
+        from . import webhooks  # noqa: F401
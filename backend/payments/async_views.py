@@ -0,0 +1,140 @@
+"""
+Async versions of the payment views that mostly wait on the gateway.
+
+Under an ASGI server a request waiting on Paystack or Flutterwave only holds
+a coroutine, not a worker, so one process can keep hundreds of gateway calls
+in flight. The gateway calls use the httpx-based async gateways. Everything
+that touches the ORM stays sync code and runs through sync_to_async: the
+DRF auth/permission/throttle checks, get_gateway(), and the
+*_response() helpers shared with the sync views. Those helpers run in a
+thread and own their transactions, so a transaction never spans an await.
+
+urls.py serves these instead of the sync views when PAYMENTS_ASYNC_VIEWS is
+set. Under WSGI the sync views stay the better choice.
+"""
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework import permissions, views
+from rest_framework.response import Response
+
+from .recipients import aget_transfer_recipient
+from .services import aget_gateway
+from .verification import averify_once
+from .views import (
+    deposit_payment_kwargs, finalize_withdrawal_response, payment_gateway_name, queued_withdrawal_response,
+    record_initialized_deposit, reserve_withdrawal, validate_withdrawal, verification_response, withdrawal_reference,
+    withdrawal_response,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAPIView(views.APIView):
+    """
+    APIView whose handlers are coroutines. DRF's dispatch is sync, so this
+    runs request setup and the sync checks in `initial()` in one
+    sync_to_async hop. Then it awaits the handler and finalizes the response
+    as usual.
+    """
+    # Makes as_view() return a coroutine function, so Django awaits dispatch()
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class AsyncVerifyPaymentView(AsyncAPIView):
+    permission_classes = [permissions.AllowAny]
+
+    async def get(self, request):
+        reference = request.query_params.get('reference')
+        if not reference:
+            return Response({'error': 'No reference provided'}, status=400)
+
+        async def verify():
+            gateway = await aget_gateway(await sync_to_async(payment_gateway_name)(reference))
+            verification_data = await gateway.verify_payment(reference)
+            return await sync_to_async(verification_response)(reference, gateway, verification_data)
+
+        return await averify_once(reference, verify)
+
+
+class AsyncDepositInitializeView(AsyncAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def post(self, request):
+        payment = deposit_payment_kwargs(request)
+        if isinstance(payment, Response):
+            return payment
+
+        gateway = await aget_gateway(failover=True)
+        init_data = await gateway.initialize_payment(**payment)
+        await sync_to_async(record_initialized_deposit)(request.user, gateway, payment, init_data)
+        return Response(init_data)
+
+
+class AsyncWithdrawalView(AsyncAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def post(self, request):
+        withdrawal = validate_withdrawal(request)
+        if isinstance(withdrawal, Response):
+            return withdrawal
+        amount, bank_code, account_number = withdrawal
+
+        gateway = await aget_gateway()
+        if not hasattr(gateway, 'transfer'):
+            return Response({'error': 'Active gateway does not support transfers'}, status=400)
+
+        recipient_code, error = await aget_transfer_recipient(gateway, request.user, account_number, bank_code)
+        if error:
+            return Response({'error': error}, status=400)
+
+        reference = withdrawal_reference(request.user)
+        if settings.PAYOUTS_BATCHED:
+            return await sync_to_async(queued_withdrawal_response)(
+                request.user, gateway, amount, reference, recipient_code, account_number, bank_code
+            )
+        tx = await sync_to_async(reserve_withdrawal)(request.user, gateway, amount, reference)
+        if tx is None:
+            return Response({'error': 'Insufficient balance'}, status=400)
+        transfer_res = await gateway.transfer(amount, recipient_code, reference)
+        return await sync_to_async(withdrawal_response)(request.user, tx, transfer_res)
+
+
+class AsyncFinalizeWithdrawalView(AsyncAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def post(self, request):
+        transfer_code = request.data.get('transfer_code')
+        otp = request.data.get('otp')
+
+        if not all([transfer_code, otp]):
+            return Response({'error': 'Transfer code and OTP are required'}, status=400)
+
+        gateway = await aget_gateway()
+        logger.info(f"Finalizing transfer {transfer_code} with OTP for user {request.user.id}")
+        res = await gateway.finalize_transfer(transfer_code, otp)
+        return await sync_to_async(finalize_withdrawal_response)(request.user, transfer_code, res)
@@ -0,0 +1,177 @@
+"""
+Shared cache for gateway responses that rarely change.
+
+Read-only gateway operations listed in CACHE_POLICIES are served from the
+Django cache. Entries are keyed by gateway, test/live mode, operation and
+request arguments. An entry is fresh for `fresh` seconds. For a further
+`stale` seconds it is still returned at once while a single caller refreshes
+it in the background (stale-while-revalidate). Only successful responses are
+stored, and a failed refresh keeps serving the stale copy.
+
+Misses are single-flight. The first caller takes a short lock in the cache
+and calls the gateway. Concurrent callers for the same key wait for the
+result instead of making their own calls. If the leader fails without
+storing anything, the next waiter takes the lock. If nothing arrives within
+LOCK_WAIT seconds, waiters give up and call the gateway directly.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import NamedTuple
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+GATEWAY_CACHE_KEY = 'payments:gateway:{gateway}:{mode}:{operation}:{digest}'
+# Longer than a gateway call can take, including retries
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 10
+POLL_INTERVAL = 0.05
+
+
+class CachePolicy(NamedTuple):
+    fresh: int
+    stale: int
+
+
+CACHE_POLICIES = {
+    # The bank list changes a few times a year
+    'list_banks': CachePolicy(fresh=6 * 60 * 60, stale=7 * 24 * 60 * 60),
+    # Repeated lookups while a user fills in the withdrawal form
+    'resolve_bank_account': CachePolicy(fresh=15 * 60, stale=24 * 60 * 60),
+}
+
+_background_tasks = set()
+
+
+def gateway_cache_key(gateway, operation, path, params=None):
+    digest = hashlib.blake2b(
+        json.dumps([path, params or {}], sort_keys=True).encode(), digest_size=16
+    ).hexdigest()
+    return GATEWAY_CACHE_KEY.format(
+        gateway=gateway.NAME,
+        mode='test' if gateway.is_test_mode else 'live',
+        operation=operation,
+        digest=digest,
+    )
+
+
+def is_success(response):
+    # Paystack answers {"status": true}, Flutterwave {"status": "success"}
+    return isinstance(response, dict) and response.get('status') in (True, 'success')
+
+
+def _entry(response, policy):
+    return {'response': response, 'fresh_until': time.time() + policy.fresh}
+
+
+def _lock_key(key):
+    return f'{key}:lock'
+
+
+def _store(key, policy, response):
+    if is_success(response):
+        cache.set(key, _entry(response, policy), policy.fresh + policy.stale)
+    return response
+
+
+def cached_call(key, policy, call):
+    """Return `call()`'s response through the cache under `key`."""
+    entry = cache.get(key)
+    if entry is not None:
+        if time.time() >= entry['fresh_until']:
+            _refresh_in_background(key, policy, call)
+        return entry['response']
+
+    lock_key = _lock_key(key)
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        if cache.add(lock_key, 1, LOCK_TIMEOUT):
+            try:
+                # The previous holder may have filled it just before releasing
+                entry = cache.get(key)
+                if entry is not None:
+                    return entry['response']
+                return _store(key, policy, call())
+            finally:
+                cache.delete(lock_key)
+        time.sleep(POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['response']
+
+    logger.warning(f"Gave up waiting for in-flight gateway call {key}")
+    return _store(key, policy, call())
+
+
+def _refresh_in_background(key, policy, call):
+    lock_key = _lock_key(key)
+    if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        return  # Someone is already refreshing it
+
+    def refresh():
+        try:
+            _store(key, policy, call())
+        except Exception as e:
+            logger.error(f"Background refresh of {key} failed: {e}")
+        finally:
+            cache.delete(lock_key)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+async def acached_call(key, policy, call):
+    """Async cached_call(): `call` is a coroutine function."""
+    entry = await cache.aget(key)
+    if entry is not None:
+        if time.time() >= entry['fresh_until']:
+            await _arefresh_in_background(key, policy, call)
+        return entry['response']
+
+    lock_key = _lock_key(key)
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        if await cache.aadd(lock_key, 1, LOCK_TIMEOUT):
+            try:
+                entry = await cache.aget(key)
+                if entry is not None:
+                    return entry['response']
+                return await _astore(key, policy, await call())
+            finally:
+                await cache.adelete(lock_key)
+        await asyncio.sleep(POLL_INTERVAL)
+        entry = await cache.aget(key)
+        if entry is not None:
+            return entry['response']
+
+    logger.warning(f"Gave up waiting for in-flight gateway call {key}")
+    return await _astore(key, policy, await call())
+
+
+async def _astore(key, policy, response):
+    if is_success(response):
+        await cache.aset(key, _entry(response, policy), policy.fresh + policy.stale)
+    return response
+
+
+async def _arefresh_in_background(key, policy, call):
+    lock_key = _lock_key(key)
+    if not await cache.aadd(lock_key, 1, LOCK_TIMEOUT):
+        return
+
+    async def refresh():
+        try:
+            await _astore(key, policy, await call())
+        except Exception as e:
+            logger.error(f"Background refresh of {key} failed: {e}")
+        finally:
+            await cache.adelete(lock_key)
+
+    # The event loop only keeps weak references to tasks
+    task = asyncio.create_task(refresh())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
@@ -0,0 +1,25 @@
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from .webhooks import process_due_events, webhook_queue_stats
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+@csrf_exempt
+def cron_process_webhooks(request):
+    """Sweep due webhook events, for deployments without a Celery worker and beat."""
+    # Security check: verify CRON_SECRET header
+    cron_secret = os.environ.get('CRON_SECRET')
+    if not cron_secret:
+        return JsonResponse({'error': 'CRON_SECRET not configured'}, status=500)
+
+    if request.headers.get('Authorization') != f"Bearer {cron_secret}":
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+
+    try:
+        processed = process_due_events()
+        return JsonResponse({'status': 'success', 'processed_count': processed, 'queue': webhook_queue_stats()})
+    except Exception as e:
+        logger.error(f"Webhook sweep failed: {e}")
+        return JsonResponse({'error': str(e)}, status=500)
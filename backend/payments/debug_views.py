@@ -5,7 +5,9 @@ from rest_framework import views, permissions
 from rest_framework.response import Response
 from django.conf import settings
 from .services import get_gateway, PaystackGateway
-from core.models import PlatformSettings
+from .metrics import gateway_metrics
+from .webhooks import webhook_queue_stats
+from core.cache import get_platform_secrets, get_platform_settings
 import uuid
 
 class PaystackDebugView(views.APIView):
@@ -19,7 +21,9 @@ class PaystackDebugView(views.APIView):
             'db_settings': {},
             'gateway_info': {},
             'bank_test': {},
-            'init_test': {}
+            'init_test': {},
+            'gateway_metrics': {},
+            'webhook_queue': {}
         }
         
         # Step 1: Check environment variables
@@ -34,13 +38,13 @@ class PaystackDebugView(views.APIView):
         
         # Step 2: Check database settings
         try:
-            db_settings = PlatformSettings.objects.first()
+            db_settings = get_platform_settings()
             if db_settings:
                 debug_info['db_settings'] = {
                     'exists': True,
                     'active_gateway': db_settings.active_gateway,
                     'db_public_key_set': bool(db_settings.paystack_public_key),
-                    'db_secret_key_set': bool(db_settings.paystack_secret_key),
+                    'db_secret_key_set': bool(get_platform_secrets()['paystack_secret_key']),
                     'use_test_mode': db_settings.use_test_mode,
                 }
             else:
@@ -97,5 +101,7 @@ class PaystackDebugView(views.APIView):
         except Exception as e:
             debug_info['init_test'] = {'error': str(e)}
         
+        debug_info['gateway_metrics'] = gateway_metrics.snapshot()
+        debug_info['webhook_queue'] = webhook_queue_stats()
         debug_info['step'] = 'Diagnostics complete'
         return Response(debug_info)
@@ -0,0 +1,159 @@
+"""
+Shared health tracking and circuit breaking for payment gateways.
+
+Unlike payments.metrics, which each worker keeps for itself, these numbers
+live in the Django cache so every worker sees the same picture and trips the
+same breaker:
+
+- Each HTTP attempt is counted in 10-second buckets per gateway: calls,
+  errors (exceptions and 5xx), failures (errors plus slow calls) and total
+  latency. The rolling window is the last GATEWAY_HEALTH_WINDOW seconds.
+- Once the window holds at least GATEWAY_BREAKER_MIN_CALLS calls and the
+  share of failed calls (errors or slower than GATEWAY_BREAKER_SLOW_CALL
+  seconds) reaches GATEWAY_BREAKER_FAILURE_RATE, the breaker opens. Calls
+  are then refused without touching the network, for
+  GATEWAY_BREAKER_COOLDOWN seconds.
+- After the cooldown the breaker is half-open: one caller at a time is let
+  through as a probe. A good probe closes the breaker and starts a fresh
+  window; a bad one opens it for another cooldown.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+HEALTH_KEY = 'payments:health:{gateway}:{bucket}:{field}'
+BREAKER_KEY = 'payments:health:{gateway}:breaker'
+PROBE_KEY = 'payments:health:{gateway}:probe'
+BUCKET_SECONDS = 10
+FIELDS = ('calls', 'errors', 'failures', 'latency_ms')
+# Longer than a gateway call can take; a probe that never reports is replaced
+PROBE_TIMEOUT = 30
+BREAKER_TIMEOUT = 24 * 60 * 60
+DEFAULT_WINDOW = 60
+DEFAULT_MIN_CALLS = 20
+DEFAULT_FAILURE_RATE = 0.5
+DEFAULT_SLOW_CALL = 10
+DEFAULT_COOLDOWN = 30
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def is_error(outcome):
+    """An exception name or a 5xx status, as in payments.metrics."""
+    return not isinstance(outcome, int) or outcome >= 500
+
+
+class GatewayHealth:
+    def _buckets(self, now):
+        current = int(now // BUCKET_SECONDS)
+        count = max(1, int(_setting('GATEWAY_HEALTH_WINDOW', DEFAULT_WINDOW) // BUCKET_SECONDS))
+        return range(current - count + 1, current + 1)
+
+    def _keys(self, gateway, buckets):
+        return [HEALTH_KEY.format(gateway=gateway, bucket=b, field=f) for b in buckets for f in FIELDS]
+
+    def _incr(self, key, delta, timeout):
+        if cache.add(key, delta, timeout):
+            return
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.add(key, delta, timeout)
+
+    def record(self, gateway, duration, outcome):
+        """Count one attempt and open or close the breaker if it changes things."""
+        now = time.time()
+        error = is_error(outcome)
+        slow = duration >= _setting('GATEWAY_BREAKER_SLOW_CALL', DEFAULT_SLOW_CALL)
+        bucket = int(now // BUCKET_SECONDS)
+        timeout = _setting('GATEWAY_HEALTH_WINDOW', DEFAULT_WINDOW) + BUCKET_SECONDS
+        for field, delta in (('calls', 1), ('errors', int(error)), ('failures', int(error or slow)),
+                             ('latency_ms', int(duration * 1000))):
+            if delta:
+                self._incr(HEALTH_KEY.format(gateway=gateway, bucket=bucket, field=field), delta, timeout)
+
+        breaker = cache.get(BREAKER_KEY.format(gateway=gateway))
+        if breaker is None:
+            window = self.window(gateway, now)
+            if (window['calls'] >= _setting('GATEWAY_BREAKER_MIN_CALLS', DEFAULT_MIN_CALLS)
+                    and window['failure_rate'] >= _setting('GATEWAY_BREAKER_FAILURE_RATE', DEFAULT_FAILURE_RATE)):
+                self._open(gateway, now, f"{window['failure_rate']:.0%} of {window['calls']} calls failed")
+        elif now >= breaker['until']:
+            # The half-open probe reporting back. Calls that were already in
+            # flight when the breaker opened report before `until` and are ignored.
+            if error or slow:
+                self._open(gateway, now, f"Probe failed ({outcome})")
+            else:
+                self.reset(gateway)
+
+    def _open(self, gateway, now, reason):
+        cooldown = _setting('GATEWAY_BREAKER_COOLDOWN', DEFAULT_COOLDOWN)
+        cache.set(BREAKER_KEY.format(gateway=gateway), {
+            'opened_at': now, 'until': now + cooldown, 'reason': reason,
+        }, BREAKER_TIMEOUT)
+        cache.delete(PROBE_KEY.format(gateway=gateway))
+
+    def window(self, gateway, now=None):
+        """Totals over the rolling window, with the failure rate and mean latency."""
+        keys = self._keys(gateway, self._buckets(now or time.time()))
+        values = cache.get_many(keys)
+        totals = dict.fromkeys(FIELDS, 0)
+        for key, value in values.items():
+            totals[key.rsplit(':', 1)[1]] += value
+        calls = totals['calls']
+        return {
+            'calls': calls,
+            'errors': totals['errors'],
+            'failures': totals['failures'],
+            'failure_rate': round(totals['failures'] / calls, 3) if calls else 0.0,
+            'avg_latency_ms': round(totals['latency_ms'] / calls, 1) if calls else None,
+        }
+
+    def state(self, gateway):
+        """'closed', 'open' or 'half_open'."""
+        breaker = cache.get(BREAKER_KEY.format(gateway=gateway))
+        if breaker is None:
+            return 'closed'
+        return 'open' if time.time() < breaker['until'] else 'half_open'
+
+    def is_available(self, gateway):
+        """Whether a call would be let through right now, without claiming the probe."""
+        state = self.state(gateway)
+        return state == 'closed' or (state == 'half_open' and cache.get(PROBE_KEY.format(gateway=gateway)) is None)
+
+    def allow_request(self, gateway):
+        """
+        Whether to make a call. False while the breaker is open; when it is
+        half-open, True for the one caller that gets to probe.
+        """
+        state = self.state(gateway)
+        if state == 'closed':
+            return True
+        if state == 'open':
+            return False
+        return cache.add(PROBE_KEY.format(gateway=gateway), 1, PROBE_TIMEOUT)
+
+    def snapshot(self, gateway):
+        breaker = cache.get(BREAKER_KEY.format(gateway=gateway)) or {}
+        return {
+            'state': self.state(gateway),
+            'reason': breaker.get('reason', ''),
+            'opened_at': breaker.get('opened_at'),
+            'retry_at': breaker.get('until'),
+            **self.window(gateway),
+        }
+
+    def reset(self, gateway):
+        """Close the breaker and start a fresh window."""
+        cache.delete_many([
+            BREAKER_KEY.format(gateway=gateway),
+            PROBE_KEY.format(gateway=gateway),
+            *self._keys(gateway, self._buckets(time.time())),
+        ])
+
+
+gateway_health = GatewayHealth()
@@ -0,0 +1,191 @@
+"""
+Append-only double-entry ledger for wallet money.
+
+Every movement of money is a posting: a set of LedgerEntry rows, one per
+account touched, that sum to zero. Accounts are named by string:
+
+- user:{id}              a user's wallet
+- escrow:{deal id}       money held for a deal between funding and release
+- platform:fees          fee income, recognised when escrow is settled
+- gateway:{name}         money that came in or went out through a gateway
+- platform:adjustments   admin corrections
+- platform:opening       counterpart of the balances carried over when the
+                         ledger was introduced
+
+Balances are materialized as postings are written, in the same
+transaction. A wallet's balance is User.balance and an escrow's is its
+AccountBalance row, each changed with a single UPDATE ... SET balance =
+balance + x, never a read-modify-write save(). A wallet debit adds
+WHERE balance >= x to that UPDATE (see change_wallet_balance()), so
+concurrent debits cannot overdraw it and the posting is rolled back with
+InsufficientFunds instead. Platform and gateway
+accounts are touched by nearly every posting, so they get no row (it would
+be a lock every payment waits on); account_balance() sums their entries.
+
+recompute_balances() rebuilds any set of accounts from the entries in one
+streaming pass. The verify_ledger command compares that with the
+materialized balances.
+"""
+import uuid
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Sum
+
+from core.money import Money, ZERO
+from .models import AccountBalance, LedgerEntry
+
+User = get_user_model()
+
+FEES = 'platform:fees'
+ADJUSTMENTS = 'platform:adjustments'
+OPENING = 'platform:opening'
+STREAM_CHUNK_SIZE = 5000
+
+
+class InsufficientFunds(Exception):
+    """A posting would have taken a wallet below zero."""
+
+    def __init__(self, account):
+        super().__init__(f"Insufficient balance in {account}")
+        self.account = account
+
+
+def change_wallet_balance(user, amount, overdraft=False):
+    """
+    Add `amount` (Money, negative to debit) to the user's balance with one
+    conditional UPDATE that touches only the balance column. Unless
+    `overdraft`, a debit only happens if the balance covers it. Returns
+    whether the row was updated.
+    """
+    rows = User.objects.filter(pk=getattr(user, 'pk', user))
+    if amount < ZERO and not overdraft:
+        rows = rows.filter(balance__gte=(-amount).to_decimal())
+    return rows.update(balance=F('balance') + amount.to_decimal()) == 1
+
+
+def user_account(user):
+    return f"user:{getattr(user, 'pk', user)}"
+
+
+def escrow_account(deal):
+    return f"escrow:{getattr(deal, 'pk', deal)}"
+
+
+def gateway_account(gateway_name):
+    return f"gateway:{gateway_name}"
+
+
+def post(kind, legs, reference='', overdraft=False):
+    """
+    Write one posting and update the materialized balances it touches.
+    `legs` is a list of (account, Money) that must sum to zero; zero legs are
+    dropped. Returns the posting id. Raises InsufficientFunds, having written
+    nothing, if a wallet cannot cover its debit and `overdraft` is not set.
+    """
+    legs = [(account, amount) for account, amount in legs if amount]
+    if sum((amount for _, amount in legs), ZERO):
+        raise ValueError(f"Unbalanced {kind} posting {reference}: {legs}")
+    posting = uuid.uuid4()
+    with transaction.atomic():
+        LedgerEntry.objects.bulk_create([
+            LedgerEntry(posting=posting, account=account, amount=amount.to_decimal(), kind=kind, reference=reference)
+            for account, amount in legs
+        ])
+        for account, amount in legs:
+            _materialize(account, amount, overdraft)
+    return posting
+
+
+def _materialize(account, amount, overdraft):
+    prefix, _, key = account.partition(':')
+    if prefix == 'user':
+        if not change_wallet_balance(key, amount, overdraft) and amount < ZERO:
+            raise InsufficientFunds(account)
+    elif prefix == 'escrow':
+        AccountBalance.objects.get_or_create(account=account)
+        AccountBalance.objects.filter(account=account).update(balance=F('balance') + amount.to_decimal())
+
+
+def settle_escrow(deal, kind, payouts, reference=''):
+    """
+    Empty the deal's escrow: pay each (account, Money) in `payouts` and book
+    what is left over as platform fees. Returns the amount that was held.
+    """
+    account = escrow_account(deal)
+    with transaction.atomic():
+        row = AccountBalance.objects.select_for_update().filter(account=account).first()
+        held = Money.from_naira(row.balance) if row else ZERO
+        paid_out = sum((amount for _, amount in payouts), ZERO)
+        post(kind, [(account, -held), *payouts, (FEES, held - paid_out)], reference=reference)
+    return held
+
+
+def account_balance(account):
+    """Current balance of any account, as Money."""
+    prefix, _, key = account.partition(':')
+    if prefix == 'user':
+        balance = User.objects.filter(pk=key).values_list('balance', flat=True).first()
+    elif prefix == 'escrow':
+        balance = AccountBalance.objects.filter(account=account).values_list('balance', flat=True).first()
+    else:
+        balance = LedgerEntry.objects.filter(account=account).aggregate(total=Sum('amount'))['total']
+    return Money.from_naira(balance or 0)
+
+
+def recompute_balances(accounts=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Sum the entries of `accounts` (all accounts if None) in one streaming
+    pass over the ledger. Returns ({account: Money}, number of entries read).
+    """
+    entries = LedgerEntry.objects.order_by('id')
+    if accounts is not None:
+        entries = entries.filter(account__in=list(accounts))
+    totals = defaultdict(int)
+    count = 0
+    for account, amount in entries.values_list('account', 'amount').iterator(chunk_size=chunk_size):
+        totals[account] += Money.from_naira(amount).kobo
+        count += 1
+    return {account: Money.from_kobo(kobo) for account, kobo in totals.items()}, count
+
+
+def materialized_balances(accounts=None, chunk_size=STREAM_CHUNK_SIZE):
+    """The stored balance of each user and escrow account in `accounts` (all of them if None)."""
+    users = User.objects.order_by('pk')
+    escrows = AccountBalance.objects.order_by('account')
+    if accounts is not None:
+        users = users.filter(pk__in=[a.split(':', 1)[1] for a in accounts if a.startswith('user:')])
+        escrows = escrows.filter(account__in=[a for a in accounts if a.startswith('escrow:')])
+    balances = {
+        user_account(pk): Money.from_naira(balance)
+        for pk, balance in users.values_list('pk', 'balance').iterator(chunk_size=chunk_size)
+    }
+    balances.update(
+        (account, Money.from_naira(balance))
+        for account, balance in escrows.values_list('account', 'balance').iterator(chunk_size=chunk_size)
+    )
+    return balances
+
+
+def rebuild_balance(account):
+    """
+    Rewrite a user or escrow account's materialized balance from its
+    entries. The row stays locked while the entries are summed, so no
+    posting lands in between. Returns the new balance.
+    """
+    prefix, _, key = account.partition(':')
+    with transaction.atomic():
+        if prefix == 'user':
+            list(User.objects.select_for_update().filter(pk=key).values_list('pk'))
+        else:
+            AccountBalance.objects.get_or_create(account=account)
+            list(AccountBalance.objects.select_for_update().filter(account=account).values_list('pk'))
+        total = Money.from_naira(
+            LedgerEntry.objects.filter(account=account).aggregate(total=Sum('amount'))['total'] or 0
+        )
+        if prefix == 'user':
+            User.objects.filter(pk=key).update(balance=total.to_decimal())
+        else:
+            AccountBalance.objects.filter(account=account).update(balance=total.to_decimal())
+    return total
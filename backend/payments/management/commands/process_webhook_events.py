@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from payments.models import WebhookEvent
+from payments.webhooks import process_due_events, requeue_events, webhook_queue_stats
+
+
+class Command(BaseCommand):
+    help = "Process stored webhook events that are due, for deployments without a Celery worker"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requeue-dead', action='store_true',
+            help="Give dead-lettered events a fresh set of attempts first",
+        )
+
+    def handle(self, *args, **options):
+        prefix = ''
+        if options['requeue_dead']:
+            prefix = f"Requeued {requeue_events(WebhookEvent.objects.filter(status='dead'))} dead events. "
+        processed = process_due_events()
+        stats = webhook_queue_stats()
+        self.stdout.write(
+            f"{prefix}Processed {processed} webhook events: {stats['pending']} pending, "
+            f"{stats['retrying']} retrying, {stats['dead']} dead, {stats['lag_seconds']}s lag."
+        )
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from payments.reconciliation import DEFAULT_MIN_AGE, reconcile_pending_payments
+from payments.services import GATEWAY_CLASSES, get_gateway
+
+
+class Command(BaseCommand):
+    help = "Verify pending deposits and deal payments against the active gateway and settle them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gateway', choices=list(GATEWAY_CLASSES), help='Defaults to the active gateway')
+        parser.add_argument('--chunk-size', type=int)
+        parser.add_argument('--concurrency', type=int)
+        parser.add_argument('--max-chunks', type=int, help='Stop after this many chunks; the next run resumes')
+        parser.add_argument(
+            '--min-age', type=int, default=int(DEFAULT_MIN_AGE.total_seconds() // 60),
+            help='Only check transactions older than this many minutes',
+        )
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start from the beginning')
+
+    def handle(self, *args, **options):
+        stats = reconcile_pending_payments(
+            get_gateway(options['gateway']),
+            chunk_size=options['chunk_size'],
+            concurrency=options['concurrency'],
+            min_age=timedelta(minutes=options['min_age']),
+            max_chunks=options['max_chunks'],
+            restart=options['restart'],
+        )
+        self.stdout.write(
+            f"Checked {stats.get('checked', 0)} pending payments in {stats.get('chunks', 0)} chunks: "
+            f"{stats.get('confirmed', 0)} confirmed, {stats.get('failed', 0)} failed, "
+            f"{stats.get('pending', 0)} still pending, {stats.get('mismatch', 0)} amount mismatches, "
+            f"{stats.get('skipped', 0)} skipped, {stats.get('errors', 0)} errors."
+        )
@@ -0,0 +1,70 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.cache import get_platform_secrets
+from payments.simulator import GatewaySimulator
+
+
+class Command(BaseCommand):
+    help = "Serve a local Paystack/Flutterwave simulator for load and soak testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=float, default=150)
+        parser.add_argument('--jitter-ms', type=float, default=50)
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with HTTP 503')
+        parser.add_argument('--otp', action='store_true', help='Single transfers wait for finalize_transfer')
+        parser.add_argument('--auto-pay', action='store_true', help='Complete charges as soon as they are initialized')
+        parser.add_argument('--webhook-url', help='Where to POST Paystack webhooks, e.g. http://127.0.0.1:8000/api/payments/webhook/paystack/')
+        parser.add_argument('--flutterwave-webhook-url', help='Where to POST Flutterwave webhooks')
+        parser.add_argument('--webhook-delay-ms', type=float, default=500)
+        parser.add_argument('--paystack-secret', help='Key to sign Paystack webhooks with; defaults to the configured secret key')
+        parser.add_argument('--flutterwave-hash', help='verif-hash for Flutterwave webhooks; defaults to the configured hash')
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        # Sign webhooks with the secrets the webhook views check against
+        paystack_secret, flutterwave_hash = options['paystack_secret'], options['flutterwave_hash']
+        if not (paystack_secret and flutterwave_hash):
+            platform = get_platform_secrets()
+            paystack_secret = (
+                paystack_secret or settings.PAYSTACK_SECRET_KEY or platform['paystack_secret_key'] or 'sk_test_simulator'
+            )
+            flutterwave_hash = (
+                flutterwave_hash or getattr(settings, 'FLUTTERWAVE_SECRET_HASH', None)
+                or platform['flutterwave_secret_key'] or 'simulator-hash'
+            )
+        simulator = GatewaySimulator(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency_ms'] / 1000,
+            jitter=options['jitter_ms'] / 1000,
+            error_rate=options['error_rate'],
+            otp=options['otp'],
+            auto_pay=options['auto_pay'],
+            paystack_webhook_url=options['webhook_url'],
+            flutterwave_webhook_url=options['flutterwave_webhook_url'],
+            paystack_secret=paystack_secret,
+            flutterwave_hash=flutterwave_hash,
+            webhook_delay=options['webhook_delay_ms'] / 1000,
+            seed=options['seed'],
+        ).start()
+
+        self.stdout.write(f"Gateway simulator listening on {simulator.url}")
+        self.stdout.write("Point the app at it with:")
+        self.stdout.write(f"  PAYSTACK_BASE_URL={simulator.url}")
+        self.stdout.write(f"  FLUTTERWAVE_BASE_URL={simulator.url}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulator.stop()
+
+        self.stdout.write("Requests served:")
+        for key, count in sorted(simulator.stats.items()):
+            self.stdout.write(f"  {key:<40} {count:>8}")
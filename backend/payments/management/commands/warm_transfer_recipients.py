@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.recipients import BULK_RECIPIENT_BATCH, warm_transfer_recipients
+from payments.services import get_gateway
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Register transfer recipients in bulk for users' saved bank details"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BULK_RECIPIENT_BATCH)
+
+    def handle(self, *args, **options):
+        gateway = get_gateway()
+        if not hasattr(gateway, 'create_transfer_recipients'):
+            raise CommandError(f"{gateway.NAME} does not support bulk recipient creation")
+
+        users = User.objects.exclude(bank_account='').exclude(bank_name='').only(
+            'id', 'username', 'first_name', 'last_name', 'bank_name', 'bank_account', 'bank_account_name'
+        )
+        stats = warm_transfer_recipients(gateway, users.iterator(), batch_size=options['batch_size'])
+        self.stdout.write(
+            f"Created {stats['created']} recipients, skipped {stats['skipped']} users, {stats['failed']} failed."
+        )
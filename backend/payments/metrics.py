@@ -0,0 +1,66 @@
+"""
+In-process latency metrics for payment gateway calls.
+
+Every HTTP attempt is recorded per (gateway, operation) with its duration and
+outcome: the HTTP status code, or the exception name when no response came
+back. Only a bounded window of recent samples is kept, so percentiles reflect
+current behaviour. Each worker process keeps its own numbers.
+"""
+import threading
+from collections import defaultdict, deque
+
+METRICS_WINDOW = 500
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class GatewayMetrics:
+    def __init__(self, window=METRICS_WINDOW):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._totals = defaultdict(lambda: {'calls': 0, 'errors': 0, 'retries': 0})
+
+    def record(self, gateway, operation, duration, outcome, retry=False):
+        """
+        `outcome` is an HTTP status code or an exception class name. Status
+        codes of 500 and above and exceptions count as errors.
+        """
+        error = not isinstance(outcome, int) or outcome >= 500
+        key = (gateway, operation)
+        with self._lock:
+            self._samples[key].append((duration, error))
+            totals = self._totals[key]
+            totals['calls'] += 1
+            totals['errors'] += error
+            totals['retries'] += retry
+
+    def snapshot(self):
+        """Per 'gateway.operation': lifetime counters plus latency percentiles (ms) over the window."""
+        with self._lock:
+            items = [(key, list(samples), dict(self._totals[key])) for key, samples in self._samples.items()]
+
+        result = {}
+        for (gateway, operation), samples, totals in items:
+            durations = sorted(duration * 1000 for duration, _ in samples)
+            result[f"{gateway}.{operation}"] = {
+                **totals,
+                'window': len(samples),
+                'window_errors': sum(1 for _, error in samples if error),
+                'p50_ms': _percentile(durations, 0.50),
+                'p95_ms': _percentile(durations, 0.95),
+                'max_ms': durations[-1] if durations else None,
+            }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+
+
+gateway_metrics = GatewayMetrics()
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:16
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_purpose(apps, schema_editor):
+    PaymentTransaction = apps.get_model('payments', 'PaymentTransaction')
+    gateways = ['paystack', 'flutterwave']
+    PaymentTransaction.objects.filter(transaction_type='deposit', gateway__in=gateways, user__isnull=False).update(
+        purpose='deposit', target_id=F('user_id')
+    )
+    PaymentTransaction.objects.filter(transaction_type='deal_payment', gateway__in=gateways, deal__isnull=False).update(
+        purpose='deal_funding', target_id=F('deal_id')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deals', '0006_deal_list_indexes'),
+        ('payments', '0009_webhookevent_unique_delivery'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymenttransaction',
+            name='purpose',
+            field=models.CharField(blank=True, choices=[('deposit', 'Wallet Deposit'), ('deal_funding', 'Deal Funding')], max_length=20),
+        ),
+        migrations.AddField(
+            model_name='paymenttransaction',
+            name='target_id',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='paymenttransaction',
+            index=models.Index(fields=['status', 'transaction_type', 'created_at'], name='tx_status_type_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymenttransaction',
+            index=models.Index(fields=['purpose', 'target_id'], name='tx_purpose_target_idx'),
+        ),
+        migrations.RunPython(backfill_purpose, migrations.RunPython.noop),
+    ]
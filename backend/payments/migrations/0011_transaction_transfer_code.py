@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0010_transaction_purpose'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymenttransaction',
+            name='gateway_reference',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='paymenttransaction',
+            name='transfer_code',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+    ]
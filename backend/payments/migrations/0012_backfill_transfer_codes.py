@@ -0,0 +1,35 @@
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def backfill_transfer_codes(apps, schema_editor):
+    PaymentTransaction = apps.get_model('payments', 'PaymentTransaction')
+    pending = (
+        PaymentTransaction.objects.filter(transaction_type='withdrawal', transfer_code='')
+        .only('id', 'raw_response')
+    )
+    batch = []
+    for tx in pending.iterator(chunk_size=BATCH_SIZE):
+        data = tx.raw_response.get('data') if isinstance(tx.raw_response, dict) else None
+        if not isinstance(data, dict) or not data.get('transfer_code'):
+            continue
+        tx.transfer_code = str(data['transfer_code'])[:100]
+        tx.gateway_reference = str(data.get('id') or '')[:100]
+        batch.append(tx)
+        if len(batch) >= BATCH_SIZE:
+            PaymentTransaction.objects.bulk_update(batch, ['transfer_code', 'gateway_reference'])
+            batch = []
+    if batch:
+        PaymentTransaction.objects.bulk_update(batch, ['transfer_code', 'gateway_reference'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0011_transaction_transfer_code'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_transfer_codes, migrations.RunPython.noop),
+    ]
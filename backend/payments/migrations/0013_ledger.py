@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0012_backfill_transfer_codes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalance',
+            fields=[
+                ('account', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('posting', models.UUIDField()),
+                ('account', models.CharField(max_length=64)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('kind', models.CharField(choices=[('opening', 'Opening Balance'), ('deposit', 'Deposit'), ('deal_funding', 'Deal Funding'), ('release', 'Escrow Release'), ('refund', 'Escrow Refund'), ('withdrawal', 'Withdrawal'), ('withdrawal_reversal', 'Withdrawal Reversal'), ('adjustment', 'Admin Adjustment')], max_length=32)),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Ledger entries',
+                'indexes': [models.Index(fields=['account', 'id'], name='ledger_account_idx'), models.Index(fields=['posting'], name='ledger_posting_idx'), models.Index(fields=['reference'], name='ledger_reference_idx')],
+            },
+        ),
+    ]
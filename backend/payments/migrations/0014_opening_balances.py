@@ -0,0 +1,62 @@
+import uuid
+
+from django.conf import settings
+from django.db import migrations
+
+BATCH_SIZE = 1000
+ESCROW_STATUSES = ['funded', 'in_progress', 'delivered', 'disputed']
+
+
+def post_opening_balances(apps, schema_editor):
+    """
+    Carry the existing wallet balances and funded escrows into the ledger,
+    each against platform:opening. User.balance already holds the wallet
+    balances, so only the escrow rows are materialized here.
+    """
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Deal = apps.get_model('deals', 'Deal')
+    PaymentTransaction = apps.get_model('payments', 'PaymentTransaction')
+    LedgerEntry = apps.get_model('payments', 'LedgerEntry')
+    AccountBalance = apps.get_model('payments', 'AccountBalance')
+
+    def opening(account, amount):
+        posting = uuid.uuid4()
+        return [
+            LedgerEntry(posting=posting, account=account, amount=amount, kind='opening'),
+            LedgerEntry(posting=posting, account='platform:opening', amount=-amount, kind='opening'),
+        ]
+
+    batch = []
+    for pk, balance in User.objects.exclude(balance=0).values_list('pk', 'balance').iterator(chunk_size=BATCH_SIZE):
+        batch.extend(opening(f'user:{pk}', balance))
+        if len(batch) >= BATCH_SIZE:
+            LedgerEntry.objects.bulk_create(batch)
+            batch = []
+
+    escrows = []
+    for deal in Deal.objects.filter(status__in=ESCROW_STATUSES).only('id', 'amount').iterator(chunk_size=BATCH_SIZE):
+        paid = PaymentTransaction.objects.filter(
+            deal_id=deal.id, status='success', transaction_type='deal_payment'
+        ).values_list('amount_paid', flat=True).first()
+        held = paid if paid is not None else deal.amount
+        batch.extend(opening(f'escrow:{deal.id}', held))
+        escrows.append(AccountBalance(account=f'escrow:{deal.id}', balance=held))
+        if len(batch) >= BATCH_SIZE:
+            LedgerEntry.objects.bulk_create(batch)
+            AccountBalance.objects.bulk_create(escrows)
+            batch, escrows = [], []
+    LedgerEntry.objects.bulk_create(batch)
+    AccountBalance.objects.bulk_create(escrows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deals', '0006_deal_list_indexes'),
+        ('payments', '0013_ledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(post_opening_balances, migrations.RunPython.noop),
+    ]
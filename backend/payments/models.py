@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 class PaymentTransaction(models.Model):
     GATEWAY_CHOICES = (
@@ -20,6 +21,12 @@ class PaymentTransaction(models.Model):
         ('payout', 'Payout'),
     )
 
+    # What an incoming gateway payment pays for; target_id is the User or Deal
+    PURPOSE_CHOICES = (
+        ('deposit', 'Wallet Deposit'),
+        ('deal_funding', 'Deal Funding'),
+    )
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='transactions', null=True, blank=True)
     deal = models.ForeignKey('deals.Deal', on_delete=models.CASCADE, related_name='transactions', null=True, blank=True)
     gateway = models.CharField(max_length=20, choices=GATEWAY_CHOICES)
@@ -27,13 +34,29 @@ class PaymentTransaction(models.Model):
     amount_paid = models.DecimalField(max_digits=12, decimal_places=2)
     transaction_type = models.CharField(max_length=20, choices=TYPE_CHOICES, default='deal_payment')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    purpose = models.CharField(max_length=20, choices=PURPOSE_CHOICES, blank=True)
+    target_id = models.PositiveBigIntegerField(null=True, blank=True)
+    # Set when a transfer is initiated, so finalization and reconciliation look it up by index
+    transfer_code = models.CharField(max_length=100, blank=True, db_index=True)
+    gateway_reference = models.CharField(max_length=100, blank=True, db_index=True)
     raw_response = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'transaction_type', 'created_at'], name='tx_status_type_created_idx'),
+            models.Index(fields=['purpose', 'target_id'], name='tx_purpose_target_idx'),
+        ]
+
     def __str__(self):
         return f"{self.gateway} {self.reference} - {self.status}"
 
 class Payout(models.Model):
+    """
+    A bank transfer waiting to go out. Pending payouts are sent in batches
+    by the payout engine (payments.payouts); the linked PaymentTransaction
+    mirrors the final outcome.
+    """
     STATUS_CHOICES = (
         ('pending', 'Pending'),
         ('processing', 'Processing'),
@@ -41,13 +64,150 @@ class Payout(models.Model):
         ('failed', 'Failed'),
     )
 
-    deal = models.ForeignKey('deals.Deal', on_delete=models.CASCADE, related_name='payouts')
+    deal = models.ForeignKey('deals.Deal', on_delete=models.CASCADE, related_name='payouts', null=True, blank=True)
     freelancer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    transaction = models.OneToOneField(
+        PaymentTransaction, on_delete=models.SET_NULL, related_name='payout', null=True, blank=True
+    )
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     bank_details_snapshot = models.JSONField(default=dict)
+    recipient_code = models.CharField(max_length=100, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     reference = models.CharField(max_length=100, blank=True)
+    # Set when a worker claims the payout; the bulk request it went out in
+    batch_id = models.CharField(max_length=32, blank=True, db_index=True)
+    transfer_code = models.CharField(max_length=100, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    failure_reason = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='payout_status_created_idx'),
+        ]
 
     def __str__(self):
         return f"Payout {self.amount} to {self.freelancer}"
+
+class TransferRecipient(models.Model):
+    """
+    A recipient code the gateway issued for one of a user's bank accounts.
+    Reused by later withdrawals to the same account; see payments.recipients.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='transfer_recipients')
+    gateway = models.CharField(max_length=20, choices=PaymentTransaction.GATEWAY_CHOICES[:2])
+    # Recipient codes from test mode are not valid in live mode and vice versa
+    is_test_mode = models.BooleanField(default=True)
+    account_number = models.CharField(max_length=20)
+    bank_code = models.CharField(max_length=20)
+    account_name = models.CharField(max_length=100, blank=True)
+    recipient_code = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'gateway', 'is_test_mode', 'account_number', 'bank_code'],
+                name='transfer_recipient_unique_account',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.recipient_code} ({self.user} {self.bank_code}/{self.account_number})"
+
+class WebhookEvent(models.Model):
+    """
+    A signature-verified gateway webhook, stored as received and processed
+    later by a worker (see payments.webhooks). The unique delivery key turns
+    gateway redeliveries away at insert time.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('dead', 'Dead-lettered'),
+    )
+
+    gateway = models.CharField(max_length=20, choices=PaymentTransaction.GATEWAY_CHOICES[:2])
+    event_type = models.CharField(max_length=64)
+    reference = models.CharField(max_length=100, blank=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='webhook_status_due_idx'),
+            models.Index(fields=['reference', 'id'], name='webhook_reference_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['gateway', 'reference', 'event_type'],
+                condition=~models.Q(reference=''),
+                name='webhook_event_unique_delivery',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.gateway} {self.event_type} {self.reference} - {self.status}"
+
+class LedgerEntry(models.Model):
+    """
+    One leg of a double-entry posting (see payments.ledger). The entries of
+    a posting sum to zero. Rows are only ever inserted: a mistake is undone
+    by a reversing posting, never by editing history.
+    """
+    KIND_CHOICES = (
+        ('opening', 'Opening Balance'),
+        ('deposit', 'Deposit'),
+        ('deal_funding', 'Deal Funding'),
+        ('release', 'Escrow Release'),
+        ('refund', 'Escrow Refund'),
+        ('withdrawal', 'Withdrawal'),
+        ('withdrawal_reversal', 'Withdrawal Reversal'),
+        ('adjustment', 'Admin Adjustment'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    posting = models.UUIDField()
+    account = models.CharField(max_length=64)
+    # Change to the account's balance; positive credits it
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    reference = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'id'], name='ledger_account_idx'),
+            models.Index(fields=['posting'], name='ledger_posting_idx'),
+            models.Index(fields=['reference'], name='ledger_reference_idx'),
+        ]
+        verbose_name_plural = "Ledger entries"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Ledger entries are append-only")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Ledger entries are append-only")
+
+    def __str__(self):
+        return f"{self.account} {self.amount:+} ({self.kind} {self.reference})"
+
+class AccountBalance(models.Model):
+    """
+    Materialized balance of an escrow account, kept up to date by every
+    posting that touches it. User wallets materialize on User.balance.
+    """
+    account = models.CharField(max_length=64, primary_key=True)
+    balance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.account}: {self.balance}"
@@ -0,0 +1,312 @@
+"""
+Batched payout engine.
+
+Bank transfers owed to users are queued as Payout rows instead of being sent
+one by one inside the request. Withdrawals do this when PAYOUTS_BATCHED is
+on. The process_payout_queue task drains the queue:
+
+1. claim_batch() moves up to PAYOUT_BATCH_SIZE pending payouts to
+   'processing' under a fresh batch_id with one conditional UPDATE, so
+   workers running side by side never claim the same row.
+2. submit_batch() sends the batch through the gateway's bulk transfer
+   endpoint and settles each item from its result. 'success' marks it paid,
+   'failed' refunds the wallet, and anything else stays 'processing' until
+   reconcile_payouts() learns the final status.
+3. settle_payout() mirrors the final status onto the linked
+   PaymentTransaction.
+
+A batch whose response was lost is never re-sent blindly. The gateway keeps
+transfer references unique, so reconcile_payouts() asks about each
+reference and only requeues the ones the gateway has never seen.
+
+Direct withdrawals sent from the request have no Payout row. One whose
+transfer call timed out stays a pending PaymentTransaction until a webhook
+or reconcile_withdrawals() learns how it ended; settle_withdrawal() then
+marks it and refunds the wallet if the transfer failed.
+"""
+import logging
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.emails import EmailService
+from core.models import Notification
+from core.money import Money
+from .ledger import InsufficientFunds, gateway_account, post, user_account
+from .models import PaymentTransaction, Payout
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RECONCILE_AFTER = timedelta(minutes=30)
+
+# Gateway transfer status -> final Payout status; anything else is still in flight
+FINAL_STATUSES = {
+    'success': 'paid',
+    'failed': 'failed',
+    'reversed': 'failed',
+}
+
+
+def get_batch_size():
+    return getattr(settings, 'PAYOUT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+
+def get_concurrency():
+    return getattr(settings, 'PAYOUT_CONCURRENCY', DEFAULT_CONCURRENCY)
+
+
+def enqueue_withdrawal(user, gateway, amount, reference, recipient_code, account_number, bank_code):
+    """
+    Debit `amount` from the wallet and queue the transfer. Returns the
+    Payout, or None if the balance no longer covers it.
+    """
+    with transaction.atomic():
+        try:
+            post('withdrawal', [(user_account(user), -amount), (gateway_account(gateway.NAME), amount)], reference)
+        except InsufficientFunds:
+            return None
+
+        tx = PaymentTransaction.objects.create(
+            user=user,
+            gateway=gateway.NAME,
+            reference=reference,
+            amount_paid=amount.to_decimal(),
+            transaction_type='withdrawal',
+            status='pending',
+        )
+        payout = Payout.objects.create(
+            freelancer=user,
+            transaction=tx,
+            amount=amount.to_decimal(),
+            reference=reference,
+            recipient_code=recipient_code,
+            bank_details_snapshot={'account_number': account_number, 'bank_code': bank_code},
+        )
+    user.refresh_from_db(fields=['balance'])
+    return payout
+
+
+def claim_batch(batch_size=None):
+    """Claim up to `batch_size` of the oldest pending payouts for this worker."""
+    batch_id = uuid.uuid4().hex
+    ids = list(
+        Payout.objects.filter(status='pending').order_by('created_at', 'id')
+        .values_list('id', flat=True)[:batch_size or get_batch_size()]
+    )
+    if not ids:
+        return []
+    Payout.objects.filter(id__in=ids, status='pending').update(
+        status='processing', batch_id=batch_id, attempts=F('attempts') + 1, updated_at=timezone.now()
+    )
+    return list(Payout.objects.filter(batch_id=batch_id).select_related('freelancer').order_by('id'))
+
+
+def submit_batch(gateway, payouts):
+    """Send claimed payouts in one bulk transfer and settle what the response tells us."""
+    stats = Counter()
+    response = gateway.bulk_transfer([
+        {'amount': payout.amount, 'recipient': payout.recipient_code, 'reference': payout.reference}
+        for payout in payouts
+    ])
+    if not response.get('status'):
+        reason = str(response.get('message') or 'Bulk transfer failed')[:255]
+        logger.error(f"Bulk transfer of {len(payouts)} payouts failed: {reason}")
+        Payout.objects.filter(id__in=[p.id for p in payouts], status='processing').update(failure_reason=reason)
+        stats['processing'] += len(payouts)
+        return stats
+
+    results = {item.get('reference'): item for item in response.get('data') or []}
+    for payout in payouts:
+        item = results.get(payout.reference) or {}
+        outcome = settle_payout(
+            payout, item.get('status'), transfer_code=item.get('transfer_code') or '', reason=item.get('message') or ''
+        )
+        stats[outcome] += 1
+    return stats
+
+
+def settle_payout(payout, gateway_status, transfer_code='', reason=''):
+    """
+    Apply a gateway transfer status to a processing payout. Returns the
+    payout's status afterwards, or 'unchanged' if another worker settled it
+    first.
+    """
+    status = FINAL_STATUSES.get(gateway_status)
+    if status is None:
+        if transfer_code and transfer_code != payout.transfer_code:
+            Payout.objects.filter(pk=payout.pk).update(transfer_code=transfer_code)
+            if payout.transaction_id:
+                PaymentTransaction.objects.filter(pk=payout.transaction_id).update(transfer_code=transfer_code)
+        return 'processing'
+
+    with transaction.atomic():
+        won = Payout.objects.filter(pk=payout.pk, status='processing').update(
+            status=status,
+            transfer_code=transfer_code or payout.transfer_code,
+            failure_reason=reason[:255] if status == 'failed' else '',
+            updated_at=timezone.now(),
+        )
+        if not won:
+            return 'unchanged'
+        if payout.transaction_id:
+            PaymentTransaction.objects.filter(pk=payout.transaction_id).update(
+                status='success' if status == 'paid' else 'failed',
+                transfer_code=transfer_code or payout.transfer_code,
+            )
+        if status == 'failed':
+            # The wallet was debited when the payout was queued
+            amount = Money.from_naira(payout.amount)
+            gateway_name = PaymentTransaction.objects.filter(pk=payout.transaction_id).values_list(
+                'gateway', flat=True
+            ).first() or 'paystack'
+            post(
+                'withdrawal_reversal',
+                [(user_account(payout.freelancer_id), amount), (gateway_account(gateway_name), -amount)],
+                payout.reference,
+            )
+            Notification.objects.create(
+                recipient=payout.freelancer,
+                type='withdrawal_failed',
+                content=f"Your withdrawal of N{Money.from_naira(payout.amount)} failed and was returned to your wallet.",
+            )
+
+    if status == 'paid':
+        EmailService.send_payout_email(payout.freelancer, payout.amount, payout.reference)
+    return status
+
+
+def drain_payout_queue(gateway, batch_size=None, concurrency=None, max_batches=None):
+    """
+    Claim and submit batches until the queue is empty or `max_batches` have
+    gone out, with up to `concurrency` bulk requests in flight. Returns
+    counts of batches and payout outcomes.
+    """
+    concurrency = concurrency or get_concurrency()
+    stats = Counter()
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if max_batches is not None and stats['batches'] >= max_batches:
+                    return
+                stats['batches'] += 1
+            payouts = claim_batch(batch_size)
+            if not payouts:
+                with lock:
+                    stats['batches'] -= 1
+                return
+            outcome = submit_batch(gateway, payouts)
+            with lock:
+                stats.update(outcome)
+
+    def threaded_worker():
+        try:
+            worker()
+        finally:
+            # Each thread opened its own database connection
+            connection.close()
+
+    if concurrency == 1:
+        worker()
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(threaded_worker) for _ in range(concurrency)]:
+                future.result()
+    return dict(stats)
+
+
+def reconcile_payouts(gateway, older_than=DEFAULT_RECONCILE_AFTER):
+    """
+    Ask the gateway about payouts that have been processing longer than
+    `older_than`, settle the ones it reports final, and requeue the ones
+    it answers 404 for, i.e. never received. Any other failure leaves the
+    payout processing for the next run.
+    """
+    stats = Counter()
+    cutoff = timezone.now() - older_than
+    stale = Payout.objects.filter(status='processing', updated_at__lte=cutoff).select_related('freelancer')
+    for payout in stale.iterator():
+        response = gateway.verify_transfer(payout.reference)
+        if response.get('status'):
+            data = response.get('data') or {}
+            stats[settle_payout(payout, data.get('status'), data.get('transfer_code') or '', data.get('reason') or '')] += 1
+        elif response.get('http_status') == 404:
+            requeued = Payout.objects.filter(pk=payout.pk, status='processing').update(
+                status='pending', batch_id='', updated_at=timezone.now()
+            )
+            stats['requeued'] += requeued
+        else:
+            stats['unknown'] += 1
+    return dict(stats)
+
+
+def settle_withdrawal(tx, gateway_status, raw_response=None, notify=True):
+    """
+    Apply a gateway transfer status to a direct withdrawal, refunding the
+    wallet if it failed. A withdrawal marked successful when the gateway
+    accepted it can still fail later, when the bank reverses the transfer.
+    Returns the transaction's status afterwards, 'pending' if the transfer
+    is still in flight, or 'unchanged' if it was already settled.
+    """
+    status = FINAL_STATUSES.get(gateway_status)
+    if status is None:
+        return 'pending'
+    status = 'success' if status == 'paid' else 'failed'
+    fields = {'status': status}
+    if raw_response is not None:
+        fields['raw_response'] = raw_response
+    settleable = ['pending'] if status == 'success' else ['pending', 'success']
+
+    with transaction.atomic():
+        # Conditional update: only the first failure refunds the debit
+        if not PaymentTransaction.objects.filter(pk=tx.pk, status__in=settleable).update(**fields):
+            return 'unchanged'
+        if status == 'failed':
+            amount = Money.from_naira(tx.amount_paid)
+            post(
+                'withdrawal_reversal',
+                [(user_account(tx.user_id), amount), (gateway_account(tx.gateway), -amount)],
+                tx.reference,
+            )
+            if notify:
+                Notification.objects.create(
+                    recipient_id=tx.user_id,
+                    type='withdrawal_failed',
+                    content=f"Your withdrawal of N{amount} failed and was returned to your wallet.",
+                )
+    return status
+
+
+def reconcile_withdrawals(gateway, older_than=DEFAULT_RECONCILE_AFTER):
+    """
+    Ask the gateway about direct withdrawals still pending after `older_than`
+    and settle the ones it reports final. A 404 means the transfer never
+    arrived, so the withdrawal fails and the wallet is refunded. Any other
+    failure leaves it pending for the next run.
+    """
+    stats = Counter()
+    cutoff = timezone.now() - older_than
+    stale = PaymentTransaction.objects.filter(
+        transaction_type='withdrawal', status='pending', payout__isnull=True, created_at__lte=cutoff
+    )
+    for tx in stale.iterator():
+        response = gateway.verify_transfer(tx.reference)
+        if response.get('status'):
+            stats[settle_withdrawal(tx, (response.get('data') or {}).get('status'), response)] += 1
+        elif response.get('http_status') == 404:
+            stats[settle_withdrawal(tx, 'failed', response)] += 1
+        else:
+            stats['unknown'] += 1
+    return dict(stats)
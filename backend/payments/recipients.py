@@ -0,0 +1,139 @@
+"""
+Registry of gateway transfer recipients.
+
+Paystack needs a recipient code for every transfer. Getting one costs two
+gateway round trips: resolving the account, then creating the recipient.
+Recipient codes do not expire, so the first withdrawal to an account stores
+its code in TransferRecipient. Later withdrawals to the same account go
+straight to the transfer. A user's entries are dropped when they edit their
+bank details (see User.save).
+"""
+import logging
+
+from .models import TransferRecipient
+
+logger = logging.getLogger(__name__)
+
+BULK_RECIPIENT_BATCH = 100  # Paystack's limit per bulk request
+
+
+def _lookup(gateway, user, account_number, bank_code):
+    return {
+        'user': user,
+        'gateway': gateway.NAME,
+        'is_test_mode': bool(gateway.is_test_mode),
+        'account_number': account_number,
+        'bank_code': bank_code,
+    }
+
+
+def _created_recipient(resolve_res, recipient_res):
+    """(defaults for the registry row, None) or (None, error message) from the two gateway responses."""
+    if not recipient_res.get('status'):
+        return None, f"Could not create recipient: {recipient_res.get('message')}"
+    return {
+        'account_name': resolve_res.get('data', {}).get('account_name') or '',
+        'recipient_code': recipient_res.get('data', {}).get('recipient_code'),
+    }, None
+
+
+def get_transfer_recipient(gateway, user, account_number, bank_code):
+    """
+    Return (recipient_code, None) for a withdrawal to this account, or
+    (None, error message). The gateway is only called on a registry miss.
+    """
+    lookup = _lookup(gateway, user, account_number, bank_code)
+    recipient = TransferRecipient.objects.filter(**lookup).only('recipient_code').first()
+    if recipient:
+        return recipient.recipient_code, None
+
+    resolve_res = gateway.resolve_bank_account(account_number, bank_code)
+    if not resolve_res.get('status'):
+        return None, f"Could not verify account: {resolve_res.get('message')}"
+    account_name = resolve_res.get('data', {}).get('account_name')
+    recipient_res = gateway.create_transfer_recipient(account_name, account_number, bank_code)
+
+    defaults, error = _created_recipient(resolve_res, recipient_res)
+    if error:
+        return None, error
+    TransferRecipient.objects.update_or_create(**lookup, defaults=defaults)
+    return defaults['recipient_code'], None
+
+
+async def aget_transfer_recipient(gateway, user, account_number, bank_code):
+    """get_transfer_recipient() for the async gateways."""
+    lookup = _lookup(gateway, user, account_number, bank_code)
+    recipient = await TransferRecipient.objects.filter(**lookup).only('recipient_code').afirst()
+    if recipient:
+        return recipient.recipient_code, None
+
+    resolve_res = await gateway.resolve_bank_account(account_number, bank_code)
+    if not resolve_res.get('status'):
+        return None, f"Could not verify account: {resolve_res.get('message')}"
+    account_name = resolve_res.get('data', {}).get('account_name')
+    recipient_res = await gateway.create_transfer_recipient(account_name, account_number, bank_code)
+
+    defaults, error = _created_recipient(resolve_res, recipient_res)
+    if error:
+        return None, error
+    await TransferRecipient.objects.aupdate_or_create(**lookup, defaults=defaults)
+    return defaults['recipient_code'], None
+
+
+def warm_transfer_recipients(gateway, users, batch_size=BULK_RECIPIENT_BATCH):
+    """
+    Register recipients for the saved bank details of `users` through the
+    gateway's bulk endpoint. User.bank_name is matched against the gateway's
+    bank list to find the bank code. Returns counts of created, skipped and
+    failed entries.
+    """
+    banks = gateway.list_banks()
+    codes = {bank['name'].strip().lower(): bank['code'] for bank in banks.get('data') or []}
+    mode = bool(gateway.is_test_mode)
+    existing = set(TransferRecipient.objects.filter(gateway=gateway.NAME, is_test_mode=mode).values_list(
+        'user_id', 'account_number', 'bank_code'
+    ))
+
+    stats = {'created': 0, 'skipped': 0, 'failed': 0}
+    pending = []
+    for user in users:
+        bank_code = codes.get(user.bank_name.strip().lower())
+        if not user.bank_account or not bank_code:
+            stats['skipped'] += 1
+        elif (user.id, user.bank_account, bank_code) not in existing:
+            pending.append((user, bank_code))
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        response = gateway.create_transfer_recipients([
+            {
+                'name': user.bank_account_name or user.get_full_name() or user.username,
+                'account_number': user.bank_account,
+                'bank_code': bank_code,
+            }
+            for user, bank_code in batch
+        ])
+        if not response.get('status'):
+            logger.error(f"Bulk recipient creation failed: {response.get('message')}")
+            stats['failed'] += len(batch)
+            continue
+
+        # Results are not guaranteed to come back in request order
+        issued = {}
+        for item in response.get('data', {}).get('success') or []:
+            details = item.get('details') or {}
+            issued[(details.get('account_number'), details.get('bank_code'))] = item
+
+        rows = []
+        for user, bank_code in batch:
+            item = issued.get((user.bank_account, bank_code))
+            if item is None:
+                stats['failed'] += 1
+                continue
+            rows.append(TransferRecipient(
+                user=user, gateway=gateway.NAME, is_test_mode=mode, account_number=user.bank_account,
+                bank_code=bank_code, account_name=item.get('name') or '', recipient_code=item['recipient_code'],
+            ))
+        TransferRecipient.objects.bulk_create(rows, ignore_conflicts=True)
+        stats['created'] += len(rows)
+    return stats
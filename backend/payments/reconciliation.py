@@ -0,0 +1,177 @@
+"""
+Reconciliation of pending gateway payments.
+
+A deposit or deal funding stays 'pending' until its webhook or the user's
+verify call confirms it. When neither arrives, reconcile_pending_payments()
+asks the gateway directly:
+
+- Pending transactions older than `min_age` are paged through by id in
+  chunks, and each chunk is verified concurrently through the async gateway
+  with at most `concurrency` calls in flight. Database work stays on the
+  calling thread.
+- Confirmed payments go through PaymentProcessor, the same as a webhook.
+  Payments the gateway reports failed are marked failed. Abandoned checkouts
+  are only marked failed once they are older than `abandon_after`.
+- The id of the last finished chunk is stored in the cache as a checkpoint,
+  so a run that is stopped resumes where it left off. Once a run reaches the
+  end, the checkpoint is cleared and the next run starts from the beginning.
+- Several workers can run at once. Each one skips ahead to the shared
+  checkpoint before fetching a chunk and claims a transaction in the cache
+  before verifying it. Processing is idempotent, so an overlap costs at
+  most a repeated gateway call.
+"""
+import asyncio
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from core.money import Money
+from .models import PaymentTransaction
+from .services import ASYNC_GATEWAYS, PaymentProcessor
+from .transport import aclose_clients
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_KEY = 'payments:reconcile:{gateway}:checkpoint'
+CHECKPOINT_TIMEOUT = 7 * 24 * 60 * 60
+CLAIM_KEY = 'payments:reconcile:claim:{id}'
+CLAIM_TIMEOUT = 10 * 60
+DEFAULT_CHUNK_SIZE = 200
+DEFAULT_CONCURRENCY = 10
+# Leave time for the webhook before asking the gateway
+DEFAULT_MIN_AGE = timedelta(minutes=15)
+DEFAULT_ABANDON_AFTER = timedelta(days=1)
+# Amount differences up to this are rounding, not a wrong payment
+AMOUNT_TOLERANCE = Money.from_naira(1)
+
+
+def get_chunk_size():
+    return getattr(settings, 'RECONCILE_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def get_concurrency():
+    return getattr(settings, 'RECONCILE_CONCURRENCY', DEFAULT_CONCURRENCY)
+
+
+def charge_outcome(gateway_name, reference, verification_data):
+    """
+    ('success', amount), ('failed', None), ('abandoned', None) or
+    ('pending', None) from a verify_payment() response.
+    """
+    if gateway_name == 'flutterwave':
+        # GET /transactions?tx_ref= lists the charges made against the reference
+        if verification_data.get('status') != 'success':
+            return 'pending', None
+        charges = [c for c in verification_data.get('data') or [] if c.get('tx_ref') == reference]
+        successful = [c for c in charges if c.get('status') == 'successful']
+        if successful:
+            return 'success', Money.from_naira(successful[0].get('amount', 0))
+        if charges and all(c.get('status') == 'failed' for c in charges):
+            return 'failed', None
+        return 'pending', None
+
+    if not verification_data.get('status'):
+        return 'pending', None
+    data = verification_data.get('data') or {}
+    status = data.get('status')
+    if status == 'success':
+        return 'success', Money.from_kobo(data.get('amount', 0))
+    if status in ('failed', 'reversed'):
+        return 'failed', None
+    if status == 'abandoned':
+        return 'abandoned', None
+    return 'pending', None
+
+
+def _pending(gateway_name, cutoff):
+    return PaymentTransaction.objects.filter(
+        gateway=gateway_name, status='pending', purpose__in=['deposit', 'deal_funding'], created_at__lte=cutoff,
+    )
+
+
+def _next_chunk(gateway_name, cutoff, after, chunk_size):
+    return list(
+        _pending(gateway_name, cutoff).filter(id__gt=after).order_by('id')
+        .only('id', 'reference', 'amount_paid', 'created_at')[:chunk_size]
+    )
+
+
+def _apply(gateway_name, tx, verification_data, abandon_cutoff):
+    """Act on the gateway's answer for one transaction; returns the outcome for the stats."""
+    outcome, amount = charge_outcome(gateway_name, tx.reference, verification_data)
+    if outcome == 'success':
+        if abs(amount - Money.from_naira(tx.amount_paid)) > AMOUNT_TOLERANCE:
+            logger.error(f"Reconciliation amount mismatch for {tx.reference}: expected {tx.amount_paid}, got {amount}")
+            return 'mismatch'
+        ok = PaymentProcessor.process_successful_payment(tx.reference, amount, gateway_name, verification_data)
+        return 'confirmed' if ok else 'errors'
+    if outcome == 'failed' or (outcome == 'abandoned' and tx.created_at <= abandon_cutoff):
+        PaymentTransaction.objects.filter(pk=tx.pk, status='pending').update(
+            status='failed', raw_response=verification_data
+        )
+        return 'failed'
+    return 'pending'
+
+
+async def _reconcile(gateway, chunk_size, concurrency, min_age, abandon_after, max_chunks, restart):
+    checkpoint_key = CHECKPOINT_KEY.format(gateway=gateway.NAME)
+    if restart:
+        await cache.adelete(checkpoint_key)
+    now = timezone.now()
+    cutoff, abandon_cutoff = now - min_age, now - abandon_after
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = Counter()
+
+    async def check(tx):
+        claim_key = CLAIM_KEY.format(id=tx.id)
+        if not await cache.aadd(claim_key, 1, CLAIM_TIMEOUT):
+            return 'skipped'
+        try:
+            async with semaphore:
+                verification_data = await gateway.verify_payment(tx.reference)
+            return await sync_to_async(_apply)(gateway.NAME, tx, verification_data, abandon_cutoff)
+        except Exception as e:
+            logger.error(f"Reconciliation of {tx.reference} failed: {e}")
+            return 'errors'
+        finally:
+            await cache.adelete(claim_key)
+
+    after = 0
+    try:
+        while max_chunks is None or stats['chunks'] < max_chunks:
+            after = max(after, await cache.aget(checkpoint_key) or 0)
+            chunk = await sync_to_async(_next_chunk)(gateway.NAME, cutoff, after, chunk_size)
+            if not chunk:
+                await cache.adelete(checkpoint_key)
+                break
+            stats.update(await asyncio.gather(*(check(tx) for tx in chunk)))
+            stats['checked'] += len(chunk)
+            stats['chunks'] += 1
+            after = chunk[-1].id
+            # Workers finish chunks out of order; never move the checkpoint back
+            if after > (await cache.aget(checkpoint_key) or 0):
+                await cache.aset(checkpoint_key, after, CHECKPOINT_TIMEOUT)
+    finally:
+        await aclose_clients(asyncio.get_running_loop())
+    return dict(stats)
+
+
+def reconcile_pending_payments(gateway, chunk_size=None, concurrency=None, min_age=DEFAULT_MIN_AGE,
+                               abandon_after=DEFAULT_ABANDON_AFTER, max_chunks=None, restart=False):
+    """
+    Verify pending payments against `gateway` and settle what it reports.
+    Resumes from the checkpoint unless `restart`. Returns counts of chunks,
+    checked transactions and outcomes.
+    """
+    async_gateway = ASYNC_GATEWAYS[type(gateway)](
+        public_key=gateway.public_key, secret_key=gateway.secret_key, is_test_mode=gateway.is_test_mode
+    )
+    return async_to_sync(_reconcile)(
+        async_gateway, chunk_size or get_chunk_size(), concurrency or get_concurrency(),
+        min_age, abandon_after, max_chunks, restart,
+    )
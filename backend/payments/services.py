@@ -1,17 +1,35 @@
+import asyncio
+import time
+
+import httpx
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.db import transaction
 from django.contrib.auth import get_user_model
-from core.models import PlatformSettings, Notification
+from core.models import Notification
+from core.cache import get_platform_secrets, get_platform_settings
 from core.emails import EmailService
+from core.money import Money
 from deals.models import Deal
+from deals.transitions import try_transition
 from .models import PaymentTransaction
+from .cache import CACHE_POLICIES, acached_call, cached_call, gateway_cache_key
+from .health import gateway_health
+from .ledger import escrow_account, gateway_account, post, user_account
+from .metrics import gateway_metrics
+from .transport import (
+    RETRY_STATUSES, backoff_delay, get_async_client, get_async_timeout, get_retry_policy, get_session, get_timeout,
+)
 import logging
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
 class BaseGateway:
+    NAME = None
+    BASE_URL = None
+
     def __init__(self, public_key, secret_key, is_test_mode=True):
         self.public_key = public_key
         self.secret_key = secret_key
@@ -23,18 +41,106 @@ class BaseGateway:
     def verify_payment(self, reference):
         raise NotImplementedError
 
+    def error_response(self, message):
+        """A failure in the shape this gateway's own error responses use."""
+        raise NotImplementedError
+
+    @property
+    def session(self):
+        return get_session(self.NAME)
+
+    def _cache_policy(self, method, operation):
+        return CACHE_POLICIES.get(operation) if method == 'GET' else None
+
+    def _request(self, method, path, operation, **kwargs):
+        """
+        Call the gateway and return the decoded JSON body, or error_response()
+        if the call failed. Operations in payments.cache.CACHE_POLICIES are
+        answered from the shared cache when possible.
+        """
+        policy = self._cache_policy(method, operation)
+        if policy is None:
+            return self._send(method, path, operation, **kwargs)
+        key = gateway_cache_key(self, operation, path, kwargs.get('params'))
+        return cached_call(key, policy, lambda: self._send(method, path, operation, **kwargs))
+
+    def _send(self, method, path, operation, **kwargs):
+        """
+        Make the HTTP call through the pooled session. GETs are retried on
+        connection errors and 429/5xx within the retry budget. Fails fast
+        while the gateway's circuit breaker is open.
+        """
+        if not gateway_health.allow_request(self.NAME):
+            return self.unavailable_response()
+        url = f"{self.BASE_URL}{path}"
+        headers = {"Authorization": f"Bearer {self.secret_key}"}
+        timeout = get_timeout()
+        retries, budget = get_retry_policy() if method == 'GET' else (0, 0)
+        started = time.monotonic()
+
+        for attempt in range(retries + 1):
+            call_started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, headers=headers, timeout=timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._record(operation, time.perf_counter() - call_started, type(e).__name__, attempt)
+                logger.warning(f"{self.NAME} {operation} attempt {attempt + 1} failed: {e}")
+                delay = self._retry_delay(attempt, retries, started, budget)
+                if delay is not None:
+                    time.sleep(delay)
+                    continue
+                return self.error_response(str(e))
+
+            self._record(operation, time.perf_counter() - call_started, response.status_code, attempt)
+            delay = self._retry_delay(attempt, retries, started, budget) if response.status_code in RETRY_STATUSES else None
+            if delay is not None:
+                logger.warning(f"{self.NAME} {operation} attempt {attempt + 1} got HTTP {response.status_code}, retrying")
+                time.sleep(delay)
+                continue
+            return self._decode(response)
+
+    def _record(self, operation, duration, outcome, attempt):
+        gateway_metrics.record(self.NAME, operation, duration, outcome, retry=attempt > 0)
+        gateway_health.record(self.NAME, duration, outcome)
+
+    def unavailable_response(self):
+        """The failure returned without calling the gateway; `sent` marks that nothing went out."""
+        return {**self.error_response(f"{self.NAME} is temporarily unavailable, please try again shortly"), 'sent': False}
+
+    def _decode(self, response):
+        """
+        The JSON body. An error body also gets the HTTP status as
+        `http_status`, so callers can tell "no such resource" (404) from
+        other failures without parsing the message.
+        """
+        try:
+            body = response.json()
+        except ValueError:
+            body = self.error_response(f"Invalid response from {self.NAME} (HTTP {response.status_code})")
+        if response.status_code >= 400 and isinstance(body, dict):
+            body.setdefault('http_status', response.status_code)
+        return body
+
+    @staticmethod
+    def _retry_delay(attempt, retries, started, budget):
+        """Backoff before the next attempt, or None if the retry budget is spent."""
+        if attempt >= retries:
+            return None
+        delay = backoff_delay(attempt)
+        if time.monotonic() - started + delay > budget:
+            return None
+        return delay
+
 class PaystackGateway(BaseGateway):
-    BASE_URL = "https://api.paystack.co"
+    NAME = 'paystack'
+    BASE_URL = getattr(settings, 'PAYSTACK_BASE_URL', "https://api.paystack.co")
+
+    def error_response(self, message):
+        return {"status": False, "message": message}
 
     def initialize_payment(self, amount, email, reference, callback_url, metadata=None):
-        url = f"{self.BASE_URL}/transaction/initialize"
         # Paystack expects amount in kobo (x100)
-        amount_kobo = int(float(amount) * 100)
-        
-        headers = {
-            "Authorization": f"Bearer {self.secret_key}",
-            "Content-Type": "application/json",
-        }
+        amount_kobo = Money.from_naira(amount).kobo
         data = {
             "email": email,
             "amount": amount_kobo,
@@ -42,51 +148,20 @@ class PaystackGateway(BaseGateway):
             "callback_url": callback_url,
             "metadata": metadata or {}
         }
-        
-        try:
-            response = requests.post(url, json=data, headers=headers)
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {"status": False, "message": str(e)}
+        return self._request('POST', "/transaction/initialize", 'initialize_payment', json=data)
 
     def verify_payment(self, reference):
-        url = f"{self.BASE_URL}/transaction/verify/{reference}"
-        headers = {
-            "Authorization": f"Bearer {self.secret_key}",
-        }
-        
-        try:
-            response = requests.get(url, headers=headers)
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {"status": False, "message": str(e)}
+        return self._request('GET', f"/transaction/verify/{reference}", 'verify_payment')
 
     # Withdrawal & Bank Methods
     def list_banks(self):
-        url = f"{self.BASE_URL}/bank"
-        headers = {"Authorization": f"Bearer {self.secret_key}"}
-        try:
-            response = requests.get(url, headers=headers)
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {"status": False, "message": str(e)}
+        return self._request('GET', "/bank", 'list_banks')
 
     def resolve_bank_account(self, account_number, bank_code):
-        url = f"{self.BASE_URL}/bank/resolve"
-        headers = {"Authorization": f"Bearer {self.secret_key}"}
         params = {"account_number": account_number, "bank_code": bank_code}
-        try:
-            response = requests.get(url, headers=headers, params=params)
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {"status": False, "message": str(e)}
+        return self._request('GET', "/bank/resolve", 'resolve_bank_account', params=params)
 
     def create_transfer_recipient(self, name, account_number, bank_code):
-        url = f"{self.BASE_URL}/transferrecipient"
-        headers = {
-            "Authorization": f"Bearer {self.secret_key}",
-            "Content-Type": "application/json",
-        }
         data = {
             "type": "nuban",
             "name": name,
@@ -94,19 +169,18 @@ class PaystackGateway(BaseGateway):
             "bank_code": bank_code,
             "currency": "NGN"
         }
-        try:
-            response = requests.post(url, json=data, headers=headers)
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {"status": False, "message": str(e)}
+        return self._request('POST', "/transferrecipient", 'create_transfer_recipient', json=data)
+
+    def create_transfer_recipients(self, recipients):
+        """
+        Bulk-create up to 100 recipients in one call. `recipients` are dicts
+        with name, account_number and bank_code.
+        """
+        batch = [{"type": "nuban", "currency": "NGN", **recipient} for recipient in recipients]
+        return self._request('POST', "/transferrecipient/bulk", 'create_transfer_recipients', json={"batch": batch})
 
     def transfer(self, amount, recipient_code, reference):
-        url = f"{self.BASE_URL}/transfer"
-        headers = {
-            "Authorization": f"Bearer {self.secret_key}",
-            "Content-Type": "application/json",
-        }
-        amount_kobo = int(float(amount) * 100)
+        amount_kobo = Money.from_naira(amount).kobo
         data = {
             "source": "balance",
             "amount": amount_kobo,
@@ -114,40 +188,50 @@ class PaystackGateway(BaseGateway):
             "reference": reference,
             "reason": "DealNest Withdrawal"
         }
-        try:
-            response = requests.post(url, json=data, headers=headers)
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {"status": False, "message": str(e)}
+        return self._request('POST', "/transfer", 'transfer', json=data)
 
-    def finalize_transfer(self, transfer_code, otp):
-        url = f"{self.BASE_URL}/transfer/finalize_transfer"
-        headers = {
-            "Authorization": f"Bearer {self.secret_key}",
-            "Content-Type": "application/json",
+    def bulk_transfer(self, transfers):
+        """
+        Queue several transfers from the balance in one call. Each item has
+        amount (naira), recipient and reference. Needs transfer OTP disabled
+        on the Paystack account.
+        """
+        data = {
+            "source": "balance",
+            "currency": "NGN",
+            "transfers": [
+                {
+                    "amount": Money.from_naira(item['amount']).kobo,
+                    "recipient": item['recipient'],
+                    "reference": item['reference'],
+                    "reason": "DealNest Withdrawal",
+                }
+                for item in transfers
+            ],
         }
+        return self._request('POST', "/transfer/bulk", 'bulk_transfer', json=data)
+
+    def verify_transfer(self, reference):
+        return self._request('GET', f"/transfer/verify/{reference}", 'verify_transfer')
+
+    def finalize_transfer(self, transfer_code, otp):
         data = {
             "transfer_code": transfer_code,
             "otp": otp
         }
-        try:
-            response = requests.post(url, json=data, headers=headers)
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {"status": False, "message": str(e)}
+        return self._request('POST', "/transfer/finalize_transfer", 'finalize_transfer', json=data)
 
 class FlutterwaveGateway(BaseGateway):
-    BASE_URL = "https://api.flutterwave.com/v3"
+    NAME = 'flutterwave'
+    BASE_URL = getattr(settings, 'FLUTTERWAVE_BASE_URL', "https://api.flutterwave.com/v3")
+
+    def error_response(self, message):
+        return {"status": "error", "message": message}
 
     def initialize_payment(self, amount, email, reference, callback_url, metadata=None):
-        url = f"{self.BASE_URL}/payments"
-        headers = {
-            "Authorization": f"Bearer {self.secret_key}",
-            "Content-Type": "application/json",
-        }
         data = {
             "tx_ref": reference,
-            "amount": str(amount),
+            "amount": str(Money.from_naira(amount)),
             "currency": "NGN",
             "redirect_url": callback_url,
             "payment_options": "card,mobilemoney,ussd",
@@ -161,12 +245,7 @@ class FlutterwaveGateway(BaseGateway):
             },
             "meta": metadata or {}
         }
-        
-        try:
-            response = requests.post(url, json=data, headers=headers)
-            return response.json()
-        except requests.exceptions.RequestException as e:
-             return {"status": "error", "message": str(e)}
+        return self._request('POST', "/payments", 'initialize_payment', json=data)
 
     def verify_payment(self, reference):
         # Flutterwave verify by transaction ID usually, but we can use tx_ref endpoint if available or list
@@ -176,68 +255,214 @@ class FlutterwaveGateway(BaseGateway):
         # Let's assume we get ID from callback or webhook.
         # IF reference is passed, we might need to look it up.
         # For simplicity, implementing query by tx_ref
-        
-        url = f"{self.BASE_URL}/transactions"
-        headers = {
-            "Authorization": f"Bearer {self.secret_key}",
-        }
         params = {"tx_ref": reference}
-        
-        try:
-            response = requests.get(url, headers=headers, params=params)
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {"status": "error", "message": str(e)}
+        return self._request('GET', "/transactions", 'verify_payment', params=params)
+
+class AsyncGatewayMixin:
+    """
+    Async transport for a gateway class. Mixed in ahead of the gateway, it
+    turns _request and _send into coroutines, so every gateway method returns
+    an awaitable while the request payloads stay defined once:
+
+        gateway = await aget_gateway()
+        data = await gateway.verify_payment(reference)
+
+    Retry, timeout, caching, metrics and circuit breaking match the sync
+    gateways.
+    """
+    async def _request(self, method, path, operation, **kwargs):
+        policy = self._cache_policy(method, operation)
+        if policy is None:
+            return await self._send(method, path, operation, **kwargs)
+        key = gateway_cache_key(self, operation, path, kwargs.get('params'))
+        return await acached_call(key, policy, lambda: self._send(method, path, operation, **kwargs))
+
+    async def _record(self, operation, duration, outcome, attempt):
+        gateway_metrics.record(self.NAME, operation, duration, outcome, retry=attempt > 0)
+        await sync_to_async(gateway_health.record, thread_sensitive=False)(self.NAME, duration, outcome)
+
+    async def _send(self, method, path, operation, **kwargs):
+        if not await sync_to_async(gateway_health.allow_request, thread_sensitive=False)(self.NAME):
+            return self.unavailable_response()
+        client = get_async_client(self.NAME, asyncio.get_running_loop())
+        url = f"{self.BASE_URL}{path}"
+        headers = {"Authorization": f"Bearer {self.secret_key}"}
+        timeout = get_async_timeout()
+        retries, budget = get_retry_policy() if method == 'GET' else (0, 0)
+        started = time.monotonic()
+
+        for attempt in range(retries + 1):
+            call_started = time.perf_counter()
+            try:
+                response = await client.request(method, url, headers=headers, timeout=timeout, **kwargs)
+            except httpx.HTTPError as e:
+                await self._record(operation, time.perf_counter() - call_started, type(e).__name__, attempt)
+                logger.warning(f"{self.NAME} {operation} attempt {attempt + 1} failed: {e!r}")
+                delay = self._retry_delay(attempt, retries, started, budget)
+                if delay is not None:
+                    await asyncio.sleep(delay)
+                    continue
+                return self.error_response(str(e) or type(e).__name__)
 
-def get_gateway():
-    # Helper to get the active gateway instance based on PlatformSettings
+            await self._record(operation, time.perf_counter() - call_started, response.status_code, attempt)
+            delay = self._retry_delay(attempt, retries, started, budget) if response.status_code in RETRY_STATUSES else None
+            if delay is not None:
+                logger.warning(f"{self.NAME} {operation} attempt {attempt + 1} got HTTP {response.status_code}, retrying")
+                await asyncio.sleep(delay)
+                continue
+            return self._decode(response)
+
+class AsyncPaystackGateway(AsyncGatewayMixin, PaystackGateway):
+    pass
+
+class AsyncFlutterwaveGateway(AsyncGatewayMixin, FlutterwaveGateway):
+    pass
+
+ASYNC_GATEWAYS = {
+    PaystackGateway: AsyncPaystackGateway,
+    FlutterwaveGateway: AsyncFlutterwaveGateway,
+}
+
+GATEWAY_CLASSES = {
+    'paystack': PaystackGateway,
+    'flutterwave': FlutterwaveGateway,
+}
+
+def is_rejection(response):
+    """
+    True if the gateway definitely refused the call: it answered with a 4xx
+    error, or the call never went out. A timeout or 5xx leaves the outcome
+    unknown, so it is not a rejection.
+    """
+    if not isinstance(response, dict) or response.get('status') in (True, 'success'):
+        return False
+    return response.get('sent') is False or 400 <= (response.get('http_status') or 0) < 500
+
+
+def _gateway_keys(name, settings_obj):
+    """(public, secret) for `name`: DB keys if they are set, otherwise env."""
+    env_public = getattr(settings, f'{name.upper()}_PUBLIC_KEY', '') or ''
+    env_secret = getattr(settings, f'{name.upper()}_SECRET_KEY', '') or ''
+    if not settings_obj:
+        return env_public, env_secret
+    return (
+        getattr(settings_obj, f'{name}_public_key') or env_public,
+        get_platform_secrets()[f'{name}_secret_key'] or env_secret,
+    )
+
+def get_gateway(name=None, failover=False):
+    """
+    The gateway named by PlatformSettings.active_gateway, or `name` (as
+    stored on a transaction) if given. With `failover`, used for payment
+    initialization when PAYMENT_GATEWAY_FAILOVER is on, the other gateway is
+    returned while the active one's circuit breaker is open, provided it has
+    keys and is itself healthy.
+    """
     try:
-        settings_obj = PlatformSettings.objects.first()
+        settings_obj = get_platform_settings()
     except:
         settings_obj = None
 
-    # Get keys from env as fallback
-    env_paystack_public = getattr(settings, 'PAYSTACK_PUBLIC_KEY', '') or ''
-    env_paystack_secret = getattr(settings, 'PAYSTACK_SECRET_KEY', '') or ''
-    env_flutter_public = getattr(settings, 'FLUTTERWAVE_PUBLIC_KEY', '') or ''
-    env_flutter_secret = getattr(settings, 'FLUTTERWAVE_SECRET_KEY', '') or ''
+    # Fallback to env (Paystack) if DB not ready
+    name = name or (settings_obj.active_gateway if settings_obj else 'paystack')
+    is_test_mode = settings_obj.use_test_mode if settings_obj else True
+    if failover and getattr(settings, 'PAYMENT_GATEWAY_FAILOVER', False) and not gateway_health.is_available(name):
+        for other in GATEWAY_CLASSES:
+            if other != name and _gateway_keys(other, settings_obj)[1] and gateway_health.is_available(other):
+                logger.warning(f"{name} circuit is open, initializing payment with {other}")
+                name = other
+                break
+
+    public_key, secret_key = _gateway_keys(name, settings_obj)
+    return GATEWAY_CLASSES[name](public_key=public_key, secret_key=secret_key, is_test_mode=is_test_mode)
+
+async def aget_gateway(name=None, failover=False):
+    """Async counterpart of get_gateway(); settings are read in a worker thread."""
+    gateway = await sync_to_async(get_gateway)(name, failover)
+    return ASYNC_GATEWAYS[type(gateway)](
+        public_key=gateway.public_key,
+        secret_key=gateway.secret_key,
+        is_test_mode=gateway.is_test_mode
+    )
+
+# Incoming payment purpose -> PaymentTransaction.transaction_type
+PURPOSE_TRANSACTION_TYPES = {
+    'deposit': 'deposit',
+    'deal_funding': 'deal_payment',
+}
+# Reference prefixes used before purposes were stored on the transaction
+LEGACY_REFERENCE_PREFIXES = {
+    'DEP': 'deposit',
+    'fund': 'deal_funding',
+}
+
+
+def legacy_reference_target(reference):
+    """(purpose, target id) parsed from a "DEP-{user_id}-..." or "fund-{deal_id}-..." reference."""
+    parts = reference.split('-')
+    purpose = LEGACY_REFERENCE_PREFIXES.get(parts[0])
+    if purpose is None or len(parts) < 2 or not parts[1].isdigit():
+        return None, None
+    return purpose, int(parts[1])
 
-    if not settings_obj:
-        # Fallback to env if DB not ready
-        return PaystackGateway(
-            public_key=env_paystack_public,
-            secret_key=env_paystack_secret
-        )
-    
-    if settings_obj.active_gateway == 'paystack':
-        # Use DB keys if they exist and are not empty, otherwise use env
-        public_key = settings_obj.paystack_public_key if settings_obj.paystack_public_key else env_paystack_public
-        secret_key = settings_obj.paystack_secret_key if settings_obj.paystack_secret_key else env_paystack_secret
-        return PaystackGateway(
-            public_key=public_key,
-            secret_key=secret_key,
-            is_test_mode=settings_obj.use_test_mode
-        )
-    else:
-        public_key = settings_obj.flutterwave_public_key if settings_obj.flutterwave_public_key else env_flutter_public
-        secret_key = settings_obj.flutterwave_secret_key if settings_obj.flutterwave_secret_key else env_flutter_secret
-        return FlutterwaveGateway(
-            public_key=public_key,
-            secret_key=secret_key,
-            is_test_mode=settings_obj.use_test_mode
-        )
 
 class PaymentProcessor:
     @staticmethod
-    def process_successful_payment(reference, amount, gateway_name, raw_data):
+    def record_initialized_payment(reference, purpose, amount, gateway_name, user, deal=None):
+        """
+        Store the pending transaction for a payment the gateway has just
+        initialized, so verification and webhooks can route it by reference.
+        """
+        return PaymentTransaction.objects.create(
+            user=user,
+            deal=deal,
+            gateway=gateway_name,
+            reference=reference,
+            amount_paid=Money.from_naira(amount).to_decimal(),
+            transaction_type=PURPOSE_TRANSACTION_TYPES[purpose],
+            purpose=purpose,
+            target_id=deal.id if deal else user.id,
+            status='pending',
+        )
+
+    @staticmethod
+    def resolve_payment(reference):
+        """
+        (purpose, target) for a payment reference, where target is the
+        depositing User or the Deal being funded. (None, None) if the
+        reference is unknown.
+        """
+        tx = PaymentTransaction.objects.select_related(
+            'user', 'deal__client', 'deal__freelancer'
+        ).filter(reference=reference).first()
+        if tx is not None and tx.purpose:
+            target = tx.deal if tx.purpose == 'deal_funding' else tx.user
+            return (tx.purpose, target) if target else (None, None)
+
+        # Initialized before purposes were recorded
+        purpose, target_id = legacy_reference_target(reference)
+        if purpose is None:
+            return None, None
+        model = Deal if purpose == 'deal_funding' else User
+        target = model.objects.filter(pk=target_id).first()
+        if target is None:
+            logger.error(f"{model.__name__} {target_id} not found for payment {reference}")
+            return None, None
+        return purpose, target
+
+    @staticmethod
+    def process_successful_payment(reference, amount, gateway_name, raw_data, resolved=None):
         """
-        Centralized logic to handle successful payments (Deposit or Deal Funding)
+        Centralized logic to handle successful payments (Deposit or Deal Funding).
+        Pass `resolved` if the caller already has resolve_payment()'s result.
         """
+        amount = Money.from_naira(amount)
         try:
-            if reference.startswith('DEP-'):
-                return PaymentProcessor._process_deposit(reference, amount, gateway_name, raw_data)
-            elif reference.startswith('fund-'):
-                return PaymentProcessor._process_deal_funding(reference, amount, gateway_name, raw_data)
+            purpose, target = resolved or PaymentProcessor.resolve_payment(reference)
+            if purpose == 'deposit':
+                return PaymentProcessor._process_deposit(reference, target, amount, gateway_name, raw_data)
+            elif purpose == 'deal_funding':
+                return PaymentProcessor._process_deal_funding(reference, target, amount, gateway_name, raw_data)
             else:
                 logger.warning(f"Unknown reference type: {reference}")
                 return False
@@ -246,16 +471,7 @@ class PaymentProcessor:
             return False
 
     @staticmethod
-    def _process_deposit(reference, amount, gateway_name, raw_data):
-        parts = reference.split('-')
-        # Format: DEP-{user_id}-{uuid}
-        if len(parts) < 2:
-            logger.error(f"Invalid deposit reference format: {reference}")
-            return False
-            
-        user_id = parts[1]
-        user = User.objects.get(id=user_id)
-        
+    def _process_deposit(reference, user, amount, gateway_name, raw_data):
         with transaction.atomic():
             tx = PaymentTransaction.objects.filter(reference=reference).select_for_update().first()
             
@@ -266,8 +482,7 @@ class PaymentProcessor:
                     tx.raw_response = raw_data
                     tx.save()
                     
-                    user.balance += amount
-                    user.save()
+                    post('deposit', [(gateway_account(gateway_name), -amount), (user_account(user), amount)], reference)
                     
                     Notification.objects.create(
                         recipient=user,
@@ -280,14 +495,15 @@ class PaymentProcessor:
                     user=user,
                     gateway=gateway_name,
                     reference=reference,
-                    amount_paid=amount,
+                    amount_paid=amount.to_decimal(),
                     transaction_type='deposit',
+                    purpose='deposit',
+                    target_id=user.id,
                     status='success',
                     raw_response=raw_data
                 )
                 
-                user.balance += amount
-                user.save()
+                post('deposit', [(gateway_account(gateway_name), -amount), (user_account(user), amount)], reference)
                 
                 Notification.objects.create(
                     recipient=user,
@@ -297,43 +513,34 @@ class PaymentProcessor:
         return True
 
     @staticmethod
-    def _process_deal_funding(reference, amount, gateway_name, raw_data):
-        parts = reference.split('-')
-        # Format: fund-{deal_id}-{uuid}
-        if len(parts) < 2:
-            logger.error(f"Invalid fund reference format: {reference}")
-            return False
-
-        deal_id = parts[1]
-        try:
-            deal = Deal.objects.get(id=deal_id)
-        except Deal.DoesNotExist:
-            logger.error(f"Deal {deal_id} not found for payment {reference}")
-            return False
-            
+    def _process_deal_funding(reference, deal, amount, gateway_name, raw_data):
         with transaction.atomic():
-            tx, created = PaymentTransaction.objects.get_or_create(
+            tx, created = PaymentTransaction.objects.select_for_update().get_or_create(
                 reference=reference,
                 defaults={
                     'user': deal.client,
                     'deal': deal,
                     'gateway': gateway_name,
-                    'amount_paid': amount,
+                    'amount_paid': amount.to_decimal(),
                     'transaction_type': 'deal_payment',
+                    'purpose': 'deal_funding',
+                    'target_id': deal.id,
                     'status': 'success',
                     'raw_response': raw_data
                 }
             )
             
+            newly_paid = created or tx.status != 'success'
             if not created and tx.status != 'success':
                 tx.status = 'success'
                 tx.raw_response = raw_data
                 tx.save()
+            if newly_paid:
+                # Held in escrow even if the deal turns out to be funded already
+                post('deal_funding', [(gateway_account(gateway_name), -amount), (escrow_account(deal), amount)], reference)
             
-            if deal.status == 'created':
-                deal.status = 'funded'
-                deal.save()
-                
+            # Verify and the webhook can confirm the same payment concurrently; only one funds the deal
+            if try_transition(deal, 'fund'):
                 if deal.freelancer:
                     Notification.objects.create(
                         recipient=deal.freelancer,
@@ -0,0 +1,357 @@
+"""
+Local Paystack/Flutterwave simulator for load and soak testing.
+
+GatewaySimulator keeps its state in memory and serves, on a local port, the
+gateway endpoints the payment code calls. To use it, either run
+`manage.py run_gateway_simulator` and point PAYSTACK_BASE_URL and
+FLUTTERWAVE_BASE_URL at it, or start it in-process:
+
+    with GatewaySimulator(latency=0.15, error_rate=0.01) as simulator:
+        PaystackGateway.BASE_URL = simulator.url
+        ...
+
+Behaviour:
+
+- initialize returns an authorization link on the simulator. Opening it
+  (GET /pay/{reference}) completes the charge, the way a customer paying
+  would. With auto_pay, charges complete as soon as they are initialized.
+- A completed charge or transfer sends a signed webhook after
+  `webhook_delay`: charge.success, transfer.success and charge.completed,
+  signed with x-paystack-signature or verif-hash. Without a webhook URL the
+  events are kept in `webhooks` for the caller to deliver.
+- Every request waits `latency` plus or minus `jitter` seconds. A fraction
+  `error_rate` of them fail with HTTP 503 before any state changes.
+- With otp=True, single transfers wait for finalize_transfer, like an
+  account with transfer OTP enabled.
+"""
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .transport import get_session, get_timeout
+
+logger = logging.getLogger(__name__)
+
+BANKS = [
+    {'id': 1, 'name': 'Access Bank', 'code': '044'},
+    {'id': 2, 'name': 'First Bank of Nigeria', 'code': '011'},
+    {'id': 3, 'name': 'Guaranty Trust Bank', 'code': '058'},
+    {'id': 4, 'name': 'United Bank For Africa', 'code': '033'},
+    {'id': 5, 'name': 'Zenith Bank', 'code': '057'},
+]
+BANK_CODES = {bank['code'] for bank in BANKS}
+FLUTTERWAVE_ROUTES = {'/payments', '/transactions'}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+
+def _paystack_ok(data, message='Successful'):
+    return 200, {'status': True, 'message': message, 'data': data}
+
+
+def _paystack_error(status, message):
+    return status, {'status': False, 'message': message}
+
+
+def _flutterwave_ok(data, message='Successful'):
+    return 200, {'status': 'success', 'message': message, 'data': data}
+
+
+class GatewaySimulator:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0, otp=False,
+                 auto_pay=False, paystack_webhook_url=None, flutterwave_webhook_url=None,
+                 paystack_secret='sk_test_simulator', flutterwave_hash='simulator-hash', webhook_delay=0.0,
+                 seed=None):
+        self.host, self.port = host, port
+        self.latency, self.jitter, self.error_rate = latency, jitter, error_rate
+        self.otp, self.auto_pay = otp, auto_pay
+        self.webhook_urls = {'paystack': paystack_webhook_url, 'flutterwave': flutterwave_webhook_url}
+        self.paystack_secret, self.flutterwave_hash = paystack_secret, flutterwave_hash
+        self.webhook_delay = webhook_delay
+
+        self.charges = {}
+        self.transfers = {}
+        self.recipients = {}
+        self.webhooks = []
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1000001)
+        self._random = random.Random(seed)
+        self._server = None
+
+        self.routes = {
+            ('POST', '/transaction/initialize'): self.paystack_initialize,
+            ('GET', '/transaction/verify'): self.paystack_verify,
+            ('GET', '/bank'): self.list_banks,
+            ('GET', '/bank/resolve'): self.resolve_account,
+            ('POST', '/transferrecipient'): self.create_recipient,
+            ('POST', '/transferrecipient/bulk'): self.create_recipients,
+            ('POST', '/transfer'): self.transfer,
+            ('POST', '/transfer/bulk'): self.bulk_transfer,
+            ('GET', '/transfer/verify'): self.verify_transfer,
+            ('POST', '/transfer/finalize_transfer'): self.finalize_transfer,
+            ('POST', '/payments'): self.flutterwave_initialize,
+            ('GET', '/transactions'): self.flutterwave_verify,
+            ('GET', '/pay'): self.pay,
+        }
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _serve(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                status, payload = simulator.handle(method, self.path, json.loads(raw) if raw else {})
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._serve('GET')
+
+            def do_POST(self):
+                self._serve('POST')
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _Server((self.host, self.port), Handler)
+        self.port = self._server.server_port
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handle(self, method, path, body):
+        """Route one request; returns (HTTP status, JSON payload)."""
+        parts = urlsplit(path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        route, arg = parts.path.rstrip('/'), None
+        if (method, route) not in self.routes:
+            route, _, arg = route.rpartition('/')
+        handler = self.routes.get((method, route))
+
+        delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        with self._lock:
+            self.stats[f'{method} {route}'] += 1
+            if handler is None:
+                return _paystack_error(404, f'No simulated endpoint for {method} {parts.path}')
+            if route != '/pay' and self._random.random() < self.error_rate:
+                self.stats['errors_injected'] += 1
+                status = 'error' if route in FLUTTERWAVE_ROUTES else False
+                return 503, {'status': status, 'message': 'Simulated gateway error'}
+            return handler(body, query, arg) if arg is not None else handler(body, query)
+
+    # Charges
+
+    def _new_charge(self, gateway, reference, amount, email):
+        charge = {
+            'id': next(self._ids), 'gateway': gateway, 'reference': reference, 'amount': amount,
+            'email': email, 'status': 'abandoned',
+        }
+        self.charges[reference] = charge
+        if self.auto_pay:
+            self._complete_charge(charge)
+        return charge
+
+    def _complete_charge(self, charge):
+        if charge['status'] == 'success':
+            return
+        charge['status'] = 'success'
+        if charge['gateway'] == 'paystack':
+            self._emit('paystack', {'event': 'charge.success', 'data': self._paystack_charge(charge)})
+        else:
+            self._emit('flutterwave', {'event': 'charge.completed', 'data': self._flutterwave_charge(charge)})
+
+    def _paystack_charge(self, charge):
+        return {
+            'id': charge['id'], 'reference': charge['reference'], 'amount': charge['amount'],
+            'status': charge['status'], 'currency': 'NGN', 'customer': {'email': charge['email']},
+        }
+
+    def _flutterwave_charge(self, charge):
+        return {
+            'id': charge['id'], 'tx_ref': charge['reference'], 'amount': charge['amount'], 'currency': 'NGN',
+            'status': 'successful' if charge['status'] == 'success' else 'pending',
+            'customer': {'email': charge['email']},
+        }
+
+    def paystack_initialize(self, body, query):
+        reference = body.get('reference') or uuid.uuid4().hex
+        if reference in self.charges:
+            return _paystack_error(400, 'Duplicate Transaction Reference')
+        self._new_charge('paystack', reference, int(body.get('amount') or 0), body.get('email'))
+        return _paystack_ok({
+            'authorization_url': f"{self.url}/pay/{reference}",
+            'access_code': uuid.uuid4().hex[:15],
+            'reference': reference,
+        }, 'Authorization URL created')
+
+    def paystack_verify(self, body, query, reference):
+        charge = self.charges.get(reference)
+        if charge is None or charge['gateway'] != 'paystack':
+            return _paystack_error(400, 'Transaction reference not found')
+        return _paystack_ok(self._paystack_charge(charge), 'Verification successful')
+
+    def flutterwave_initialize(self, body, query):
+        reference = body.get('tx_ref') or uuid.uuid4().hex
+        if reference in self.charges:
+            return 400, {'status': 'error', 'message': 'Duplicate tx_ref'}
+        self._new_charge('flutterwave', reference, float(body.get('amount') or 0), body.get('customer', {}).get('email'))
+        return _flutterwave_ok({'link': f"{self.url}/pay/{reference}"}, 'Hosted Link')
+
+    def flutterwave_verify(self, body, query):
+        charge = self.charges.get(query.get('tx_ref'))
+        found = [self._flutterwave_charge(charge)] if charge and charge['gateway'] == 'flutterwave' else []
+        return _flutterwave_ok(found, 'Transactions fetched')
+
+    def pay(self, body, query, reference):
+        """The customer completing checkout."""
+        charge = self.charges.get(reference)
+        if charge is None:
+            return _paystack_error(404, 'Unknown checkout')
+        self._complete_charge(charge)
+        return _paystack_ok({'reference': reference, 'status': 'success'}, 'Payment complete')
+
+    # Banks and recipients
+
+    def list_banks(self, body, query):
+        return _paystack_ok(BANKS, 'Banks retrieved')
+
+    def resolve_account(self, body, query):
+        account_number, bank_code = query.get('account_number', ''), query.get('bank_code')
+        if len(account_number) != 10 or not account_number.isdigit() or bank_code not in BANK_CODES:
+            return _paystack_error(422, 'Could not resolve account name. Check parameters or try again.')
+        return _paystack_ok({'account_number': account_number, 'account_name': f'SIMULATED ACCOUNT {account_number[-4:]}'})
+
+    def _recipient(self, item):
+        key = (item.get('account_number'), item.get('bank_code'))
+        code = self.recipients.setdefault(key, f"RCP_{uuid.uuid4().hex[:12]}")
+        return {
+            'recipient_code': code, 'name': item.get('name'), 'type': 'nuban',
+            'details': {'account_number': key[0], 'bank_code': key[1]},
+        }
+
+    def create_recipient(self, body, query):
+        if body.get('bank_code') not in BANK_CODES:
+            return _paystack_error(400, 'Invalid bank code')
+        return _paystack_ok(self._recipient(body), 'Transfer recipient created successfully')
+
+    def create_recipients(self, body, query):
+        success, errors = [], []
+        for item in body.get('batch') or []:
+            if item.get('bank_code') in BANK_CODES:
+                success.append(self._recipient(item))
+            else:
+                errors.append({'message': 'Invalid bank code', 'details': item})
+        return _paystack_ok({'success': success, 'errors': errors}, 'Recipients added successfully')
+
+    # Transfers
+
+    def _new_transfer(self, item, status):
+        transfer = {
+            'id': next(self._ids), 'reference': item.get('reference') or uuid.uuid4().hex,
+            'transfer_code': f"TRF_{uuid.uuid4().hex[:12]}", 'amount': int(item.get('amount') or 0),
+            'recipient': item.get('recipient'), 'currency': 'NGN', 'status': status,
+        }
+        self.transfers[transfer['reference']] = transfer
+        if status == 'success':
+            self._emit('paystack', {'event': 'transfer.success', 'data': dict(transfer)})
+        return transfer
+
+    def transfer(self, body, query):
+        if body.get('reference') in self.transfers:
+            return _paystack_error(400, 'Duplicate Transfer Reference')
+        transfer = self._new_transfer(body, 'otp' if self.otp else 'success')
+        message = 'Transfer requires OTP to continue' if self.otp else 'Transfer has been queued'
+        return _paystack_ok(dict(transfer), message)
+
+    def bulk_transfer(self, body, query):
+        if self.otp:
+            return _paystack_error(400, 'You cannot initiate bulk transfers with OTP enabled')
+        results = []
+        for item in body.get('transfers') or []:
+            transfer = self.transfers.get(item.get('reference')) or self._new_transfer(item, 'success')
+            results.append({key: transfer[key] for key in ('reference', 'transfer_code', 'amount', 'status')})
+        return _paystack_ok(results, f'{len(results)} transfers queued.')
+
+    def verify_transfer(self, body, query, reference):
+        transfer = self.transfers.get(reference)
+        if transfer is None:
+            return _paystack_error(404, 'Transfer not found')
+        return _paystack_ok(dict(transfer), 'Transfer retrieved')
+
+    def finalize_transfer(self, body, query):
+        transfer = next((t for t in self.transfers.values() if t['transfer_code'] == body.get('transfer_code')), None)
+        if transfer is None:
+            return _paystack_error(400, 'Transfer not found')
+        if transfer['status'] != 'otp':
+            return _paystack_error(400, 'Transfer is not currently awaiting OTP')
+        if not body.get('otp'):
+            return _paystack_error(400, 'Invalid OTP')
+        transfer['status'] = 'success'
+        self._emit('paystack', {'event': 'transfer.success', 'data': dict(transfer)})
+        return _paystack_ok(dict(transfer), 'Transfer has been queued')
+
+    # Webhooks
+
+    def _emit(self, gateway, event):
+        body = json.dumps(event).encode()
+        if gateway == 'paystack':
+            signature = hmac.new(self.paystack_secret.encode(), body, hashlib.sha512).hexdigest()
+            headers = {'Content-Type': 'application/json', 'x-paystack-signature': signature}
+        else:
+            headers = {'Content-Type': 'application/json', 'verif-hash': self.flutterwave_hash}
+
+        url = self.webhook_urls.get(gateway)
+        if url is None:
+            self.webhooks.append({'gateway': gateway, 'headers': headers, 'body': body})
+            return
+        timer = threading.Timer(self.webhook_delay, self._deliver, args=(url, headers, body))
+        timer.daemon = True
+        timer.start()
+
+    def _deliver(self, url, headers, body):
+        try:
+            response = get_session('simulator-webhooks').post(url, data=body, headers=headers, timeout=get_timeout())
+            ok = response.status_code == 200
+        except Exception as e:
+            logger.warning(f"Simulated webhook to {url} failed: {e!r}")
+            ok = False
+        with self._lock:
+            self.stats['webhooks_delivered' if ok else 'webhooks_failed'] += 1
@@ -0,0 +1,91 @@
+import logging
+
+from celery import shared_task
+
+logger = logging.getLogger(__name__)
+
+
+def _payout_gateway():
+    from .services import get_gateway
+
+    gateway = get_gateway()
+    if not hasattr(gateway, 'bulk_transfer'):
+        logger.error(f"{gateway.NAME} does not support bulk transfers; payouts stay queued")
+        return None
+    return gateway
+
+
+@shared_task
+def process_payout_queue(batch_size=None, concurrency=None, max_batches=None):
+    from .payouts import drain_payout_queue
+
+    gateway = _payout_gateway()
+    if gateway is None:
+        return {}
+    stats = drain_payout_queue(gateway, batch_size=batch_size, concurrency=concurrency, max_batches=max_batches)
+    logger.info(f"Payout queue run: {stats}")
+    return stats
+
+
+@shared_task
+def reconcile_payouts():
+    from .payouts import reconcile_payouts as reconcile
+
+    gateway = _payout_gateway()
+    if gateway is None:
+        return {}
+    return reconcile(gateway)
+
+
+@shared_task
+def reconcile_withdrawals():
+    from .payouts import reconcile_withdrawals as reconcile
+    from .services import get_gateway
+
+    gateway = get_gateway()
+    if not hasattr(gateway, 'verify_transfer'):
+        return {}
+    return reconcile(gateway)
+
+
+@shared_task
+def drain_webhook_reference(reference):
+    from .webhooks import drain_reference
+
+    return drain_reference(reference)
+
+
+@shared_task
+def process_webhook_events():
+    from .webhooks import process_due_events, webhook_queue_stats
+
+    processed = process_due_events()
+    stats = webhook_queue_stats()
+    logger.info(f"Webhook sweep processed {processed} events; queue: {stats}")
+    return stats
+
+
+@shared_task
+def purge_webhook_events():
+    from .webhooks import purge_webhook_events as purge
+
+    deleted = purge()
+    logger.info(f"Purged {deleted} processed webhook events")
+    return deleted
+
+
+@shared_task
+def reconcile_payments(chunk_size=None, concurrency=None, max_chunks=None):
+    from .reconciliation import reconcile_pending_payments
+    from .services import GATEWAY_CLASSES, get_gateway
+
+    # Failover can leave payments pending on either gateway
+    stats = {}
+    for name in GATEWAY_CLASSES:
+        gateway = get_gateway(name)
+        if gateway.secret_key:
+            stats[name] = reconcile_pending_payments(
+                gateway, chunk_size=chunk_size, concurrency=concurrency, max_chunks=max_chunks
+            )
+    logger.info(f"Payment reconciliation run: {stats}")
+    return stats
@@ -1,11 +1,170 @@
-from django.test import TestCase
-from unittest.mock import patch, MagicMock
-from core.models import User, PlatformSettings
-from deals.models import Deal, JobType
-from .services import get_gateway, PaystackGateway, FlutterwaveGateway
+import asyncio
+import hashlib
+import hmac
+import json
+import threading
+import time
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import skipIf
+from unittest.mock import AsyncMock, patch
+from urllib.parse import urlsplit
+import requests
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
+from django.db import connection
+from datetime import timedelta
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient, force_authenticate
+from core.models import User, PlatformSettings, JobType
+from core.money import Money
+from deals.models import Deal
+from deals.services import DealService
+from .health import gateway_health
+from .ledger import (
+    FEES, InsufficientFunds, account_balance, change_wallet_balance, escrow_account, gateway_account, post,
+    user_account,
+)
+from .metrics import gateway_metrics
+from .async_views import (
+    AsyncDepositInitializeView, AsyncFinalizeWithdrawalView, AsyncVerifyPaymentView, AsyncWithdrawalView,
+)
+from .models import LedgerEntry, PaymentTransaction, Payout, TransferRecipient, WebhookEvent
+from .payouts import claim_batch, enqueue_withdrawal, reconcile_payouts, reconcile_withdrawals, settle_payout
+from .services import (
+    get_gateway, AsyncFlutterwaveGateway, PaymentProcessor, AsyncPaystackGateway, PaystackGateway, FlutterwaveGateway,
+)
+from .cache import gateway_cache_key
+from .reconciliation import CLAIM_KEY as RECONCILE_CLAIM_KEY, reconcile_pending_payments
+from .simulator import GatewaySimulator
+from .tasks import process_payout_queue
+from .views import reserve_withdrawal, withdrawal_response
+from .transport import aclose_clients, close_sessions
+from .webhooks import (
+    drain_reference, process_due_events, purge_webhook_events, record_webhook_event, webhook_queue_stats,
+)
 
-class PaymentServiceTestCase(TestCase):
+
+class StubGatewayServer:
+    """
+    Local HTTP/1.1 server standing in for a gateway API. Each route answers
+    with its queued responses in order and then keeps repeating the last one.
+    """
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.routes.clear()
+            self.requests.clear()
+            self.connections = 0
+
+    def add(self, method, path, *responses):
+        """
+        Queue (status, body[, delay_seconds]) responses for a route. A
+        response may also be a callable taking the recorded request.
+        """
+        self.routes[(method, path)] = list(responses)
+
+    def _respond(self, request):
+        with self._lock:
+            queue = self.routes.get((request['method'], request['path']))
+            if not queue:
+                return 404, {'status': False, 'message': 'No stub route'}, 0
+            response = queue.pop(0) if len(queue) > 1 else queue[0]
+        if callable(response):
+            response = response(request)
+        status, body, *delay = response
+        return status, body, delay[0] if delay else 0
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                parts = urlsplit(self.path)
+                request = {
+                    'method': self.command, 'path': parts.path, 'query': parts.query,
+                    'headers': dict(self.headers), 'json': body,
+                }
+                with stub._lock:
+                    stub.requests.append(request)
+                status, payload, delay = stub._respond(request)
+                if delay:
+                    threading.Event().wait(delay)
+                content = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client timed out and hung up first
+                    self.close_connection = True
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class GatewayStubTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubGatewayServer()
+        cls.stub.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.stop()
+        close_sessions()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.stub.reset()
+        close_sessions()
+        gateway_metrics.reset()
+        for gateway in (PaystackGateway, FlutterwaveGateway):
+            patcher = patch.object(gateway, 'BASE_URL', self.stub.url)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Backoff sleeps are not under test
+        patcher = patch('payments.services.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class PaymentServiceTestCase(GatewayStubTestCase):
     def setUp(self):
+        super().setUp()
         self.settings = PlatformSettings.objects.create(
             active_gateway='paystack',
             paystack_secret_key='sk_test_mock',
@@ -21,52 +180,1270 @@ class PaymentServiceTestCase(TestCase):
             amount=5000
         )
 
-    @patch('requests.post')
-    def test_paystack_initialization(self, mock_post):
-        mock_response = MagicMock()
-        mock_response.json.return_value = {
-            'status': True, 
+    def test_paystack_initialization(self):
+        self.stub.add('POST', '/transaction/initialize', (200, {
+            'status': True,
             'data': {'authorization_url': 'https://paystack.com/pay/xxx', 'reference': 'ref123'}
-        }
-        mock_post.return_value = mock_response
+        }))
 
         gateway = get_gateway()
         result = gateway.initialize_payment(5000, 'client@example.com', 'ref123', 'http://callback.url')
-        
+
         self.assertTrue(result['status'])
         self.assertEqual(result['data']['authorization_url'], 'https://paystack.com/pay/xxx')
-        
-    @patch('requests.get')
-    def test_paystack_verification_success(self, mock_get):
-        mock_response = MagicMock()
-        mock_response.json.return_value = {
+        sent = self.stub.requests[0]
+        self.assertEqual(sent['headers']['Authorization'], 'Bearer sk_test_mock')
+        self.assertEqual(sent['json']['amount'], 500000)
+
+    def test_paystack_verification_success(self):
+        self.stub.add('GET', '/transaction/verify/ref123', (200, {
             'status': True,
             'data': {'status': 'success', 'amount': 500000, 'reference': 'ref123'}
-        }
-        mock_get.return_value = mock_response
+        }))
 
         gateway = get_gateway()
         verification = gateway.verify_payment('ref123')
-        
+
         self.assertTrue(verification['status'])
         self.assertEqual(verification['data']['status'], 'success')
 
-    @patch('requests.post')
-    def test_flutterwave_initialization(self, mock_post):
+    def test_flutterwave_initialization(self):
         # Switch to FW
         self.settings.active_gateway = 'flutterwave'
         self.settings.flutterwave_secret_key = 'flw_sec_mock'
         self.settings.save()
-
-        mock_response = MagicMock()
-        mock_response.json.return_value = {
+        self.stub.add('POST', '/payments', (200, {
             'status': 'success',
             'data': {'link': 'https://flutterwave.com/pay/xxx'}
-        }
-        mock_post.return_value = mock_response
+        }))
 
         gateway = get_gateway()
         result = gateway.initialize_payment(5000, 'client@example.com', 'ref456', 'http://callback.url', {})
-        
+
         self.assertEqual(result['status'], 'success')
         self.assertEqual(result['data']['link'], 'https://flutterwave.com/pay/xxx')
+        self.assertEqual(self.stub.requests[0]['json']['amount'], '5000.00')
+
+
+class GatewayTransportTestCase(GatewayStubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gateway = PaystackGateway(public_key='pk', secret_key='sk_test')
+
+    def test_calls_reuse_one_keep_alive_connection(self):
+        self.stub.add('GET', '/transaction/verify/ref1', (200, {'status': True, 'data': {}}))
+        self.stub.add('POST', '/transferrecipient', (200, {'status': True, 'data': {}}))
+
+        for _ in range(5):
+            self.gateway.verify_payment('ref1')
+        PaystackGateway(public_key='pk', secret_key='sk_other').create_transfer_recipient('Ada', '0123456789', '058')
+
+        self.assertEqual(len(self.stub.requests), 6)
+        self.assertEqual(self.stub.connections, 1)
+
+    def test_get_is_retried_on_503(self):
+        self.stub.add(
+            'GET', '/transaction/verify/ref1',
+            (503, {'status': False, 'message': 'busy'}),
+            (503, {'status': False, 'message': 'busy'}),
+            (200, {'status': True, 'data': {'status': 'success'}}),
+        )
+
+        result = self.gateway.verify_payment('ref1')
+
+        self.assertTrue(result['status'])
+        self.assertEqual(len(self.stub.requests), 3)
+        self.assertEqual(self.sleep.call_count, 2)
+        metrics = gateway_metrics.snapshot()['paystack.verify_payment']
+        self.assertEqual((metrics['calls'], metrics['errors'], metrics['retries']), (3, 2, 2))
+
+    def test_retries_are_bounded(self):
+        self.stub.add('GET', '/bank', (503, {'status': False, 'message': 'busy'}))
+
+        with override_settings(PAYMENT_GATEWAY_GET_RETRIES=2):
+            result = self.gateway.list_banks()
+        self.assertEqual(result, {'status': False, 'message': 'busy', 'http_status': 503})
+        self.assertEqual(len(self.stub.requests), 3)
+
+        self.stub.requests.clear()
+        with override_settings(PAYMENT_GATEWAY_GET_RETRIES=5, PAYMENT_GATEWAY_RETRY_BUDGET=0):
+            self.gateway.list_banks()
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_post_is_never_retried(self):
+        self.stub.add('POST', '/transfer', (503, {'status': False, 'message': 'busy'}))
+
+        result = self.gateway.transfer(1000, 'RCP_x', 'WD-1')
+
+        self.assertFalse(result['status'])
+        self.assertEqual(len(self.stub.requests), 1)
+
+    @override_settings(PAYMENT_GATEWAY_READ_TIMEOUT=0.2, PAYMENT_GATEWAY_GET_RETRIES=0)
+    def test_slow_gateway_times_out(self):
+        self.stub.add('GET', '/transaction/verify/slow', (200, {'status': True}, 2))
+
+        result = self.gateway.verify_payment('slow')
+
+        self.assertFalse(result['status'])
+        self.assertIn('timed out', result['message'])
+        metrics = gateway_metrics.snapshot()['paystack.verify_payment']
+        self.assertEqual(metrics['errors'], 1)
+        self.assertLess(metrics['max_ms'], 1500)
+
+    def test_unreachable_gateway_returns_error_in_gateway_shape(self):
+        flutterwave = FlutterwaveGateway(public_key='pk', secret_key='flw')
+
+        with patch.object(FlutterwaveGateway, 'BASE_URL', 'http://127.0.0.1:9'), \
+                self.assertLogs('payments.services', level='WARNING'):
+            result = flutterwave.initialize_payment(100, 'a@example.com', 'ref', 'http://cb')
+
+        self.assertEqual(result['status'], 'error')
+        self.assertEqual(gateway_metrics.snapshot()['flutterwave.initialize_payment']['errors'], 1)
+
+
+class AsyncGatewayTestCase(GatewayStubTestCase):
+    async def test_concurrent_calls_overlap_on_one_client(self):
+        self.stub.add('GET', '/transaction/verify/ref1', (200, {'status': True, 'data': {}}, 0.3))
+        gateway = AsyncPaystackGateway(public_key='pk', secret_key='sk_test')
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(gateway.verify_payment('ref1') for _ in range(20)))
+        elapsed = time.perf_counter() - started
+        await aclose_clients(asyncio.get_running_loop())
+
+        self.assertTrue(all(result['status'] for result in results))
+        # 20 sequential calls would take 6s
+        self.assertLess(elapsed, 2)
+        self.assertEqual(gateway_metrics.snapshot()['paystack.verify_payment']['calls'], 20)
+
+    async def test_get_is_retried_and_post_is_not(self):
+        self.stub.add(
+            'GET', '/transaction/verify/ref1',
+            (503, {'status': False, 'message': 'busy'}),
+            (200, {'status': True, 'data': {'status': 'success'}}),
+        )
+        self.stub.add('POST', '/transfer', (503, {'status': False, 'message': 'busy'}))
+        gateway = AsyncPaystackGateway(public_key='pk', secret_key='sk_test')
+
+        with patch('payments.services.asyncio.sleep', new_callable=AsyncMock):
+            verified = await gateway.verify_payment('ref1')
+            transferred = await gateway.transfer(1000, 'RCP_x', 'WD-1')
+        await aclose_clients(asyncio.get_running_loop())
+
+        self.assertTrue(verified['status'])
+        self.assertFalse(transferred['status'])
+        self.assertEqual([r['method'] for r in self.stub.requests], ['GET', 'GET', 'POST'])
+
+    @override_settings(PAYMENT_GATEWAY_READ_TIMEOUT=0.2, PAYMENT_GATEWAY_GET_RETRIES=0)
+    async def test_timeout_returns_error_in_gateway_shape(self):
+        self.stub.add('GET', '/transactions', (200, {'status': 'success'}, 2))
+        gateway = AsyncFlutterwaveGateway(public_key='pk', secret_key='flw')
+
+        result = await gateway.verify_payment('slow')
+        await aclose_clients(asyncio.get_running_loop())
+
+        self.assertEqual(result['status'], 'error')
+        self.assertEqual(gateway_metrics.snapshot()['flutterwave.verify_payment']['errors'], 1)
+
+
+class AsyncPaymentViewTestCase(GatewayStubTestCase):
+    def setUp(self):
+        super().setUp()
+        PlatformSettings.objects.create(active_gateway='paystack', paystack_secret_key='sk_test_mock')
+        self.user = User.objects.create_user(
+            username='saver', email='saver@example.com', balance=20000, kyc_status='basic'
+        )
+        self.factory = AsyncRequestFactory()
+
+    async def call(self, view, request):
+        response = await view.as_view()(request)
+        await aclose_clients(asyncio.get_running_loop())
+        return response
+
+    async def test_deposit_requires_authentication(self):
+        request = self.factory.post('/api/payments/deposit/initiate/', {'amount': 1000}, content_type='application/json')
+
+        response = await self.call(AsyncDepositInitializeView, request)
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.stub.requests, [])
+
+    async def test_deposit_initialize(self):
+        self.stub.add('POST', '/transaction/initialize', (200, {
+            'status': True, 'data': {'authorization_url': 'https://paystack.com/pay/dep'}
+        }))
+        request = self.factory.post('/api/payments/deposit/initiate/', {'amount': 1000}, content_type='application/json')
+        force_authenticate(request, self.user)
+
+        response = await self.call(AsyncDepositInitializeView, request)
+
+        self.assertEqual(response.data['data']['authorization_url'], 'https://paystack.com/pay/dep')
+        sent = self.stub.requests[0]['json']
+        self.assertEqual(sent['amount'], 100000)
+        self.assertTrue(sent['reference'].startswith(f'DEP-{self.user.id}-'))
+        tx = await PaymentTransaction.objects.aget(reference=sent['reference'])
+        self.assertEqual((tx.purpose, tx.target_id, tx.status), ('deposit', self.user.id, 'pending'))
+
+    async def test_verify_credits_deposit(self):
+        reference = f'DEP-{self.user.id}-abc12345'
+        self.stub.add('GET', f'/transaction/verify/{reference}', (200, {
+            'status': True, 'data': {'status': 'success', 'amount': 250000, 'reference': reference}
+        }))
+        request = self.factory.get('/api/payments/verify/', {'reference': reference})
+
+        response = await self.call(AsyncVerifyPaymentView, request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['type'], 'deposit')
+        await self.user.arefresh_from_db()
+        self.assertEqual(self.user.balance, 22500)
+
+        # Settled now, so a repeat is answered without the gateway
+        await cache.aclear()
+        response = await self.call(AsyncVerifyPaymentView, self.factory.get('/api/payments/verify/', {'reference': reference}))
+        self.assertEqual((response.data['status'], response.data['balance']), ('verified', 22500))
+        self.assertEqual(len(self.stub.requests), 1)
+
+    async def test_withdrawal_debits_balance(self):
+        self.stub.add('GET', '/bank/resolve', (200, {'status': True, 'data': {'account_name': 'SAVER ONE'}}))
+        self.stub.add('POST', '/transferrecipient', (200, {'status': True, 'data': {'recipient_code': 'RCP_1'}}))
+        self.stub.add('POST', '/transfer', (200, {'status': True, 'data': {'transfer_code': 'TRF_1', 'status': 'otp'}}))
+        request = self.factory.post('/api/payments/withdraw/', {
+            'amount': '5000', 'bank_code': '058', 'account_number': '0123456789'
+        }, content_type='application/json')
+        force_authenticate(request, self.user)
+
+        response = await self.call(AsyncWithdrawalView, request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['requires_otp'])
+        self.assertEqual(self.stub.requests[-1]['json']['recipient'], 'RCP_1')
+        tx = await PaymentTransaction.objects.aget(transaction_type='withdrawal')
+        self.assertEqual((tx.status, tx.transfer_code), ('pending', 'TRF_1'))
+        await self.user.arefresh_from_db()
+        self.assertEqual(self.user.balance, 15000)
+
+    async def test_withdrawal_is_not_sent_when_balance_no_longer_covers_it(self):
+        self.stub.add('GET', '/bank/resolve', (200, {'status': True, 'data': {'account_name': 'SAVER ONE'}}))
+        self.stub.add('POST', '/transferrecipient', (200, {'status': True, 'data': {'recipient_code': 'RCP_1'}}))
+        self.stub.add('POST', '/transfer', (200, {'status': True, 'data': {'transfer_code': 'TRF_1', 'status': 'success'}}))
+        # Spent elsewhere after the request's user was loaded
+        await User.objects.filter(pk=self.user.pk).aupdate(balance=1000)
+        request = self.factory.post('/api/payments/withdraw/', {
+            'amount': '5000', 'bank_code': '058', 'account_number': '0123456789'
+        }, content_type='application/json')
+        force_authenticate(request, self.user)
+
+        response = await self.call(AsyncWithdrawalView, request)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('/transfer', [r['path'] for r in self.stub.requests])
+        self.assertFalse(await PaymentTransaction.objects.filter(transaction_type='withdrawal').aexists())
+        await self.user.arefresh_from_db()
+        self.assertEqual(self.user.balance, 1000)
+
+    async def test_refused_withdrawal_refunds_the_wallet(self):
+        self.stub.add('GET', '/bank/resolve', (200, {'status': True, 'data': {'account_name': 'SAVER ONE'}}))
+        self.stub.add('POST', '/transferrecipient', (200, {'status': True, 'data': {'recipient_code': 'RCP_1'}}))
+        self.stub.add('POST', '/transfer', (400, {'status': False, 'message': 'Insufficient balance in integration'}))
+        request = self.factory.post('/api/payments/withdraw/', {
+            'amount': '5000', 'bank_code': '058', 'account_number': '0123456789'
+        }, content_type='application/json')
+        force_authenticate(request, self.user)
+
+        response = await self.call(AsyncWithdrawalView, request)
+
+        self.assertEqual(response.status_code, 400)
+        tx = await PaymentTransaction.objects.aget(transaction_type='withdrawal')
+        self.assertEqual(tx.status, 'failed')
+        await self.user.arefresh_from_db()
+        self.assertEqual(self.user.balance, 20000)
+        kinds = [kind async for kind in LedgerEntry.objects.filter(reference=tx.reference).values_list('kind', flat=True)]
+        self.assertEqual(sorted(set(kinds)), ['withdrawal', 'withdrawal_reversal'])
+
+    async def test_finalize_finds_withdrawal_by_transfer_code(self):
+        await PaymentTransaction.objects.acreate(
+            user=self.user, gateway='paystack', reference='WITH-1', amount_paid=5000,
+            transaction_type='withdrawal', transfer_code='TRF_1',
+        )
+        # Another pending transfer whose raw response merely mentions the code
+        await PaymentTransaction.objects.acreate(
+            user=self.user, gateway='paystack', reference='WITH-2', amount_paid=5000,
+            transaction_type='withdrawal', transfer_code='TRF_2', raw_response={'note': 'TRF_1'},
+        )
+        self.stub.add('POST', '/transfer/finalize_transfer', (200, {'status': True, 'data': {'status': 'success'}}))
+        request = self.factory.post('/api/payments/withdraw/finalize/', {
+            'transfer_code': 'TRF_1', 'otp': '123456'
+        }, content_type='application/json')
+        force_authenticate(request, self.user)
+
+        response = await self.call(AsyncFinalizeWithdrawalView, request)
+
+        self.assertEqual(response.status_code, 200)
+        statuses = {tx.reference: tx.status async for tx in PaymentTransaction.objects.all()}
+        self.assertEqual(statuses, {'WITH-1': 'success', 'WITH-2': 'pending'})
+
+
+class PaymentRoutingTestCase(TestCase):
+    def setUp(self):
+        PlatformSettings.objects.create(active_gateway='paystack', paystack_secret_key='sk_test_mock')
+        self.client_user = User.objects.create_user(username='client', email='client@example.com', balance=0)
+        self.freelancer = User.objects.create_user(username='freelancer', email='freelancer@example.com')
+        job_type = JobType.objects.create(name='Design')
+        self.deal = Deal.objects.create(
+            client=self.client_user, freelancer=self.freelancer, title='Logo', description='A logo',
+            amount=10000, job_type=job_type,
+        )
+
+    def test_routes_by_recorded_purpose_not_reference_format(self):
+        PaymentProcessor.record_initialized_payment('ps_abc', 'deposit', Money.from_naira(750), 'paystack', self.client_user)
+
+        self.assertEqual(PaymentProcessor.resolve_payment('ps_abc'), ('deposit', self.client_user))
+        self.assertTrue(PaymentProcessor.process_successful_payment('ps_abc', Money.from_naira(750), 'paystack', {}))
+
+        self.client_user.refresh_from_db()
+        self.assertEqual(self.client_user.balance, 750)
+        self.assertEqual(PaymentTransaction.objects.get(reference='ps_abc').status, 'success')
+
+    def test_deal_funding_resolves_with_one_query(self):
+        PaymentProcessor.record_initialized_payment(
+            'checkout-1', 'deal_funding', Money.from_naira(10500), 'paystack', self.client_user, deal=self.deal
+        )
+
+        with self.assertNumQueries(1):
+            purpose, deal = PaymentProcessor.resolve_payment('checkout-1')
+            self.assertEqual((purpose, deal.freelancer), ('deal_funding', self.freelancer))
+
+        self.assertTrue(PaymentProcessor.process_successful_payment('checkout-1', Money.from_naira(10500), 'paystack', {}))
+        self.deal.refresh_from_db()
+        self.assertEqual(self.deal.status, 'funded')
+
+    def test_legacy_references_still_resolve(self):
+        self.assertEqual(
+            PaymentProcessor.resolve_payment(f'fund-{self.deal.id}-0123456789'), ('deal_funding', self.deal)
+        )
+        self.assertEqual(PaymentProcessor.resolve_payment('DEP-x-abc'), (None, None))
+        self.assertEqual(PaymentProcessor.resolve_payment('ORDER-1'), (None, None))
+
+
+class ReconcilePaymentsTestCase(GatewayStubTestCase):
+    def setUp(self):
+        super().setUp()
+        PlatformSettings.objects.create(active_gateway='paystack', paystack_secret_key='sk_test_mock')
+        self.gateway = get_gateway()
+        self.user = User.objects.create_user(username='saver', email='saver@example.com', balance=0)
+
+    def pending(self, reference, naira=1000, age=timedelta(hours=1)):
+        tx = PaymentProcessor.record_initialized_payment(
+            reference, 'deposit', Money.from_naira(naira), 'paystack', self.user
+        )
+        PaymentTransaction.objects.filter(pk=tx.pk).update(created_at=tx.created_at - age)
+        return tx
+
+    def verify_returns(self, reference, status, kobo=100000):
+        self.stub.add('GET', f'/transaction/verify/{reference}', (200, {
+            'status': True, 'data': {'status': status, 'amount': kobo, 'reference': reference}
+        }))
+
+    def statuses(self):
+        return dict(PaymentTransaction.objects.values_list('reference', 'status'))
+
+    def test_settles_pending_payments_by_gateway_status(self):
+        for reference, status in [('paid', 'success'), ('declined', 'failed'), ('browsing', 'abandoned')]:
+            self.pending(reference)
+            self.verify_returns(reference, status)
+        self.pending('gave-up', age=timedelta(days=2))
+        self.verify_returns('gave-up', 'abandoned')
+        self.pending('short', naira=5000)
+        self.verify_returns('short', 'success', kobo=100000)
+        self.pending('just-started', age=timedelta(0))
+
+        stats = reconcile_pending_payments(self.gateway)
+
+        self.assertEqual(stats, {'chunks': 1, 'checked': 5, 'confirmed': 1, 'failed': 2, 'pending': 1, 'mismatch': 1})
+        self.assertEqual(self.statuses(), {
+            'paid': 'success', 'declined': 'failed', 'browsing': 'pending', 'gave-up': 'failed',
+            'short': 'pending', 'just-started': 'pending',
+        })
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 1000)
+
+    def test_stopped_run_resumes_from_checkpoint(self):
+        references = [f'ref-{i}' for i in range(5)]
+        for reference in references:
+            self.pending(reference)
+            self.verify_returns(reference, 'ongoing')
+
+        first = reconcile_pending_payments(self.gateway, chunk_size=2, max_chunks=2)
+        second = reconcile_pending_payments(self.gateway, chunk_size=2)
+
+        self.assertEqual((first['checked'], second['checked']), (4, 1))
+        verified = [r['path'].rsplit('/', 1)[1] for r in self.stub.requests]
+        self.assertEqual(sorted(verified), references)
+        # A completed pass clears the checkpoint so the next one starts over
+        self.assertEqual(reconcile_pending_payments(self.gateway, chunk_size=2)['checked'], 5)
+
+    def test_transactions_claimed_by_another_worker_are_skipped(self):
+        tx = self.pending('busy')
+        cache.add(RECONCILE_CLAIM_KEY.format(id=tx.id), 1)
+
+        out = StringIO()
+        call_command('reconcile_payments', stdout=out)
+
+        self.assertEqual(self.stub.requests, [])
+        self.assertIn('Checked 1 pending payments in 1 chunks', out.getvalue())
+        self.assertIn('1 skipped', out.getvalue())
+
+
+@override_settings(PAYSTACK_SECRET_KEY='sk_test_simulator')
+class GatewaySimulatorTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        close_sessions()
+        self.simulator = GatewaySimulator().start()
+        self.addCleanup(self.simulator.stop)
+        for gateway_class in (PaystackGateway, FlutterwaveGateway):
+            patcher = patch.object(gateway_class, 'BASE_URL', self.simulator.url)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        PlatformSettings.objects.create(active_gateway='paystack', paystack_secret_key='sk_test_simulator')
+        self.gateway = get_gateway()
+        self.user = User.objects.create_user(username='saver', email='saver@example.com', balance=0)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=False)
+    def test_deposit_is_paid_and_confirmed_by_signed_webhook(self):
+        run_drains_inline(self)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        init = client.post('/api/payments/deposit/initiate/', {'amount': '2500'}, format='json').json()
+        reference = init['data']['reference']
+        self.assertEqual(self.gateway.verify_payment(reference)['data']['status'], 'abandoned')
+
+        requests.get(init['data']['authorization_url'], timeout=5)
+
+        self.assertEqual(self.gateway.verify_payment(reference)['data']['status'], 'success')
+        webhook, = self.simulator.webhooks
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post(
+                '/api/payments/webhook/paystack/', webhook['body'], content_type='application/json',
+                HTTP_X_PAYSTACK_SIGNATURE=webhook['headers']['x-paystack-signature'],
+            )
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 2500)
+
+    def test_otp_transfer_waits_for_finalize(self):
+        self.simulator.otp = True
+        self.assertEqual(self.gateway.resolve_bank_account('12345', '044')['status'], False)
+        recipient = self.gateway.create_transfer_recipient('Saver', '0123456789', '044')['data']['recipient_code']
+
+        transfer = self.gateway.transfer(Money.from_naira(1500), recipient, 'WITH-1')['data']
+        self.assertEqual((transfer['status'], transfer['amount']), ('otp', 150000))
+        self.assertEqual(self.simulator.webhooks, [])
+
+        self.assertTrue(self.gateway.finalize_transfer(transfer['transfer_code'], '123456')['status'])
+        self.assertEqual(self.gateway.verify_transfer('WITH-1')['data']['status'], 'success')
+        self.assertEqual(json.loads(self.simulator.webhooks[0]['body'])['event'], 'transfer.success')
+
+    def test_injected_errors_fail_before_changing_state(self):
+        self.simulator.error_rate = 1
+
+        result = self.gateway.initialize_payment(1000, 'saver@example.com', 'DEP-x', 'https://example.com')
+
+        self.assertEqual(result, {'status': False, 'message': 'Simulated gateway error', 'http_status': 503})
+        self.assertEqual(self.simulator.charges, {})
+        self.assertEqual(self.simulator.stats['errors_injected'], 1)
+
+class VerifySingleFlightTestCase(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        close_sessions()
+        self.simulator = GatewaySimulator(latency=0.3).start()
+        self.addCleanup(self.simulator.stop)
+        patcher = patch.object(PaystackGateway, 'BASE_URL', self.simulator.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        PlatformSettings.objects.create(active_gateway='paystack', paystack_secret_key='sk_test_simulator')
+        self.user = User.objects.create_user(username='saver', email='saver@example.com', balance=0)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        init = client.post('/api/payments/deposit/initiate/', {'amount': '2500'}, format='json').json()
+        self.reference = init['data']['reference']
+        requests.get(init['data']['authorization_url'], timeout=5)
+
+    def verify(self, results):
+        try:
+            response = APIClient().get('/api/payments/verify/', {'reference': self.reference})
+            results.append((response.status_code, response.json()))
+        finally:
+            connection.close()
+
+    def test_concurrent_verifications_share_one_gateway_call(self):
+        results = []
+        threads = [threading.Thread(target=self.verify, args=(results,)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result == (200, results[0][1]) for result in results), results)
+        self.assertEqual(results[0][1]['status'], 'verified')
+        self.assertEqual(self.simulator.stats['GET /transaction/verify'], 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 2500)
+
+    def test_settled_reference_is_answered_locally(self):
+        self.verify([])
+        cache.clear()
+
+        results = []
+        self.verify(results)
+
+        self.assertEqual(results, [(200, {'status': 'verified', 'type': 'deposit', 'balance': 2500})])
+        self.assertEqual(self.simulator.stats['GET /transaction/verify'], 1)
+
+
+@override_settings(GATEWAY_BREAKER_MIN_CALLS=3, GATEWAY_BREAKER_COOLDOWN=30)
+class GatewayHealthTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        close_sessions()
+        self.simulator = GatewaySimulator().start()
+        self.addCleanup(self.simulator.stop)
+        for gateway_class in (PaystackGateway, FlutterwaveGateway):
+            patcher = patch.object(gateway_class, 'BASE_URL', self.simulator.url)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        PlatformSettings.objects.create(
+            active_gateway='paystack', paystack_secret_key='sk_test_simulator', flutterwave_secret_key='FLWSECK_TEST',
+        )
+        self.user = User.objects.create_user(username='saver', email='saver@example.com', balance=0)
+
+    def trip_paystack(self):
+        self.simulator.error_rate = 1
+        gateway = get_gateway()
+        for i in range(3):
+            gateway.initialize_payment(1000, 'saver@example.com', f'DEP-{i}', 'https://example.com')
+        self.simulator.error_rate = 0
+
+    def test_breaker_opens_and_fails_fast(self):
+        self.trip_paystack()
+
+        self.assertEqual(gateway_health.state('paystack'), 'open')
+        result = get_gateway().initialize_payment(1000, 'saver@example.com', 'DEP-late', 'https://example.com')
+        self.assertEqual(result['status'], False)
+        self.assertIn('temporarily unavailable', result['message'])
+        self.assertEqual(self.simulator.stats['POST /transaction/initialize'], 3)
+        self.assertEqual(gateway_health.state('flutterwave'), 'closed')
+
+    def test_half_open_probe_closes_breaker(self):
+        with override_settings(GATEWAY_BREAKER_COOLDOWN=0):
+            self.trip_paystack()
+            self.assertEqual(gateway_health.state('paystack'), 'half_open')
+            gateway = get_gateway()
+
+            self.assertTrue(gateway.initialize_payment(1000, 'saver@example.com', 'DEP-probe', 'https://example.com')['status'])
+
+        snapshot = gateway_health.snapshot('paystack')
+        self.assertEqual((snapshot['state'], snapshot['calls']), ('closed', 0))
+
+    def test_initialization_fails_over_when_enabled(self):
+        self.trip_paystack()
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        self.assertIsInstance(get_gateway(failover=True), PaystackGateway)
+        with override_settings(PAYMENT_GATEWAY_FAILOVER=True):
+            self.assertIsInstance(get_gateway(failover=True), FlutterwaveGateway)
+            init = client.post('/api/payments/deposit/initiate/', {'amount': '2500'}, format='json').json()
+
+        self.assertEqual(init['status'], 'success')
+        tx = PaymentTransaction.objects.get()
+        self.assertEqual(tx.gateway, 'flutterwave')
+        # Verification goes to the gateway the payment was made with
+        client.get('/api/payments/verify/', {'reference': tx.reference})
+        self.assertEqual(self.simulator.stats['GET /transactions'], 1)
+
+    def test_admin_integrations_show_health(self):
+        self.trip_paystack()
+        admin = User.objects.create_user(username='ops', email='ops@example.com', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        services = {row['service']: row for row in client.get('/api/admin/integrations/').json()}
+
+        self.assertEqual(services['paystack']['health']['state'], 'open')
+        self.assertEqual(services['paystack']['health']['errors'], 3)
+        self.assertIsNone(services['resend']['health'])
+        client.patch('/api/admin/integrations/', {'service': 'paystack', 'reset_circuit': True}, format='json')
+        self.assertEqual(gateway_health.state('paystack'), 'closed')
+
+
+class GatewayCacheTestCase(GatewayStubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gateway = PaystackGateway(public_key='pk', secret_key='sk_test', is_test_mode=True)
+        self.banks = {'status': True, 'data': [{'name': 'Access Bank', 'code': '044'}]}
+
+    def wait_for_requests(self, count):
+        deadline = time.monotonic() + 5
+        while len(self.stub.requests) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_bank_list_is_cached_per_gateway_mode(self):
+        self.stub.add('GET', '/bank', (200, self.banks))
+
+        self.assertEqual(self.gateway.list_banks(), self.banks)
+        self.assertEqual(self.gateway.list_banks(), self.banks)
+        self.assertEqual(len(self.stub.requests), 1)
+
+        PaystackGateway(public_key='pk', secret_key='sk_live', is_test_mode=False).list_banks()
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_account_resolution_is_keyed_by_arguments(self):
+        self.stub.add('GET', '/bank/resolve', (200, {'status': True, 'data': {'account_name': 'ADA'}}))
+
+        self.gateway.resolve_bank_account('0123456789', '058')
+        self.gateway.resolve_bank_account('0123456789', '058')
+        self.gateway.resolve_bank_account('9876543210', '058')
+
+        self.assertEqual(len(self.stub.requests), 2)
+
+    @override_settings(PAYMENT_GATEWAY_GET_RETRIES=0)
+    def test_failures_are_not_cached(self):
+        self.stub.add('GET', '/bank', (503, {'status': False, 'message': 'busy'}), (200, self.banks))
+
+        self.assertFalse(self.gateway.list_banks()['status'])
+        self.assertEqual(self.gateway.list_banks(), self.banks)
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_stale_entry_is_served_while_refreshing(self):
+        refreshed = {'status': True, 'data': [{'name': 'Kuda', 'code': '50211'}]}
+        self.stub.add('GET', '/bank', (200, self.banks), (200, refreshed))
+        self.gateway.list_banks()
+        key = gateway_cache_key(self.gateway, 'list_banks', '/bank')
+        cache.set(key, {**cache.get(key), 'fresh_until': 0}, 60)
+
+        self.assertEqual(self.gateway.list_banks(), self.banks)
+        self.wait_for_requests(2)
+        deadline = time.monotonic() + 5
+        while cache.get(key)['response'] != refreshed and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(self.gateway.list_banks(), refreshed)
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_concurrent_misses_make_one_call(self):
+        self.stub.add('GET', '/bank', (200, self.banks, 0.3))
+        results = []
+
+        threads = [threading.Thread(target=lambda: results.append(self.gateway.list_banks())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [self.banks] * 8)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    async def test_async_concurrent_misses_make_one_call(self):
+        self.stub.add('GET', '/bank/resolve', (200, {'status': True, 'data': {'account_name': 'ADA'}}, 0.3))
+        gateway = AsyncPaystackGateway(public_key='pk', secret_key='sk_test')
+
+        results = await asyncio.gather(*(gateway.resolve_bank_account('0123456789', '058') for _ in range(8)))
+        await aclose_clients(asyncio.get_running_loop())
+
+        self.assertTrue(all(result['data']['account_name'] == 'ADA' for result in results))
+        self.assertEqual(len(self.stub.requests), 1)
+
+
+class TransferRecipientTestCase(GatewayStubTestCase):
+    def setUp(self):
+        super().setUp()
+        PlatformSettings.objects.create(active_gateway='paystack', paystack_secret_key='sk_test_mock')
+        self.user = User.objects.create_user(
+            username='saver', email='saver@example.com', balance=50000, kyc_status='basic',
+            bank_name='Access Bank', bank_account='0123456789', bank_account_name='SAVER ONE',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.stub.add('GET', '/bank/resolve', (200, {'status': True, 'data': {'account_name': 'SAVER ONE'}}))
+        self.stub.add('POST', '/transferrecipient', (200, {'status': True, 'data': {'recipient_code': 'RCP_1'}}))
+        self.stub.add('POST', '/transfer', (200, {'status': True, 'data': {'transfer_code': 'TRF_1', 'status': 'success'}}))
+
+    def withdraw(self, account_number='0123456789'):
+        return self.client.post('/api/payments/withdraw/', {
+            'amount': '1000', 'bank_code': '044', 'account_number': account_number
+        }, format='json')
+
+    def paths(self):
+        return [r['path'] for r in self.stub.requests]
+
+    def test_recipient_is_reused_for_the_same_account(self):
+        self.assertEqual(self.withdraw().status_code, 200)
+        self.assertEqual(self.withdraw().status_code, 200)
+
+        self.assertEqual(self.paths(), ['/bank/resolve', '/transferrecipient', '/transfer', '/transfer'])
+        self.assertEqual(self.stub.requests[-1]['json']['recipient'], 'RCP_1')
+        recipient = TransferRecipient.objects.get()
+        self.assertEqual(
+            (recipient.gateway, recipient.is_test_mode, recipient.bank_code, recipient.account_name),
+            ('paystack', True, '044', 'SAVER ONE'),
+        )
+
+    def test_failed_recipient_creation_is_not_registered(self):
+        self.stub.add('POST', '/transferrecipient', (400, {'status': False, 'message': 'Invalid bank code'}))
+
+        response = self.withdraw()
+
+        self.assertIn('Invalid bank code', response.data['error'])
+        self.assertFalse(TransferRecipient.objects.exists())
+
+    def test_editing_bank_details_drops_saved_recipients(self):
+        self.withdraw()
+        user = User.objects.get(pk=self.user.pk)
+
+        user.balance = 1
+        user.save()
+        self.assertEqual(TransferRecipient.objects.count(), 1)
+
+        user.bank_account = '9999999999'
+        user.save()
+        self.assertFalse(TransferRecipient.objects.exists())
+
+    def test_warm_registry_in_bulk(self):
+        User.objects.create_user(username='nobank', email='nobank@example.com')
+        User.objects.create_user(
+            username='unknownbank', email='u@example.com', bank_name='Bank of Nowhere', bank_account='1111111111'
+        )
+        User.objects.create_user(
+            username='second', email='second@example.com', bank_name='access bank ', bank_account='2222222222'
+        )
+        self.stub.add('GET', '/bank', (200, {'status': True, 'data': [{'name': 'Access Bank', 'code': '044'}]}))
+        self.stub.add('POST', '/transferrecipient/bulk', (200, {'status': True, 'data': {
+            'success': [
+                {'recipient_code': 'RCP_B', 'name': 'second', 'details': {'account_number': '2222222222', 'bank_code': '044'}},
+                {'recipient_code': 'RCP_A', 'name': 'SAVER ONE', 'details': {'account_number': '0123456789', 'bank_code': '044'}},
+            ],
+            'errors': [],
+        }}))
+
+        out = StringIO()
+        call_command('warm_transfer_recipients', stdout=out)
+
+        self.assertIn('Created 2 recipients, skipped 1 users, 0 failed', out.getvalue())
+        self.assertEqual(len(self.stub.requests[-1]['json']['batch']), 2)
+        self.assertEqual(
+            dict(TransferRecipient.objects.values_list('user__username', 'recipient_code')),
+            {'saver': 'RCP_A', 'second': 'RCP_B'},
+        )
+
+        # Already registered accounts are not sent again, and withdrawals use the warmed code
+        call_command('warm_transfer_recipients', stdout=StringIO())
+        self.assertEqual(self.paths().count('/transferrecipient/bulk'), 1)
+        self.withdraw()
+        self.assertEqual(self.paths()[-1], '/transfer')
+        self.assertEqual(self.stub.requests[-1]['json']['recipient'], 'RCP_A')
+
+
+def bulk_transfer_result(statuses=None):
+    """Stub /transfer/bulk handler: every transfer succeeds unless `statuses` says otherwise."""
+    statuses = statuses or {}
+
+    def respond(request):
+        return 200, {'status': True, 'message': 'Transfers queued', 'data': [
+            {
+                'reference': item['reference'], 'recipient': item['recipient'], 'amount': item['amount'],
+                'transfer_code': f"TRF_{item['reference']}", 'status': statuses.get(item['reference'], 'success'),
+            }
+            for item in request['json']['transfers']
+        ]}
+    return respond
+
+
+class PayoutEngineTestCase(GatewayStubTestCase):
+    def setUp(self):
+        super().setUp()
+        PlatformSettings.objects.create(active_gateway='paystack', paystack_secret_key='sk_test_mock')
+        self.gateway = get_gateway()
+        self.user = User.objects.create_user(
+            username='earner', email='earner@example.com', balance=100000, kyc_status='basic'
+        )
+
+    def enqueue(self, count, amount='1000'):
+        return [
+            enqueue_withdrawal(self.user, self.gateway, Money.from_naira(amount), f'WITH-{self.user.id}-{i:04d}',
+                               'RCP_1', '0123456789', '044')
+            for i in range(count)
+        ]
+
+    def bulk_requests(self):
+        return [r for r in self.stub.requests if r['path'] == '/transfer/bulk']
+
+    @override_settings(PAYOUTS_BATCHED=True)
+    def test_batched_withdrawal_is_queued_not_sent(self):
+        TransferRecipient.objects.create(
+            user=self.user, gateway='paystack', account_number='0123456789', bank_code='044', recipient_code='RCP_1'
+        )
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.post('/api/payments/withdraw/', {
+            'amount': '2500', 'bank_code': '044', 'account_number': '0123456789'
+        }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['queued'])
+        self.assertEqual(self.stub.requests, [])
+        payout = Payout.objects.select_related('transaction').get()
+        self.assertEqual((payout.status, payout.recipient_code, payout.amount), ('pending', 'RCP_1', 2500))
+        self.assertEqual(payout.transaction.status, 'pending')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 97500)
+
+    def test_queue_drains_in_batches_with_per_item_outcomes(self):
+        payouts = self.enqueue(25)
+        failed, in_flight = payouts[3].reference, payouts[17].reference
+        self.stub.add('POST', '/transfer/bulk', bulk_transfer_result({failed: 'failed', in_flight: 'pending'}))
+
+        stats = process_payout_queue(batch_size=10, concurrency=1)
+
+        self.assertEqual([len(r['json']['transfers']) for r in self.bulk_requests()], [10, 10, 5])
+        self.assertEqual(self.bulk_requests()[0]['json']['transfers'][0]['amount'], 100000)
+        self.assertEqual(stats, {'batches': 3, 'paid': 23, 'failed': 1, 'processing': 1})
+        statuses = dict(PaymentTransaction.objects.values_list('reference', 'status'))
+        self.assertEqual(statuses[failed], 'failed')
+        self.assertEqual(statuses[in_flight], 'pending')
+        self.assertEqual(list(statuses.values()).count('success'), 23)
+        self.assertEqual(Payout.objects.get(reference=in_flight).transfer_code, f'TRF_{in_flight}')
+        # 25 debits of 1000, one refunded
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 100000 - 24 * 1000)
+
+    def test_max_batches_bounds_a_run(self):
+        self.enqueue(5)
+        self.stub.add('POST', '/transfer/bulk', bulk_transfer_result())
+
+        stats = process_payout_queue(batch_size=2, concurrency=1, max_batches=2)
+
+        self.assertEqual(stats['batches'], 2)
+        self.assertEqual(Payout.objects.filter(status='pending').count(), 1)
+
+    def test_lost_batch_is_reconciled_by_reference(self):
+        sent, never_arrived = self.enqueue(2)
+        self.stub.add('POST', '/transfer/bulk', (502, {'status': False, 'message': 'Bad gateway'}))
+
+        stats = process_payout_queue(concurrency=1)
+
+        self.assertEqual(stats['processing'], 2)
+        self.assertEqual(Payout.objects.filter(status='processing', failure_reason='Bad gateway').count(), 2)
+
+        self.stub.add('GET', f'/transfer/verify/{sent.reference}', (200, {
+            'status': True, 'data': {'status': 'success', 'transfer_code': 'TRF_late'}
+        }))
+        self.stub.add('GET', f'/transfer/verify/{never_arrived.reference}', (404, {
+            'status': False, 'message': 'Transfer not found'
+        }))
+        stats = reconcile_payouts(self.gateway, older_than=timedelta(0))
+
+        self.assertEqual(stats, {'paid': 1, 'requeued': 1})
+        self.assertEqual(Payout.objects.get(pk=sent.pk).transfer_code, 'TRF_late')
+        self.assertEqual(Payout.objects.get(pk=never_arrived.pk).status, 'pending')
+
+    def test_reconcile_only_requeues_on_404(self):
+        payout, = self.enqueue(1)
+        claim_batch()
+        # An outage whose message happens to say "not found" is not proof the transfer never arrived
+        self.stub.add('GET', f'/transfer/verify/{payout.reference}', (503, {
+            'status': False, 'message': 'Upstream not found'
+        }))
+
+        stats = reconcile_payouts(self.gateway, older_than=timedelta(0))
+
+        self.assertEqual(stats, {'unknown': 1})
+        self.assertEqual(Payout.objects.get(pk=payout.pk).status, 'processing')
+
+    def test_settling_twice_does_not_refund_twice(self):
+        payout, = self.enqueue(1)
+        payout, = claim_batch()
+
+        self.assertEqual(settle_payout(payout, 'failed', reason='Account closed'), 'failed')
+        self.assertEqual(settle_payout(payout, 'failed'), 'unchanged')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 100000)
+
+    def test_withdrawal_with_unknown_outcome_waits_for_reconciliation(self):
+        amount = Money.from_naira('5000')
+        tx = reserve_withdrawal(self.user, self.gateway, amount, 'WITH-direct')
+        # The gateway may have accepted the transfer before the 502
+        self.stub.add('POST', '/transfer', (502, {'status': False, 'message': 'Bad gateway'}))
+
+        response = withdrawal_response(self.user, tx, self.gateway.transfer(amount, 'RCP_1', tx.reference))
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(PaymentTransaction.objects.get(pk=tx.pk).status, 'pending')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 95000)
+
+        self.stub.add('GET', '/transfer/verify/WITH-direct', (200, {'status': True, 'data': {'status': 'reversed'}}))
+        stats = reconcile_withdrawals(self.gateway, older_than=timedelta(0))
+
+        self.assertEqual(stats, {'failed': 1})
+        self.assertEqual(PaymentTransaction.objects.get(pk=tx.pk).status, 'failed')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 100000)
+        self.assertEqual(reconcile_withdrawals(self.gateway, older_than=timedelta(0)), {})
+
+    def test_reconcile_leaves_withdrawal_pending_while_outcome_unknown(self):
+        tx = reserve_withdrawal(self.user, self.gateway, Money.from_naira('5000'), 'WITH-direct')
+        self.stub.add('GET', '/transfer/verify/WITH-direct', (503, {'status': False, 'message': 'Unavailable'}))
+
+        self.assertEqual(reconcile_withdrawals(self.gateway, older_than=timedelta(0)), {'unknown': 1})
+        self.assertEqual(PaymentTransaction.objects.get(pk=tx.pk).status, 'pending')
+
+
+@skipIf(connection.vendor == 'sqlite', 'SQLite in-memory test databases cannot take concurrent writers')
+class ConcurrentPayoutTestCase(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.stub = StubGatewayServer()
+        self.stub.start()
+        self.addCleanup(self.stub.stop)
+        patcher = patch.object(PaystackGateway, 'BASE_URL', self.stub.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parallel_workers_claim_disjoint_batches(self):
+        PlatformSettings.objects.create(active_gateway='paystack', paystack_secret_key='sk_test_mock')
+        user = User.objects.create_user(username='earner', email='earner@example.com', balance=100000)
+        gateway = get_gateway()
+        for i in range(40):
+            enqueue_withdrawal(user, gateway, Money.from_naira(100), f'WITH-{i:04d}', 'RCP_1', '0123456789', '044')
+        self.stub.add('POST', '/transfer/bulk', lambda request: (*bulk_transfer_result()(request), 0.05))
+
+        stats = process_payout_queue(batch_size=5, concurrency=4)
+
+        references = [t['reference'] for r in self.stub.requests for t in r['json']['transfers']]
+        self.assertEqual(len(references), 40)
+        self.assertEqual(len(set(references)), 40)
+        self.assertEqual(stats['paid'], 40)
+        self.assertEqual(Payout.objects.filter(status='paid').count(), 40)
+
+
+class LedgerTestCase(TestCase):
+    def setUp(self):
+        PlatformSettings.objects.create(active_gateway='paystack', platform_fee_percent=10, fee_payer='split')
+        job_type = JobType.objects.create(name='Dev', slug='dev')
+        self.client_user = User.objects.create_user(username='client', email='client@example.com')
+        self.freelancer = User.objects.create_user(username='freelancer', email='freelancer@example.com')
+        self.deal = Deal.objects.create(
+            client=self.client_user, freelancer=self.freelancer, job_type=job_type,
+            title='Logo', description='Desc', amount=10000,
+        )
+
+    def verify_ledger(self, *args):
+        out = StringIO()
+        call_command('verify_ledger', *args, stdout=out)
+        return out.getvalue()
+
+    def test_deposit_funding_and_release_balance_every_account(self):
+        PaymentProcessor.process_successful_payment('DEP-1', Money.from_naira(12000), 'paystack', {}, resolved=('deposit', self.client_user))
+        self.client_user.refresh_from_db()
+        DealService.fund_deal(self.deal, self.client_user, payment_method='wallet')
+        self.deal.refresh_from_db()
+        DealService.release_payout(self.deal)
+
+        # 10% fee split: the client pays 10500, the freelancer receives 9500
+        self.assertEqual(account_balance(user_account(self.client_user)), Money.from_naira(1500))
+        self.assertEqual(account_balance(user_account(self.freelancer)), Money.from_naira(9500))
+        self.assertEqual(account_balance(escrow_account(self.deal)), Money.from_naira(0))
+        self.assertEqual(account_balance(FEES), Money.from_naira(1000))
+        self.assertEqual(account_balance(gateway_account('paystack')), Money.from_naira(-12000))
+        self.assertEqual(LedgerEntry.objects.count(), 7)
+        self.assertIn('0 balance mismatches', self.verify_ledger())
+
+    def test_entries_are_append_only(self):
+        PaymentProcessor.process_successful_payment('DEP-1', Money.from_naira(500), 'paystack', {}, resolved=('deposit', self.client_user))
+        entry = LedgerEntry.objects.first()
+
+        with self.assertRaises(ValueError):
+            entry.save()
+        with self.assertRaises(ValueError):
+            entry.delete()
+
+    def test_verify_ledger_finds_and_rebuilds_drifted_balance(self):
+        PaymentProcessor.process_successful_payment('DEP-1', Money.from_naira(500), 'paystack', {}, resolved=('deposit', self.client_user))
+        User.objects.filter(pk=self.client_user.pk).update(balance=900)
+
+        output = self.verify_ledger('--account', user_account(self.client_user), '--fix')
+
+        self.assertIn(f'{user_account(self.client_user)}: stored 900.00, ledger 500.00 -> rebuilt as 500.00', output)
+        self.client_user.refresh_from_db()
+        self.assertEqual(self.client_user.balance, 500)
+        self.assertIn('0 balance mismatches', self.verify_ledger())
+
+    def test_wallet_debit_only_when_covered(self):
+        User.objects.filter(pk=self.client_user.pk).update(balance=300)
+
+        self.assertFalse(change_wallet_balance(self.client_user, Money.from_naira(-500)))
+        self.assertTrue(change_wallet_balance(self.client_user, Money.from_naira(-300)))
+        self.assertTrue(change_wallet_balance(self.client_user, Money.from_naira(-50), overdraft=True))
+        self.client_user.refresh_from_db()
+        self.assertEqual(self.client_user.balance, -50)
+
+    def test_uncovered_posting_writes_nothing(self):
+        with self.assertRaises(InsufficientFunds):
+            post('withdrawal', [(user_account(self.client_user), Money.from_naira(-1)), (gateway_account('paystack'), Money.from_naira(1))])
+
+        self.assertFalse(LedgerEntry.objects.exists())
+        self.client_user.refresh_from_db()
+        self.assertEqual(self.client_user.balance, 0)
+
+    def test_wallet_funding_rejected_without_balance(self):
+        with self.assertRaisesMessage(Exception, 'Insufficient wallet balance'):
+            DealService.fund_deal(self.deal, self.client_user, payment_method='wallet')
+
+        self.deal.refresh_from_db()
+        self.assertEqual(self.deal.status, 'created')
+        self.assertFalse(LedgerEntry.objects.exists())
+
+
+@skipIf(connection.vendor == 'sqlite', 'SQLite in-memory test databases cannot take concurrent writers')
+class WalletConcurrencyTestCase(TransactionTestCase):
+    def test_parallel_debits_never_overdraw_or_lose_credits(self):
+        user = User.objects.create_user(username='spender', email='spender@example.com')
+        post('deposit', [(gateway_account('paystack'), Money.from_naira(-1000)), (user_account(user), Money.from_naira(1000))], 'DEP-0')
+        start = threading.Barrier(40)
+        debited = []
+
+        def debit(i):
+            try:
+                start.wait()
+                post('withdrawal', [(user_account(user), Money.from_naira(-100)), (gateway_account('paystack'), Money.from_naira(100))], f'WITH-{i}')
+                debited.append(i)
+            except InsufficientFunds:
+                pass
+            finally:
+                connection.close()
+
+        def credit(i):
+            try:
+                start.wait()
+                post('deposit', [(gateway_account('paystack'), Money.from_naira(-10)), (user_account(user), Money.from_naira(10))], f'DEP-{i + 1}')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=debit, args=(i,)) for i in range(20)]
+        threads += [threading.Thread(target=credit, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        user.refresh_from_db()
+        # 1000 plus 20 credits of 10 covers at most 12 debits of 100
+        self.assertGreaterEqual(len(debited), 10)
+        self.assertLessEqual(len(debited), 12)
+        self.assertGreaterEqual(user.balance, 0)
+        self.assertEqual(Money.from_naira(user.balance), Money.from_naira(1200 - 100 * len(debited)))
+        self.assertEqual(LedgerEntry.objects.filter(account=user_account(user), kind='deposit').count(), 21)
+        out = StringIO()
+        call_command('verify_ledger', stdout=out)
+        self.assertIn('0 balance mismatches', out.getvalue())
+
+
+def run_drains_inline(test):
+    """Have drain_webhook_reference.delay() run at once, as a worker would, without eager mode."""
+    patcher = patch('payments.tasks.drain_webhook_reference.delay', side_effect=drain_reference)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+@override_settings(PAYSTACK_SECRET_KEY='sk_test_hook', WEBHOOK_MAX_ATTEMPTS=2, CELERY_TASK_ALWAYS_EAGER=False)
+class WebhookQueueTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        run_drains_inline(self)
+        self.user = User.objects.create_user(username='payer', email='payer@example.com', balance=0)
+        self.reference = f'DEP-{self.user.id}-abc123'
+
+    def post_paystack(self, payload):
+        body = json.dumps(payload).encode()
+        signature = hmac.new(b'sk_test_hook', body, hashlib.sha512).hexdigest()
+        return APIClient().post(
+            '/api/payments/webhook/paystack/', body, content_type='application/json',
+            HTTP_X_PAYSTACK_SIGNATURE=signature,
+        )
+
+    def charge(self, reference, amount=500000):
+        return {'event': 'charge.success', 'data': {'reference': reference, 'amount': amount}}
+
+    def test_webhook_is_acknowledged_before_processing(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.post_paystack(self.charge(self.reference))
+
+        self.assertEqual(response.status_code, 200)
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.event_type, event.reference, event.status), ('charge.success', self.reference, 'pending'))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 0)
+
+        for callback in callbacks:
+            callback()
+
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('processed', 1))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 5000)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_eager_mode_drains_after_the_response_is_sent(self):
+        request_started.send(sender=self.__class__)
+        with self.captureOnCommitCallbacks(execute=True):
+            record_webhook_event('paystack', self.charge(self.reference))
+
+        # Still serving the webhook request
+        self.assertEqual(WebhookEvent.objects.get().status, 'pending')
+
+        request_finished.send(sender=self.__class__)
+
+        self.assertEqual(WebhookEvent.objects.get().status, 'processed')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 5000)
+
+    def test_cron_endpoint_sweeps_due_events(self):
+        record_webhook_event('paystack', self.charge(self.reference))
+        url = '/api/payments/cron/process-webhooks/'
+
+        with patch.dict('os.environ', {'CRON_SECRET': 'cron-secret'}):
+            denied = APIClient().post(url)
+            response = APIClient().post(url, HTTP_AUTHORIZATION='Bearer cron-secret')
+
+        self.assertEqual(denied.status_code, 401)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['processed_count'], 1)
+        self.assertEqual(WebhookEvent.objects.get().status, 'processed')
+
+        out = StringIO()
+        call_command('process_webhook_events', stdout=out)
+        self.assertIn('Processed 0 webhook events: 0 pending', out.getvalue())
+
+    def test_bad_signature_is_rejected_and_not_stored(self):
+        response = APIClient().post(
+            '/api/payments/webhook/paystack/', self.charge(self.reference), format='json',
+            HTTP_X_PAYSTACK_SIGNATURE='forged',
+        )
+
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_failing_event_backs_off_then_dead_letters_without_blocking_the_reference(self):
+        # Unknown reference type: the processor refuses it
+        failing = record_webhook_event('paystack', self.charge('ORDER-1'))
+        behind = record_webhook_event('paystack', {'event': 'charge.dispute.create', 'data': {'reference': 'ORDER-1'}})
+
+        self.assertEqual(drain_reference('ORDER-1'), 0)
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), ('pending', 1))
+        self.assertGreater(failing.next_attempt_at, failing.received_at)
+        self.assertEqual(WebhookEvent.objects.get(pk=behind.pk).status, 'pending')
+        self.assertEqual(webhook_queue_stats()['retrying'], 1)
+
+        WebhookEvent.objects.filter(pk=failing.pk).update(next_attempt_at=failing.received_at)
+        self.assertEqual(process_due_events(), 1)
+
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), ('dead', 2))
+        self.assertEqual(WebhookEvent.objects.get(pk=behind.pk).status, 'processed')
+        self.assertEqual(webhook_queue_stats(), {'pending': 0, 'retrying': 0, 'dead': 1, 'lag_seconds': 0.0})
+
+    def test_events_for_a_reference_apply_in_arrival_order(self):
+        record_webhook_event('paystack', self.charge(self.reference))
+        record_webhook_event('paystack', {'event': 'refund.processed', 'data': {'reference': self.reference}})
+
+        self.assertEqual(drain_reference(self.reference), 2)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 5000)
+        self.assertEqual(list(WebhookEvent.objects.values_list('status', flat=True)), ['processed', 'processed'])
+
+    def test_redelivery_is_dropped_at_insert(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            first = self.post_paystack(self.charge(self.reference))
+            replay = self.post_paystack(self.charge(self.reference))
+
+        self.assertEqual((first.status_code, replay.status_code), (200, 200))
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(WebhookEvent.objects.get().status, 'processed')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 5000)
+
+    def test_redelivery_requeues_a_dead_event(self):
+        event = record_webhook_event('paystack', self.charge(self.reference))
+        WebhookEvent.objects.filter(pk=event.pk).update(status='dead', attempts=8, last_error='Database down')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertIsNone(record_webhook_event('paystack', self.charge(self.reference)))
+
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts, event.last_error), ('processed', 1, ''))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 5000)
+
+    def test_command_requeues_dead_events(self):
+        event = record_webhook_event('paystack', self.charge(self.reference))
+        WebhookEvent.objects.filter(pk=event.pk).update(status='dead', attempts=8)
+
+        out = StringIO()
+        call_command('process_webhook_events', '--requeue-dead', stdout=out)
+
+        self.assertIn('Requeued 1 dead events. Processed 1 webhook events: 0 pending', out.getvalue())
+        self.assertEqual(WebhookEvent.objects.get(pk=event.pk).status, 'processed')
+
+    def test_processed_events_expire_after_retention(self):
+        old = record_webhook_event('paystack', self.charge(self.reference))
+        drain_reference(self.reference)
+        dead = record_webhook_event('paystack', self.charge('ORDER-1'))
+        WebhookEvent.objects.filter(pk=old.pk).update(processed_at=old.received_at - timedelta(days=31))
+        WebhookEvent.objects.filter(pk=dead.pk).update(status='dead', received_at=old.received_at - timedelta(days=31))
+
+        self.assertEqual(purge_webhook_events(retention_days=30), 1)
+        self.assertEqual(list(WebhookEvent.objects.values_list('pk', flat=True)), [dead.pk])
+        # Once purged, the delivery key is free again
+        self.assertIsNotNone(record_webhook_event('paystack', self.charge(self.reference)))
+
+    def test_transfer_webhook_settles_payout(self):
+        self.user.balance = 10000
+        self.user.save(update_fields=['balance'])
+        gateway = PaystackGateway(public_key='pk', secret_key='sk_test_hook')
+        payout = enqueue_withdrawal(self.user, gateway, Money.from_naira(4000), 'WITH-1', 'RCP_1', '0123456789', '044')
+        claim_batch()
+
+        record_webhook_event('paystack', {
+            'event': 'transfer.failed', 'data': {'reference': 'WITH-1', 'transfer_code': 'TRF_1', 'reason': 'Closed'}
+        })
+        drain_reference('WITH-1')
+
+        payout.refresh_from_db()
+        self.assertEqual((payout.status, payout.transfer_code), ('failed', 'TRF_1'))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 10000)
+
+    def test_reversed_transfer_refunds_direct_withdrawal(self):
+        self.user.balance = 10000
+        self.user.save(update_fields=['balance'])
+        gateway = PaystackGateway(public_key='pk', secret_key='sk_test_hook')
+        tx = reserve_withdrawal(self.user, gateway, Money.from_naira(4000), 'WITH-1')
+        withdrawal_response(self.user, tx, {'status': True, 'data': {'transfer_code': 'TRF_1', 'status': 'success'}})
+        self.assertEqual(PaymentTransaction.objects.get(pk=tx.pk).status, 'success')
+
+        event = {'event': 'transfer.reversed', 'data': {'reference': 'WITH-1', 'transfer_code': 'TRF_1'}}
+        record_webhook_event('paystack', event)
+        drain_reference('WITH-1')
+        # A second failure report for the same transfer must not refund it again
+        record_webhook_event('paystack', {**event, 'event': 'transfer.failed'})
+        drain_reference('WITH-1')
+
+        self.assertEqual(PaymentTransaction.objects.get(pk=tx.pk).status, 'failed')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 10000)
+        self.assertEqual(LedgerEntry.objects.filter(reference='WITH-1', kind='withdrawal_reversal').count(), 2)
@@ -0,0 +1,119 @@
+"""
+HTTP plumbing shared by the payment gateways.
+
+Each gateway class owns one requests.Session per process. The session keeps
+a bounded pool of keep-alive connections, so repeated calls skip the TCP and
+TLS handshake. Sessions are rebuilt after a fork, since pooled sockets must
+not be shared between gunicorn or Celery workers.
+
+Retries are for idempotent GETs only. Each call has a retry budget: at most
+PAYMENT_GATEWAY_GET_RETRIES extra attempts, and no backoff sleep that would
+go past PAYMENT_GATEWAY_RETRY_BUDGET seconds from the first attempt. POSTs
+(initialize, transfer, ...) are never retried here; repeating one could
+charge or pay out twice.
+
+The async gateways use one httpx.AsyncClient per gateway and event loop. An
+AsyncClient's connections belong to the loop that opened them, so a client is
+never shared across loops. Under an ASGI server that means one client per
+worker process, which can keep hundreds of calls in flight at once.
+"""
+import os
+import random
+import threading
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 20
+DEFAULT_GET_RETRIES = 2
+DEFAULT_RETRY_BUDGET = 5.0
+DEFAULT_POOL_SIZE = 10
+DEFAULT_ASYNC_POOL_SIZE = 200
+BACKOFF_BASE = 0.25
+BACKOFF_CAP = 2.0
+
+# Responses worth retrying for a GET: rate limited or the gateway/proxy is struggling
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+# event loop -> {gateway name: AsyncClient}; entries go away with their loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_session(name):
+    """Return the pooled session for a gateway, creating it on first use in this process."""
+    pid = os.getpid()
+    entry = _sessions.get(name)
+    if entry is not None and entry[0] == pid:
+        return entry[1]
+
+    with _sessions_lock:
+        entry = _sessions.get(name)
+        if entry is None or entry[0] != pid:
+            pool_size = getattr(settings, 'PAYMENT_GATEWAY_POOL_SIZE', DEFAULT_POOL_SIZE)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            entry = _sessions[name] = (pid, session)
+        return entry[1]
+
+
+def close_sessions():
+    with _sessions_lock:
+        for _, session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def get_async_client(name, loop):
+    """Return the pooled AsyncClient for a gateway on the given running event loop."""
+    clients = _async_clients.get(loop)
+    if clients is None:
+        clients = _async_clients[loop] = {}
+    client = clients.get(name)
+    if client is None or client.is_closed:
+        pool_size = getattr(settings, 'PAYMENT_GATEWAY_ASYNC_POOL_SIZE', DEFAULT_ASYNC_POOL_SIZE)
+        client = clients[name] = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=getattr(settings, 'PAYMENT_GATEWAY_POOL_SIZE', DEFAULT_POOL_SIZE),
+            ),
+        )
+    return client
+
+
+async def aclose_clients(loop):
+    """Close the AsyncClients opened on `loop`, e.g. from an ASGI lifespan shutdown."""
+    for client in _async_clients.pop(loop, {}).values():
+        await client.aclose()
+
+
+def get_timeout():
+    return (
+        getattr(settings, 'PAYMENT_GATEWAY_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+        getattr(settings, 'PAYMENT_GATEWAY_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+    )
+
+
+def get_async_timeout():
+    connect, read = get_timeout()
+    return httpx.Timeout(read, connect=connect)
+
+
+def get_retry_policy():
+    """(extra GET attempts, total backoff budget in seconds)"""
+    return (
+        getattr(settings, 'PAYMENT_GATEWAY_GET_RETRIES', DEFAULT_GET_RETRIES),
+        getattr(settings, 'PAYMENT_GATEWAY_RETRY_BUDGET', DEFAULT_RETRY_BUDGET),
+    )
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
@@ -1,7 +1,17 @@
+from django.conf import settings
 from django.urls import path
 from .views import VerifyPaymentView, PaystackWebhookView, FlutterwaveWebhookView, BankListView, DepositInitializeView, WithdrawalView, FinalizeWithdrawalView
+from .cron_views import cron_process_webhooks
 from .debug_views import PaystackDebugView
 
+if settings.PAYMENTS_ASYNC_VIEWS:
+    from .async_views import (
+        AsyncVerifyPaymentView as VerifyPaymentView,
+        AsyncDepositInitializeView as DepositInitializeView,
+        AsyncWithdrawalView as WithdrawalView,
+        AsyncFinalizeWithdrawalView as FinalizeWithdrawalView,
+    )
+
 urlpatterns = [
     path('verify/', VerifyPaymentView.as_view(), name='payment_verify'),
     path('webhook/paystack/', PaystackWebhookView.as_view(), name='webhook_paystack'),
@@ -11,4 +21,5 @@ urlpatterns = [
     path('withdraw/', WithdrawalView.as_view(), name='withdraw'),
     path('withdraw/finalize/', FinalizeWithdrawalView.as_view(), name='withdraw_finalize'),
     path('debug/', PaystackDebugView.as_view(), name='paystack_debug'),
+    path('cron/process-webhooks/', cron_process_webhooks, name='cron_process_webhooks'),
 ]
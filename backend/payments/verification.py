@@ -0,0 +1,117 @@
+"""
+Single-flight payment verification.
+
+The checkout callback page, browser retries and impatient refreshes all hit
+/api/payments/verify/ for the same reference, often at the same moment.
+verify_once() makes sure they share one gateway call and one run of
+PaymentProcessor:
+
+- A reference that is already settled is answered from its
+  PaymentTransaction without contacting the gateway.
+- Otherwise the first caller takes a lock in the cache, verifies, and stores
+  the response for RESULT_TIMEOUT seconds. Concurrent callers wait for that
+  result instead of verifying themselves. If nothing arrives within
+  LOCK_WAIT seconds, they give up waiting and verify directly.
+
+Results that are not settled yet (a checkout still open, a gateway error)
+are only kept briefly, so a payment completed a moment later is picked up on
+the next refresh.
+"""
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from .cache import LOCK_TIMEOUT, LOCK_WAIT, POLL_INTERVAL
+from .models import PaymentTransaction
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+RESULT_KEY = 'payments:verify:{reference}'
+RESULT_TIMEOUT = 5
+
+
+def settled_response(reference):
+    """The verify response for a payment already credited, or None."""
+    tx = (
+        PaymentTransaction.objects.filter(reference=reference, status='success', purpose__in=['deposit', 'deal_funding'])
+        .only('purpose', 'user_id', 'deal_id').first()
+    )
+    if tx is None:
+        return None
+    if tx.purpose == 'deal_funding':
+        return Response({'status': 'verified', 'type': 'deal_payment', 'deal_id': tx.deal_id})
+    balance = User.objects.filter(pk=tx.user_id).values_list('balance', flat=True).get()
+    return Response({'status': 'verified', 'type': 'deposit', 'balance': balance})
+
+
+def _cached(reference):
+    result = cache.get(RESULT_KEY.format(reference=reference))
+    return Response(result[0], status=result[1]) if result is not None else None
+
+
+def _store(reference, response):
+    cache.set(RESULT_KEY.format(reference=reference), (response.data, response.status_code), RESULT_TIMEOUT)
+    return response
+
+
+def verify_once(reference, verify):
+    """
+    Return the verify response for `reference`, calling `verify()` (which
+    contacts the gateway and returns a Response) at most once across
+    concurrent callers.
+    """
+    response = settled_response(reference) or _cached(reference)
+    if response is not None:
+        return response
+
+    lock_key = f'{RESULT_KEY.format(reference=reference)}:lock'
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        if cache.add(lock_key, 1, LOCK_TIMEOUT):
+            try:
+                # The previous holder may have finished just before releasing
+                response = _cached(reference)
+                if response is not None:
+                    return response
+                return _store(reference, verify())
+            finally:
+                cache.delete(lock_key)
+        time.sleep(POLL_INTERVAL)
+        response = _cached(reference)
+        if response is not None:
+            return response
+
+    logger.warning(f"Gave up waiting for in-flight verification of {reference}")
+    return _store(reference, verify())
+
+
+async def averify_once(reference, verify):
+    """Async verify_once(): `verify` is a coroutine function."""
+    response = await sync_to_async(settled_response)(reference) or await sync_to_async(_cached)(reference)
+    if response is not None:
+        return response
+
+    lock_key = f'{RESULT_KEY.format(reference=reference)}:lock'
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        if await cache.aadd(lock_key, 1, LOCK_TIMEOUT):
+            try:
+                response = await sync_to_async(_cached)(reference)
+                if response is not None:
+                    return response
+                return await sync_to_async(_store)(reference, await verify())
+            finally:
+                await cache.adelete(lock_key)
+        await asyncio.sleep(POLL_INTERVAL)
+        response = await sync_to_async(_cached)(reference)
+        if response is not None:
+            return response
+
+    logger.warning(f"Gave up waiting for in-flight verification of {reference}")
+    return await sync_to_async(_store)(reference, await verify())
@@ -1,14 +1,21 @@
 from rest_framework import views, permissions, status
 from rest_framework.response import Response
-from .services import get_gateway, PaymentProcessor
-from deals.models import Deal
+from .services import GATEWAY_CLASSES, get_gateway, is_rejection, PaymentProcessor
 from .models import PaymentTransaction
+from .ledger import InsufficientFunds, gateway_account, post, user_account
+from .payouts import enqueue_withdrawal, settle_withdrawal
+from .recipients import get_transfer_recipient
+from .verification import verify_once
+from .webhooks import record_webhook_event
+from .cache import is_success
 from django.conf import settings
 from django.db import transaction
-from decimal import Decimal
+from core.money import Money
 from django.contrib.auth import get_user_model
-from core.models import PlatformSettings, Notification
+from core.models import Notification
+from core.cache import get_platform_secrets, get_platform_settings
 import logging
+import uuid
 
 logger = logging.getLogger(__name__)
 
@@ -22,104 +29,86 @@ class VerifyPaymentView(views.APIView):
         if not reference:
             return Response({'error': 'No reference provided'}, status=400)
 
-        gateway = get_gateway()
-        verification_data = gateway.verify_payment(reference)
-        
-        # Check status in verification_data
-        # Format depends on gateway, but our abstraction should standardize.
-        # But we returned raw JSON in services.py. We might need to parse.
-        
-        status_val = False
-        if 'status' in verification_data:
-             if verification_data['status'] == True or verification_data['status'] == 'success':
-                 status_val = True
-             if verification_data['status'] == 'expected_response_for_flutterwave': # Adjust logic
-                 pass
-
-        # Improve service abstraction to return standard success boolean
-        # For MVP, assume if we get data and status is success/true
-        
-        success = False
-        # Paystack: {status: True, data: {status: 'success', ...}}
-        # Flutterwave: {status: 'success', ...}
-        
-        if verification_data.get('status') == True and verification_data.get('data', {}).get('status') == 'success':
-             success = True
-        elif verification_data.get('status') == 'success':
-             success = True
-             
-        if success:
-            # Reference format: 
-            # 1. "fund-{deal.id}-{uuid}" for Deal Payments
-            # 2. "DEP-{user.id}-{uuid}" for Deposits
-            
-            try:
-                parts = reference.split('-')
-                ref_type = parts[0]
-                
-                if ref_type == 'fund':
-                    deal_id = parts[1]
-                    deal = Deal.objects.get(id=deal_id)
-                    
-                    if 'paystack' in str(gateway.BASE_URL):
-                        amount_paid = Decimal(str(verification_data.get('data', {}).get('amount', 0))) / 100
-                    else:
-                        amount_paid = Decimal(str(verification_data.get('amount', 0)))
-
-                    # Verify amount matches deal + fees
-                    settings = PlatformSettings.objects.first()
-                    breakdown = settings.calculate_fee_breakdown(deal.amount)
-                    
-                    if abs(float(amount_paid) - breakdown['total_to_pay']) > 1.0:
-                        logger.error(f"Amount mismatch for {reference}: Expected {breakdown['total_to_pay']}, got {amount_paid}")
-                        return Response({
-                            'error': f"Amount mismatch. Expected {breakdown['total_to_pay']}, got {amount_paid}",
-                        }, status=400)
-
-                    # logic delegated to processor
-                    raw_data = verification_data
-                    gateway_name = 'paystack' if 'paystack' in str(gateway.BASE_URL) else 'flutterwave'
-                    
-                    success_proc = PaymentProcessor.process_successful_payment(reference, amount_paid, gateway_name, raw_data)
-                    
-                    if success_proc:
-                         return Response({'status': 'verified', 'type': 'deal_payment', 'deal_id': deal.id})
-                    else:
-                         return Response({'status': 'error', 'message': 'Processing failed'}, status=500)
+        def verify():
+            gateway = get_gateway(payment_gateway_name(reference))
+            return verification_response(reference, gateway, gateway.verify_payment(reference))
+
+        # Duplicate calls for one reference share a single gateway call
+        return verify_once(reference, verify)
+
+def payment_gateway_name(reference):
+    """The gateway a payment was initialized with; None (the active one) if it is not recorded."""
+    return (
+        PaymentTransaction.objects.filter(reference=reference, gateway__in=GATEWAY_CLASSES)
+        .values_list('gateway', flat=True).first()
+    )
+
+def verification_response(reference, gateway, verification_data):
+    """Turn a verify_payment() result into the API response, crediting the payment on success."""
+    success = False
+    # Paystack: {status: True, data: {status: 'success', ...}}
+    # Flutterwave: {status: 'success', ...}
+    
+    if verification_data.get('status') == True and verification_data.get('data', {}).get('status') == 'success':
+         success = True
+    elif verification_data.get('status') == 'success':
+         success = True
+         
+    if success:
+        try:
+            purpose, target = PaymentProcessor.resolve_payment(reference)
+            # Paystack reports kobo in data.amount, Flutterwave naira
+            if gateway.NAME == 'paystack':
+                amount_paid = Money.from_kobo(verification_data.get('data', {}).get('amount', 0))
+            else:
+                amount_paid = Money.from_naira(verification_data.get('amount', 0))
+
+            if purpose == 'deal_funding':
+                deal = target
+
+                # Verify amount matches deal + fees (1 naira tolerance)
+                settings = get_platform_settings()
+                expected = settings.fee_breakdown(deal.amount)['total_to_pay']
                 
-                elif ref_type == 'DEP':
-                    # Amount logic
-                    # Paystack amount is in kobo in verification_data['data']['amount']
-                    if 'paystack' in str(gateway.BASE_URL):
-                         amount_paid = Decimal(verification_data.get('data', {}).get('amount', 0)) / 100
-                    else:
-                         amount_paid = Decimal(str(verification_data.get('amount', 0)))
-
-                    raw_data = verification_data
-                    gateway_name = 'paystack' if 'paystack' in str(gateway.BASE_URL) else 'flutterwave'
-                    
-                    success_proc = PaymentProcessor.process_successful_payment(reference, amount_paid, gateway_name, raw_data)
-                    
-                    if success_proc:
-                         user_id = parts[1]
-                         user = User.objects.get(id=user_id) # Reload to get new balance
-                         return Response({'status': 'verified', 'type': 'deposit', 'balance': user.balance})
-                    else:
-                         return Response({'status': 'error', 'message': 'Processing failed'}, status=500)
+                if abs(amount_paid - expected) > Money.from_naira(1):
+                    logger.error(f"Amount mismatch for {reference}: Expected {expected}, got {amount_paid}")
+                    return Response({
+                        'error': f"Amount mismatch. Expected {expected}, got {amount_paid}",
+                    }, status=400)
+
+                success_proc = PaymentProcessor.process_successful_payment(
+                    reference, amount_paid, gateway.NAME, verification_data, resolved=(purpose, target)
+                )
                 
-                return Response({'status': 'unknown_reference_type'}, status=400)
+                if success_proc:
+                     return Response({'status': 'verified', 'type': 'deal_payment', 'deal_id': deal.id})
+                else:
+                     return Response({'status': 'error', 'message': 'Processing failed'}, status=500)
+            
+            elif purpose == 'deposit':
+                success_proc = PaymentProcessor.process_successful_payment(
+                    reference, amount_paid, gateway.NAME, verification_data, resolved=(purpose, target)
+                )
                 
-            except Exception as e:
-                logger.error(f"Verification error: {e}")
-                return Response({'status': 'error', 'message': str(e)}, status=400)
-        else:
-             logger.warning(f"Verification failed for {reference}: {verification_data}")
-             msg = verification_data.get('message', 'Gateway verification failed')
-             return Response({
-                 'status': 'failed', 
-                 'error': f"Payment not confirmed: {msg}",
-                 'data': verification_data
-             }, status=400)
+                if success_proc:
+                     balance = User.objects.filter(pk=target.pk).values_list('balance', flat=True).get()
+                     return Response({'status': 'verified', 'type': 'deposit', 'balance': balance})
+                else:
+                     return Response({'status': 'error', 'message': 'Processing failed'}, status=500)
+            
+            return Response({'status': 'unknown_reference_type'}, status=400)
+            
+        except Exception as e:
+            logger.error(f"Verification error: {e}")
+            return Response({'status': 'error', 'message': str(e)}, status=400)
+    else:
+         logger.warning(f"Verification failed for {reference}: {verification_data}")
+         msg = verification_data.get('message', 'Gateway verification failed')
+         return Response({
+             'status': 'failed', 
+             'error': f"Payment not confirmed: {msg}",
+             'data': verification_data
+         }, status=400)
 
 class PaystackWebhookView(views.APIView):
     permission_classes = [permissions.AllowAny]
@@ -131,9 +120,8 @@ class PaystackWebhookView(views.APIView):
         
         # 1. Look up secret key
         secret_key = settings.PAYSTACK_SECRET_KEY
-        if not secret_key and PlatformSettings.objects.exists():
-            ps = PlatformSettings.objects.first()
-            secret_key = ps.paystack_secret_key
+        if not secret_key:
+            secret_key = get_platform_secrets()['paystack_secret_key']
         
         if not secret_key:
             logger.error("Paystack Webhook: No secret key configured")
@@ -150,16 +138,8 @@ class PaystackWebhookView(views.APIView):
             logger.warning("Paystack Webhook: Signature mismatch")
             return Response(status=400)
             
-        # 3. Process event
-        event = json.loads(request.body)
-        if event.get('event') == 'charge.success':
-            data = event.get('data', {})
-            reference = data.get('reference')
-            amount = Decimal(data.get('amount')) / 100 # Kobo to Naira
-            
-            # Using generic processor
-            PaymentProcessor.process_successful_payment(reference, amount, 'paystack', event)
-            
+        # 3. Store the event; a worker applies it (payments/webhooks.py)
+        record_webhook_event('paystack', json.loads(request.body))
         return Response(status=200)
 
 class FlutterwaveWebhookView(views.APIView):
@@ -172,22 +152,13 @@ class FlutterwaveWebhookView(views.APIView):
         
         if not secret_hash:
             # If not in settings, check PlatformSettings
-            ps = PlatformSettings.objects.first()
-            secret_hash = ps.flutterwave_secret_key # Use secret key as fallback hash if needed, or specific hash
+            secret_hash = get_platform_secrets()['flutterwave_secret_key'] # Use secret key as fallback hash if needed, or specific hash
             
         if signature != secret_hash:
             logger.warning("Flutterwave Webhook: Signature mismatch")
             return Response(status=400)
             
-        data = request.data
-        if data.get('event') == 'charge.completed':
-            tx_data = data.get('data', {})
-            reference = tx_data.get('tx_ref')
-            amount = Decimal(str(tx_data.get('amount', 0)))
-            
-            # Using generic processor
-            PaymentProcessor.process_successful_payment(reference, amount, 'flutterwave', data)
-            
+        record_webhook_event('flutterwave', request.data)
         return Response(status=200)
 
 class BankListView(views.APIView):
@@ -200,117 +171,203 @@ class BankListView(views.APIView):
             return Response(banks)
         return Response({'error': 'Active gateway does not support bank listing'}, status=400)
 
+def deposit_payment_kwargs(request):
+    """Build initialize_payment() arguments for a deposit, or return an error Response."""
+    amount = request.data.get('amount')
+    if not amount:
+        return Response({'error': 'Amount is required'}, status=400)
+
+    reference = f"DEP-{request.user.id}-{uuid.uuid4().hex[:8]}"
+    # Callback URL should point to frontend dashboard
+    callback_url = request.data.get('callback_url', f"{settings.FRONTEND_URL}/dashboard?verify_deposit=true")
+    return {
+        'amount': amount,
+        'email': request.user.email,
+        'reference': reference,
+        'callback_url': callback_url,
+        'metadata': {'user_id': request.user.id, 'type': 'deposit'},
+    }
+
+def record_initialized_deposit(user, gateway, payment, init_data):
+    """Store the pending deposit once the gateway has accepted it."""
+    if is_success(init_data):
+        PaymentProcessor.record_initialized_payment(payment['reference'], 'deposit', payment['amount'], gateway.NAME, user)
+
 class DepositInitializeView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
-        amount = request.data.get('amount')
-        if not amount:
-            return Response({'error': 'Amount is required'}, status=400)
-            
-        import uuid
-        reference = f"DEP-{request.user.id}-{uuid.uuid4().hex[:8]}"
-        gateway = get_gateway()
-        
-        # Callback URL should point to frontend dashboard
-        callback_url = request.data.get('callback_url', f"{settings.FRONTEND_URL}/dashboard?verify_deposit=true")
-        
-        init_data = gateway.initialize_payment(
-            amount=amount,
-            email=request.user.email,
+        payment = deposit_payment_kwargs(request)
+        if isinstance(payment, Response):
+            return payment
+
+        gateway = get_gateway(failover=True)
+        init_data = gateway.initialize_payment(**payment)
+        record_initialized_deposit(request.user, gateway, payment, init_data)
+        return Response(init_data)
+
+def validate_withdrawal(request):
+    """Check a withdrawal request; returns (amount, bank_code, account_number) or an error Response."""
+    amount = request.data.get('amount')
+    bank_code = request.data.get('bank_code')
+    account_number = request.data.get('account_number')
+
+    if not all([amount, bank_code, account_number]):
+        return Response({'error': 'Amount, bank code, and account number are required'}, status=400)
+
+    try:
+        amount = Money.from_naira(amount)
+    except (ArithmeticError, ValueError, TypeError):
+        return Response({'error': 'Invalid amount'}, status=400)
+
+    if amount.kobo <= 0:
+        return Response({'error': 'Invalid amount'}, status=400)
+
+    if Money.from_naira(request.user.balance) < amount:
+        return Response({'error': 'Insufficient balance'}, status=400)
+
+    # KYC Check
+    if request.user.kyc_status not in ['basic', 'full']:
+         return Response({'error': 'Identity verification required for withdrawals. Please verify your account.'}, status=403)
+
+    return amount, bank_code, account_number
+
+def withdrawal_reference(user):
+    return f"WITH-{user.id}-{uuid.uuid4().hex[:8]}"
+
+def reserve_withdrawal(user, gateway, amount, reference):
+    """
+    Debit `amount` and record the pending withdrawal before any money is
+    sent. Returns the PaymentTransaction, or None if the balance no longer
+    covers it.
+    """
+    with transaction.atomic():
+        try:
+            post('withdrawal', [(user_account(user), -amount), (gateway_account(gateway.NAME), amount)], reference)
+        except InsufficientFunds:
+            return None
+
+        return PaymentTransaction.objects.create(
+            user=user,
+            gateway=gateway.NAME,
             reference=reference,
-            callback_url=callback_url,
-            metadata={'user_id': request.user.id, 'type': 'deposit'}
+            amount_paid=amount.to_decimal(),
+            transaction_type='withdrawal',
+            status='pending',
         )
-        
-        return Response(init_data)
+
+def withdrawal_response(user, tx, transfer_res):
+    """
+    Record the gateway's answer to a reserved withdrawal. The wallet is
+    refunded only if the gateway definitely refused the transfer; when the
+    outcome is unknown the withdrawal stays pending until a webhook or
+    reconcile_withdrawals() settles it.
+    """
+    amount = Money.from_naira(tx.amount_paid)
+    if is_rejection(transfer_res):
+        logger.error(f"Transfer initiation failed for {user.id}: {transfer_res}")
+        settle_withdrawal(tx, 'failed', transfer_res, notify=False)
+        return Response({'error': f"Transfer failed: {transfer_res.get('message')}"}, status=400)
+    if not transfer_res.get('status'):
+        logger.warning(f"Transfer outcome unknown for {user.id}, reference {tx.reference}: {transfer_res}")
+        PaymentTransaction.objects.filter(pk=tx.pk, status='pending').update(raw_response=transfer_res)
+        user.refresh_from_db(fields=['balance'])
+        return Response({
+            'status': 'pending',
+            'message': 'Withdrawal is being confirmed with the bank',
+            'new_balance': user.balance,
+            'reference': tx.reference,
+        }, status=202)
+
+    transfer_code = transfer_res.get('data', {}).get('transfer_code')
+    gateway_reference = transfer_res.get('data', {}).get('id')
+    requires_otp = transfer_res.get('data', {}).get('status') == 'otp'
+
+    logger.info(f"Withdrawal initiated for user {user.id}: {amount}. Reference: {tx.reference}, Requires OTP: {requires_otp}")
+
+    PaymentTransaction.objects.filter(pk=tx.pk).update(
+        status='pending' if requires_otp else 'success',
+        transfer_code=transfer_code or '',
+        gateway_reference=str(gateway_reference or ''),
+        raw_response=transfer_res,
+    )
+    user.refresh_from_db(fields=['balance'])
+
+    return Response({
+        'status': 'success',
+        'message': 'Withdrawal initiated successfully',
+        'new_balance': user.balance,
+        'transfer_code': transfer_code,
+        'requires_otp': requires_otp
+    })
+
+def queued_withdrawal_response(user, gateway, amount, reference, recipient_code, account_number, bank_code):
+    payout = enqueue_withdrawal(user, gateway, amount, reference, recipient_code, account_number, bank_code)
+    if payout is None:
+        return Response({'error': 'Insufficient balance'}, status=400)
+
+    logger.info(f"Withdrawal queued for user {user.id}: {amount}. Reference: {reference}")
+    return Response({
+        'status': 'success',
+        'message': 'Withdrawal queued for payout',
+        'new_balance': user.balance,
+        'reference': reference,
+        'transfer_code': None,
+        'requires_otp': False,
+        'queued': True,
+    })
 
 class WithdrawalView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
-        amount = request.data.get('amount')
-        bank_code = request.data.get('bank_code')
-        account_number = request.data.get('account_number')
-        
-        if not all([amount, bank_code, account_number]):
-            return Response({'error': 'Amount, bank code, and account number are required'}, status=400)
-            
-        try:
-            amount = Decimal(amount)
-        except:
-            return Response({'error': 'Invalid amount'}, status=400)
+        withdrawal = validate_withdrawal(request)
+        if isinstance(withdrawal, Response):
+            return withdrawal
+        amount, bank_code, account_number = withdrawal
 
-        if request.user.balance < amount:
-            return Response({'error': 'Insufficient balance'}, status=400)
-
-        # KYC Check
-        if request.user.kyc_status not in ['basic', 'full']:
-             return Response({'error': 'Identity verification required for withdrawals. Please verify your account.'}, status=403)
-            
         gateway = get_gateway()
         if not hasattr(gateway, 'transfer'):
             return Response({'error': 'Active gateway does not support transfers'}, status=400)
-            
-        # 1. Resolve Account
-        resolve_res = gateway.resolve_bank_account(account_number, bank_code)
-        if not resolve_res.get('status'):
-            return Response({'error': f"Could not verify account: {resolve_res.get('message')}"}, status=400)
-            
-        account_name = resolve_res.get('data', {}).get('account_name')
-        
-        # 2. Create Transfer Recipient
-        recipient_res = gateway.create_transfer_recipient(account_name, account_number, bank_code)
-        if not recipient_res.get('status'):
-            return Response({'error': f"Could not create recipient: {recipient_res.get('message')}"}, status=400)
-            
-        recipient_code = recipient_res.get('data', {}).get('recipient_code')
-        
-        # 3. Initiate Transfer
-        import uuid
-        reference = f"WITH-{request.user.id}-{uuid.uuid4().hex[:8]}"
+
+        # 1. Resolve the account and create a transfer recipient, unless one is registered already
+        recipient_code, error = get_transfer_recipient(gateway, request.user, account_number, bank_code)
+        if error:
+            return Response({'error': error}, status=400)
+
+        # 2. Initiate Transfer, or queue it for the next bulk payout run
+        reference = withdrawal_reference(request.user)
+        if settings.PAYOUTS_BATCHED:
+            return queued_withdrawal_response(
+                request.user, gateway, amount, reference, recipient_code, account_number, bank_code
+            )
+        # Debit first, so a balance that no longer covers the amount never reaches the gateway
+        tx = reserve_withdrawal(request.user, gateway, amount, reference)
+        if tx is None:
+            return Response({'error': 'Insufficient balance'}, status=400)
         transfer_res = gateway.transfer(amount, recipient_code, reference)
-        
-        if transfer_res.get('status'):
-            # Deduct balance atomically
-            transfer_code = transfer_res.get('data', {}).get('transfer_code')
-            requires_otp = transfer_res.get('data', {}).get('status') == 'otp'
-            
-            logger.info(f"Withdrawal initiated for user {request.user.id}: {amount}. Reference: {reference}, Requires OTP: {requires_otp}")
-            
-            try:
-                with transaction.atomic():
-                    user = request.user
-                    if user.balance < amount:
-                         return Response({'error': 'Insufficient balance'}, status=400)
-
-                    user.balance -= amount
-                    user.save()
-                    
-                    # Record Transaction
-                    PaymentTransaction.objects.create(
-                        user=user,
-                        gateway='paystack',
-                        reference=reference,
-                        amount_paid=amount,
-                        transaction_type='withdrawal',
-                        status='pending' if requires_otp else 'success',
-                        raw_response=transfer_res
-                    )
-            except Exception as e:
-                logger.error(f"Error recording withdrawal for {request.user.id}: {e}")
-                return Response({'error': 'Transaction recorded but error updating balance'}, status=500)
-            
-            return Response({
-                'status': 'success', 
-                'message': 'Withdrawal initiated successfully', 
-                'new_balance': user.balance,
-                'transfer_code': transfer_code,
-                'requires_otp': requires_otp
-            })
-        else:
-            logger.error(f"Transfer initiation failed for {request.user.id}: {transfer_res}")
-            return Response({'error': f"Transfer failed: {transfer_res.get('message')}"}, status=400)
+        return withdrawal_response(request.user, tx, transfer_res)
+
+def finalize_withdrawal_response(user, transfer_code, res):
+    """Mark the pending withdrawal for `transfer_code` successful once the gateway accepted the OTP."""
+    if not res.get('status'):
+        logger.error(f"Finalization failed for transfer {transfer_code}: {res}")
+        return Response({'error': f"Finalization failed: {res.get('message')}"}, status=400)
+
+    # Update transaction status
+    try:
+        tx = PaymentTransaction.objects.select_related('user').filter(
+            transfer_code=transfer_code, status='pending'
+        ).first()
+        # Conditional update: a repeated finalize must not send a second email
+        if tx and PaymentTransaction.objects.filter(pk=tx.pk, status='pending').update(status='success'):
+            # Send Email
+            from core.emails import EmailService
+            EmailService.send_payout_email(tx.user, tx.amount_paid, tx.reference)
+    except Exception as e:
+        logger.error(f"Error updating transaction status for transfer {transfer_code}: {e}")
+
+    return Response({'status': 'success', 'message': 'Transfer finalized successfully'})
 
 class FinalizeWithdrawalView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -325,25 +382,4 @@ class FinalizeWithdrawalView(views.APIView):
         gateway = get_gateway()
         logger.info(f"Finalizing transfer {transfer_code} with OTP for user {request.user.id}")
         res = gateway.finalize_transfer(transfer_code, otp)
-        
-        if res.get('status'):
-            # Update transaction status
-            try:
-                # We don't have the transfer_code in the DB yet, we have the 'reference'.
-                # But transfer_code is in the raw_response of the pending transaction.
-                # Actually, Paystack's finalize returns the transfer object.
-                tx = PaymentTransaction.objects.filter(raw_response__contains=transfer_code, status='pending').first()
-                if tx:
-                    tx.status = 'success'
-                    tx.save()
-                    
-                    # Send Email
-                    from core.emails import EmailService
-                    EmailService.send_payout_email(tx.user, tx.amount_paid, tx.reference)
-            except Exception as e:
-                logger.error(f"Error updating transaction status for transfer {transfer_code}: {e}")
-
-            return Response({'status': 'success', 'message': 'Transfer finalized successfully'})
-        else:
-            logger.error(f"Finalization failed for transfer {transfer_code}: {res}")
-            return Response({'error': f"Finalization failed: {res.get('message')}"}, status=400)
+        return finalize_withdrawal_response(request.user, transfer_code, res)
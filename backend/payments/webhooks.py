@@ -0,0 +1,323 @@
+"""
+Ack-first webhook processing.
+
+The webhook views only check the signature, store the event as a
+WebhookEvent and return 200. The slow part runs on a Celery worker: row
+locks, balance updates, notifications and emails. record_webhook_event()
+schedules a drain of the event's reference once the row is committed. The
+process_webhook_events task sweeps up anything a lost or failed task left
+behind.
+
+Without CELERY_BROKER_URL, settings.py turns on CELERY_TASK_ALWAYS_EAGER
+and delay() would run the drain inside the webhook request. In that mode the
+drain is held back until the response has been sent (request_finished) and
+runs in the web process. There is no beat either, so retries and anything
+left behind are swept by the CRON_SECRET-protected
+/api/payments/cron/process-webhooks/ endpoint (see render.yaml) or the
+process_webhook_events management command.
+
+Events for one reference are handled in the order they arrived. A drain
+holds a per-reference lock in the cache and stops at the first event that
+has not succeeded yet. An event that fails is retried with exponential
+backoff. After WEBHOOK_MAX_ATTEMPTS it is dead-lettered (status 'dead') for
+an admin to look at, and the events queued behind it go ahead.
+
+Gateways redeliver the same event many times. Events are unique per
+(gateway, reference, event type), and record_webhook_event() inserts with
+ON CONFLICT DO NOTHING, so a redelivery costs one index probe: no row
+locks and no processing. The exception is a redelivery of a dead event,
+which requeues it: the gateway is retrying, and whatever made the event
+fail may have been fixed since. requeue_events() does the same for the
+admin's "Retry" action and `process_webhook_events --requeue-dead`. Processed events are kept for
+WEBHOOK_RETENTION_DAYS so replays within that window are caught, then
+purge_webhook_events() deletes them.
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from core.money import Money
+from .models import PaymentTransaction, Payout, WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+DRAIN_LOCK_KEY = 'payments:webhooks:drain:{reference}'
+DRAIN_LOCK_TIMEOUT = 5 * 60
+DEFAULT_MAX_ATTEMPTS = 8
+DEFAULT_RETRY_BASE_DELAY = 30
+MAX_RETRY_DELAY = 6 * 60 * 60
+SWEEP_LIMIT = 500
+DEFAULT_RETENTION_DAYS = 30
+
+
+def get_max_attempts():
+    return getattr(settings, 'WEBHOOK_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+
+
+def retry_delay(attempts):
+    base = getattr(settings, 'WEBHOOK_RETRY_BASE_DELAY', DEFAULT_RETRY_BASE_DELAY)
+    return timedelta(seconds=min(MAX_RETRY_DELAY, base * 2 ** (attempts - 1)))
+
+
+def event_reference(gateway, payload):
+    data = payload.get('data') or {}
+    if gateway == 'flutterwave':
+        reference = data.get('tx_ref') or data.get('reference')
+    else:
+        reference = data.get('reference')
+    return str(reference or data.get('id') or '')[:100]
+
+
+def record_webhook_event(gateway, payload):
+    """
+    Store a verified webhook and schedule its processing. Returns the event,
+    or None if it is a redelivery of one already stored.
+    """
+    event = WebhookEvent(
+        gateway=gateway,
+        event_type=str(payload.get('event') or '')[:64],
+        reference=event_reference(gateway, payload),
+        payload=payload,
+    )
+    if not _insert_new(event):
+        dead = WebhookEvent.objects.filter(
+            gateway=gateway, reference=event.reference, event_type=event.event_type, status='dead'
+        )
+        if requeue_events(dead):
+            logger.info(f"Redelivered {gateway} {event.event_type} webhook for {event.reference} requeued a dead event")
+        else:
+            logger.info(f"Ignoring redelivered {gateway} {event.event_type} webhook for {event.reference}")
+        return None
+    transaction.on_commit(lambda: _schedule_drain(event.reference))
+    return event
+
+
+def requeue_events(events):
+    """
+    Reset the unprocessed events in the `events` queryset to a fresh pending
+    state and schedule their drains. Returns how many were requeued.
+    """
+    events = events.exclude(status='processed')
+    references = set(events.values_list('reference', flat=True))
+    if not references:
+        return 0
+    requeued = events.update(status='pending', attempts=0, next_attempt_at=timezone.now(), last_error='')
+    for reference in references:
+        transaction.on_commit(lambda reference=reference: _schedule_drain(reference))
+    return requeued
+
+
+def _insert_new(event):
+    """
+    INSERT ... ON CONFLICT DO NOTHING (PostgreSQL and SQLite). Sets the pk and
+    returns True if the row went in, False if the delivery key already exists.
+    """
+    meta = WebhookEvent._meta
+    fields = [field for field in meta.concrete_fields if not field.primary_key]
+    qn = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({}) ON CONFLICT DO NOTHING RETURNING {}'.format(
+        qn(meta.db_table),
+        ', '.join(qn(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+        qn(meta.pk.column),
+    )
+    params = [field.get_db_prep_save(field.pre_save(event, add=True), connection) for field in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    if row is None:
+        return False
+    event.pk = row[0]
+    event._state.adding = False
+    return True
+
+
+# References to drain once the current request's response is sent (eager mode)
+_after_response = threading.local()
+
+
+def _start_request(**kwargs):
+    _after_response.references = []
+
+
+def _finish_request(**kwargs):
+    references = getattr(_after_response, 'references', None)
+    _after_response.references = None
+    if not references:
+        return
+    try:
+        for reference in dict.fromkeys(references):
+            drain_reference(reference)
+    except Exception as e:
+        # The events stay pending for the sweep
+        logger.error(f"Webhook drain after response failed: {e}")
+    finally:
+        # Django's own handler already ran; don't leave this connection open
+        if not connection.in_atomic_block:
+            close_old_connections()
+
+
+request_started.connect(_start_request, dispatch_uid='payments.webhooks.start_request')
+request_finished.connect(_finish_request, dispatch_uid='payments.webhooks.finish_request')
+
+
+def _schedule_drain(reference):
+    from .tasks import drain_webhook_reference
+
+    if getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False):
+        # delay() would process the event before the webhook is acknowledged
+        references = getattr(_after_response, 'references', None)
+        if references is None:
+            # Not serving a request (shell, command, task): nothing to wait for
+            drain_reference(reference)
+        else:
+            references.append(reference)
+        return
+    try:
+        drain_webhook_reference.delay(reference)
+    except Exception as e:
+        # The event is stored; the sweeper will pick it up
+        logger.error(f"Could not queue webhook drain for {reference}: {e}")
+
+
+def _paystack_charge(event):
+    from .services import PaymentProcessor
+
+    data = event.payload.get('data') or {}
+    return PaymentProcessor.process_successful_payment(
+        event.reference, Money.from_kobo(data.get('amount')), 'paystack', event.payload
+    )
+
+
+def _flutterwave_charge(event):
+    from .services import PaymentProcessor
+
+    data = event.payload.get('data') or {}
+    return PaymentProcessor.process_successful_payment(
+        event.reference, Money.from_naira(data.get('amount', 0)), 'flutterwave', event.payload
+    )
+
+
+def _paystack_transfer(event):
+    from .payouts import settle_payout, settle_withdrawal
+
+    data = event.payload.get('data') or {}
+    gateway_status = event.event_type.split('.', 1)[1]
+    payout = Payout.objects.filter(reference=event.reference, status='processing').select_related('freelancer').first()
+    if payout:
+        settle_payout(payout, gateway_status, data.get('transfer_code') or '', data.get('reason') or '')
+        return True
+    # A withdrawal sent straight from the request, without a Payout row
+    tx = PaymentTransaction.objects.filter(
+        reference=event.reference, transaction_type='withdrawal', payout__isnull=True
+    ).first()
+    if tx:
+        settle_withdrawal(tx, gateway_status, event.payload)
+    return True
+
+
+# (gateway, event type) -> handler returning True once the event has been applied
+HANDLERS = {
+    ('paystack', 'charge.success'): _paystack_charge,
+    ('paystack', 'transfer.success'): _paystack_transfer,
+    ('paystack', 'transfer.failed'): _paystack_transfer,
+    ('paystack', 'transfer.reversed'): _paystack_transfer,
+    ('flutterwave', 'charge.completed'): _flutterwave_charge,
+}
+
+
+def process_event(event):
+    """Apply one event and record the outcome. Returns True if it succeeded."""
+    handler = HANDLERS.get((event.gateway, event.event_type))
+    error = ''
+    try:
+        ok = handler is None or handler(event)
+        if not ok:
+            error = 'Handler reported failure'
+    except Exception as e:
+        logger.exception(f"Webhook event {event.pk} ({event.event_type} {event.reference}) failed")
+        ok, error = False, str(e)
+
+    now = timezone.now()
+    event.attempts += 1
+    if ok:
+        event.status, event.processed_at, event.last_error = 'processed', now, ''
+    elif event.attempts >= get_max_attempts():
+        logger.error(f"Webhook event {event.pk} dead-lettered after {event.attempts} attempts: {error}")
+        event.status, event.last_error = 'dead', error
+    else:
+        event.next_attempt_at, event.last_error = now + retry_delay(event.attempts), error
+    event.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at', 'processed_at'])
+    return ok
+
+
+def _drain_locked(reference):
+    processed = 0
+    now = timezone.now()
+    for event in WebhookEvent.objects.filter(reference=reference, status='pending').order_by('id'):
+        # Later events for this reference wait behind one that is backing off
+        if event.next_attempt_at > now or not process_event(event):
+            break
+        processed += 1
+    return processed
+
+
+def _head_is_due(reference):
+    head = WebhookEvent.objects.filter(reference=reference, status='pending').order_by('id').first()
+    return head is not None and head.next_attempt_at <= timezone.now()
+
+
+def drain_reference(reference):
+    """
+    Process pending events for `reference` in arrival order. Returns how many
+    succeeded. A no-op if another worker is already draining the reference.
+    """
+    lock_key = DRAIN_LOCK_KEY.format(reference=reference)
+    processed = 0
+    while cache.add(lock_key, 1, DRAIN_LOCK_TIMEOUT):
+        try:
+            processed += _drain_locked(reference)
+        finally:
+            cache.delete(lock_key)
+        # An event stored while we held the lock had its own drain turned away
+        if not _head_is_due(reference):
+            break
+    return processed
+
+
+def process_due_events(limit=SWEEP_LIMIT):
+    """Drain every reference with a pending event that is due. Returns how many events succeeded."""
+    references = (
+        WebhookEvent.objects.filter(status='pending', next_attempt_at__lte=timezone.now())
+        .values('reference').annotate(first=Min('id')).order_by('first')
+        .values_list('reference', flat=True)[:limit]
+    )
+    return sum(drain_reference(reference) for reference in list(references))
+
+
+def webhook_queue_stats():
+    """Queue depth and lag for monitoring."""
+    stats = WebhookEvent.objects.aggregate(
+        pending=Count('id', filter=Q(status='pending')),
+        retrying=Count('id', filter=Q(status='pending', attempts__gt=0)),
+        dead=Count('id', filter=Q(status='dead')),
+        oldest_pending=Min('received_at', filter=Q(status='pending')),
+    )
+    oldest = stats.pop('oldest_pending')
+    stats['lag_seconds'] = round((timezone.now() - oldest).total_seconds(), 1) if oldest else 0.0
+    return stats
+
+
+def purge_webhook_events(retention_days=None):
+    """Delete processed events older than the retention period. Returns how many went."""
+    days = retention_days or getattr(settings, 'WEBHOOK_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = WebhookEvent.objects.filter(status='processed', processed_at__lt=cutoff).delete()
+    return deleted
@@ -72,7 +72,7 @@ function DashboardContent() {
         const fetchData = async () => {
             try {
                 await fetchUser()
-                const dealsRes = await api.get("/deals/")
+                const dealsRes = await api.get("/deals/", { params: { expand: "client,freelancer" } })
                 setDeals(dealsRes.data.results || dealsRes.data)
             } catch (err) { } finally {
                 setLoading(false)
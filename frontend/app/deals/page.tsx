@@ -34,7 +34,7 @@ function MyDealsContent() {
             try {
                 const [userRes, dealsRes] = await Promise.all([
                     api.get("/auth/me/"),
-                    api.get("/deals/")
+                    api.get("/deals/", { params: { expand: "client,description" } })
                 ])
                 setUser(userRes.data)
                 setDeals(dealsRes.data.results || dealsRes.data)
@@ -91,6 +91,11 @@ export function WithdrawModal({ open, onOpenChange, balance, onSuccess }: Withdr
                     if (onSuccess) onSuccess()
                     resetForm()
                 }
+            } else if (res.data.status === 'pending') {
+                toast.info(res.data.message || "Withdrawal is being confirmed")
+                onOpenChange(false)
+                if (onSuccess) onSuccess()
+                resetForm()
             } else {
                 toast.error(res.data.error || "Withdrawal failed")
             }